@@ -0,0 +1,938 @@
+"""
+Benchmarks for srt.py
+
+python bench.py [options] [benchmark ...]
+
+with no arguments, runs every benchmark
+
+the suite benchmark times the main parse, transform and serialize
+paths and their peak memory on a synthetic document, and can save
+its results as a baseline and compare later runs against it:
+
+python bench.py suite --save baseline.json
+python bench.py suite --compare baseline.json
+
+see python bench.py --help for the options
+"""
+
+import gc
+import json
+import multiprocessing
+import optparse
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from StringIO import StringIO
+
+from srt import Timecode, parse_srt, parse_timecode_line, TIMECODE_SEP, _timecode_caches
+from srt import CompactSRTDocument, SRTDocument, SRTFrame, run_batch, write_srt
+from srt import MappedSRTFile, parse, write_bin, write_sjson
+from srt import SRTStreamParser, follow_feeds, TimeMap, parse_sjson, DocumentCache, EditList
+from srt import iter_merged, iter_sorted, SubtitleIndex, parse_srt_bytes
+import srt
+
+
+def synthetic_srt(cue_count, line_length=None, overlap_ratio=0.0, seed=0):
+    """
+    returns the text of an srt file with cue_count cues, one every 2s
+
+    with a line_length, each cue gets one or two lines of random
+    words up to that long. overlap_ratio is the fraction of cues
+    that run on past the start of the next one
+    """
+    rand = random.Random(seed)
+    out = []
+    for index in range(cue_count):
+        start = Timecode(index * 2000)
+        if rand.random() < overlap_ratio:
+            end = Timecode(index * 2000 + 2500)
+        else:
+            end = Timecode(index * 2000 + 1500)
+        if line_length is None:
+            text = "line number %d\nsecond line" % index
+        else:
+            text = '\n'.join(random_line(rand, line_length) for _ in range(rand.randint(1, 2)))
+        out.append("%d\n%s --> %s\n%s\n\n" % (index + 1, start, end, text))
+    return ''.join(out)
+
+
+def random_line(rand, line_length):
+    """
+    random lowercase words, at most line_length long
+    """
+    words = []
+    length = -1
+    while True:
+        word = ''.join(rand.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rand.randint(1, 8)))
+        if length + 1 + len(word) > line_length:
+            return ' '.join(words) or word[:line_length]
+        words.append(word)
+        length += 1 + len(word)
+
+
+def timed(function, *args):
+    """
+    returns the best wall time of three runs of function(*args)
+    """
+    best = None
+    for _ in range(3):
+        before = time.time()
+        function(*args)
+        elapsed = time.time() - before
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def bench_load():
+    """
+    parse_srt load time against cue count.
+    the per cue time should stay flat
+    """
+    for cue_count in (2500, 5000, 10000, 20000):
+        text = synthetic_srt(cue_count)
+        elapsed = timed(lambda: parse_srt(StringIO(text)))
+        print "parse_srt %6d cues: %8.3fs  %6.2fus/cue" % (cue_count, elapsed, elapsed / cue_count * 1e6)
+
+
+def bench_timecode():
+    """
+    parsing timecode lines: the old split + from_string against
+    parse_timecode_line, with a cold and a warm cache
+    """
+    lines = [
+        "%s --> %s" % (Timecode(index * 2000), Timecode(index * 2000 + 1500))
+        for index in range(20000)
+    ]
+    
+    def uncached():
+        for line in lines:
+            [Timecode(Timecode._parse_milliseconds(tc)) for tc in TIMECODE_SEP.split(line)]
+    
+    def cold():
+        _timecode_caches.cache.clear()
+        for line in lines:
+            parse_timecode_line(line)
+    
+    def warm():
+        for line in lines[:2000]:
+            parse_timecode_line(line)
+    
+    loose = [line.replace(',', '.').replace(' --> ', '->') for line in lines]
+    def fallback():
+        _timecode_caches.cache.clear()
+        for line in loose:
+            parse_timecode_line(line)
+    
+    for name, function, count in [
+            ('split + from_string', uncached, len(lines)),
+            ('parse_timecode_line (cold cache)', cold, len(lines)),
+            ('parse_timecode_line (warm cache)', warm, 2000),
+            ('parse_timecode_line (loose form)', fallback, len(lines)),
+    ]:
+        elapsed = timed(function)
+        print "%-34s %6.2fus/line" % (name, elapsed / count * 1e6)
+
+
+def live_objects(function):
+    """
+    returns (result, number of new gc tracked objects) of function()
+    """
+    gc.collect()
+    before = len(gc.get_objects())
+    result = function()
+    gc.collect()
+    return result, len(gc.get_objects()) - before
+
+
+def bench_compact():
+    """
+    resident (gc tracked) objects of a 50k cue SRTDocument against CompactSRTDocument
+    """
+    text = synthetic_srt(50000)
+    doc, doc_objects = live_objects(lambda: parse_srt(StringIO(text)))
+    compact, compact_objects = live_objects(lambda: CompactSRTDocument.from_document(doc))
+    print "SRTDocument:        %7d objects" % doc_objects
+    print "CompactSRTDocument: %7d objects" % compact_objects
+    for name, function in [
+            ('split', lambda d: d.split(Timecode(50000 * 1000))),
+            ('shift', lambda d: d.shift(1000)),
+            ('json', lambda d: d.json()),
+    ]:
+        print "%-6s SRTDocument %7.3fs  CompactSRTDocument %7.3fs" % (
+            name, timed(function, doc), timed(function, compact))
+
+
+def deep_size(frame):
+    """
+    bytes held by a frame, its timecodes and its lines container
+    """
+    size = 0
+    for obj in (frame, frame.start, frame.end, frame.lines):
+        size += sys.getsizeof(obj)
+        if hasattr(obj, '__dict__'):
+            size += sys.getsizeof(obj.__dict__)
+    return size
+
+
+def bench_frames():
+    """
+    SRTFrame construction time and size, and document copying
+    """
+    count = 100000
+    def build():
+        return [SRTFrame(Timecode(index * 2000), Timecode(index * 2000 + 1500), ['line'])
+                for index in xrange(count)]
+    
+    elapsed = timed(build)
+    frames, objects = live_objects(build)
+    print "build %d frames: %7.3fs  %d gc objects  %d bytes/frame" % (
+        count, elapsed, objects, sum(deep_size(frame) for frame in frames) / count)
+    
+    doc = SRTDocument.from_frames(frames)
+    print "SRTDocument(frames):  %7.3fs" % timed(SRTDocument, frames)
+    print "doc.shift(1000):      %7.3fs" % timed(doc.shift, 1000)
+    print "doc.split(middle):    %7.3fs" % timed(doc.split, Timecode(count * 1000))
+
+
+def bench_query():
+    """
+    frame_at and frames_between on a 100k cue document
+    """
+    count = 100000
+    doc = SRTDocument.from_frames(
+        SRTFrame(Timecode(index * 2000), Timecode(index * 2000 + 1500), ['line'])
+        for index in xrange(count))
+    doc.frame_at(0) # build the index
+    times = range(0, count * 2000, count * 2000 / 10000)
+    
+    def linear():
+        for time in times[:100]:
+            [frame for frame in doc.frames if frame.start.milliseconds() <= time < frame.end.milliseconds()]
+    
+    def frame_at():
+        for time in times:
+            doc.frame_at(time)
+    
+    def frames_between():
+        for time in times:
+            doc.frames_between(time, time + 10000)
+    
+    print "linear scan:     %8.2fus/query" % (timed(linear) / 100 * 1e6)
+    print "frame_at:        %8.2fus/query" % (timed(frame_at) / len(times) * 1e6)
+    print "frames_between:  %8.2fus/query" % (timed(frames_between) / len(times) * 1e6)
+
+
+def bench_overlap():
+    """
+    queries on a 50k cue document where every cue lasts 10s
+    and a new one starts every 100ms, so ~100 are on screen at once
+    """
+    count = 50000
+    doc = SRTDocument.from_frames(
+        SRTFrame(Timecode(index * 100), Timecode(index * 100 + 10000), ['line'])
+        for index in xrange(count))
+    doc.frames_active_at(0) # build the index
+    times = range(0, count * 100, count * 100 / 2000)
+    
+    def linear():
+        for time in times[:20]:
+            [frame for frame in doc.frames if frame.start.milliseconds() <= time < frame.end.milliseconds()]
+    
+    def active_at():
+        for time in times:
+            doc.frames_active_at(time)
+    
+    def split():
+        for time in times[:20]:
+            doc.split(Timecode(time))
+    
+    print "linear scan:       %8.2fus/query" % (timed(linear) / 20 * 1e6)
+    print "frames_active_at:  %8.2fus/query (~100 results)" % (timed(active_at) / len(times) * 1e6)
+    print "split:             %8.2fus/split" % (timed(split) / 20 * 1e6)
+
+
+def bench_split():
+    """
+    cutting a 100k cue document into k pieces:
+    split in a loop (what the split command used to do)
+    against split_many
+    """
+    count = 100000
+    doc = SRTDocument.from_frames(
+        SRTFrame(Timecode(index * 2000), Timecode(index * 2000 + 1500), ['line'])
+        for index in xrange(count))
+    
+    for pieces in (10, 100, 500):
+        cuts = [Timecode(count * 2000 / pieces * index + 700) for index in range(1, pieces)]
+        
+        def loop():
+            current = doc
+            out = []
+            for time in cuts:
+                left, current = current.split(time)
+                out.append(left.normalize())
+            out.append(current.normalize())
+        
+        def sweep():
+            for piece in doc.split_many(cuts, normalize=True):
+                pass
+        
+        print "%3d pieces: split loop %7.3fs  split_many %7.3fs" % (pieces, timed(loop), timed(sweep))
+
+
+def bench_cat():
+    """
+    chaining 1000 documents of 100 cues each:
+    folding add against SRTDocument.concatenate
+    """
+    segment = SRTDocument.from_frames(
+        SRTFrame(Timecode(index * 2000), Timecode(index * 2000 + 1500), ['line'])
+        for index in xrange(100))
+    documents = [segment] * 1000
+    
+    def fold():
+        result = SRTDocument()
+        for doc in documents:
+            result = result.add(doc.shift(result.frames[-1].end.milliseconds()) if result.frames else doc)
+    
+    print "add in a loop:  %7.3fs" % timed(fold)
+    print "concatenate:    %7.3fs" % timed(SRTDocument.concatenate, documents)
+
+
+def bench_cache():
+    """
+    loading one of 20 files of 20k cues, 200 times, mostly the
+    same few: plain parse against DocumentCache in memory (by stat
+    and by content) and from its .sbin store
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        paths = []
+        text = synthetic_srt(20000)
+        for index in range(20):
+            path = os.path.join(directory, '%d.srt' % index)
+            with open(path, 'w') as handle:
+                handle.write(text.replace('second line', 'file %d' % index))
+            paths.append(path)
+        rand = random.Random(20)
+        # a few popular files, a long tail
+        requests = [paths[min(int(rand.expovariate(0.5)), 19)] for _ in range(200)]
+        
+        def run(load):
+            before = time.time()
+            for path in requests:
+                load(path)
+            return time.time() - before
+        
+        print "parse:                      %7.3fs" % run(parse)
+        for name, cache in [
+                ('DocumentCache, stat key', DocumentCache(max_bytes=8 * 1024 * 1024)),
+                ('DocumentCache, content key', DocumentCache(max_bytes=8 * 1024 * 1024, key='content')),
+                ('DocumentCache, store only', DocumentCache(max_bytes=0, store_directory=os.path.join(directory, 'store'))),
+        ]:
+            elapsed = run(cache.parse)
+            stats = cache.stats()
+            print "%-27s %7.3fs  %3d hits %3d misses %3d store hits %3d evictions" % (
+                name + ':', elapsed, stats['hits'], stats['misses'], stats['store_hits'], stats['evictions'])
+    finally:
+        shutil.rmtree(directory)
+
+
+def bench_server():
+    """
+    delete on a 20k cue file, 20 times: the one-shot
+    command line against srt_client.py and a running server
+    """
+    directory = tempfile.mkdtemp()
+    server = None
+    try:
+        path = os.path.join(directory, 'a.srt')
+        with open(path, 'w') as handle:
+            handle.write(synthetic_srt(20000))
+        address = os.path.join(directory, 'srt.sock')
+        here = os.path.dirname(os.path.abspath(__file__))
+        
+        def run(arguments):
+            before = time.time()
+            for _ in range(20):
+                with open(os.devnull, 'w') as devnull:
+                    subprocess.check_call([sys.executable] + arguments, stdout=devnull)
+            return (time.time() - before) / 20
+        
+        delete = ['delete', path, '00:01:00,000', '00:02:00,000']
+        server = subprocess.Popen([sys.executable, os.path.join(here, 'srt.py'), 'serve', address],
+                                  stderr=subprocess.PIPE)
+        server.stderr.readline() # serving on ...
+        
+        print "python srt.py delete:         %7.1fms" % (run([os.path.join(here, 'srt.py')] + delete) * 1000)
+        print "python srt_client.py delete:  %7.1fms" % (run([os.path.join(here, 'srt_client.py'), '--server', address] + delete) * 1000)
+        print "python -c pass:               %7.1fms" % (run(['-c', 'pass']) * 1000)
+        
+        def in_process():
+            stdout = sys.stdout
+            sys.stdout = NullWriter()
+            try:
+                srt.command_delete(delete[1:])
+            finally:
+                sys.stdout = stdout
+        with DocumentCache() as cache:
+            in_process()
+            print "the delete itself (cached):   %7.1fms" % (timed(in_process) * 1000)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        shutil.rmtree(directory)
+
+
+def bench_index():
+    """
+    a full text index of 5000 files of 50 cues: build time, an
+    update with nothing changed, and query latency for a word, a
+    three word phrase and a prefix
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        paths = []
+        for index in range(5000):
+            path = os.path.join(directory, '%d.srt' % index)
+            with open(path, 'w') as handle:
+                handle.write(synthetic_srt(50, line_length=40, seed=index))
+            paths.append(path)
+        
+        index_path = os.path.join(directory, 'index.db')
+        with SubtitleIndex(index_path) as index:
+            before = time.time()
+            index.update(paths)
+            print "build, %d workers:    %7.3fs" % (multiprocessing.cpu_count(), time.time() - before)
+            before = time.time()
+            index.update(paths)
+            print "update, no changes:   %7.3fs" % (time.time() - before)
+            print "index size:           %7.1fMB" % (os.path.getsize(index_path) / 1e6)
+            
+            # queries taken from the corpus, so they all have hits
+            rand = random.Random(24)
+            texts = [index.search(word)[0].text for word in ('ab', 'cd', 'ef', 'gh', 'ij')]
+            phrases = []
+            for text in texts:
+                words = text.split()
+                start = rand.randint(0, max(len(words) - 3, 0))
+                phrases.append(' '.join(words[start:start + 3]))
+            
+            for name, queries, prefix in [
+                    ('one word', [phrase.split()[0] for phrase in phrases], False),
+                    ('three word phrase', phrases, False),
+                    ('prefix', [phrase.split()[0][:3] for phrase in phrases], True),
+            ]:
+                def run():
+                    hits = 0
+                    for query in queries:
+                        hits += len(index.search(query, prefix, limit=100))
+                    return hits
+                elapsed = timed(run)
+                print "%-20s  %8.1fus/query  %5.1f hits/query" % (
+                    name + ':', elapsed / len(queries) * 1e6, float(run()) / len(queries))
+    finally:
+        shutil.rmtree(directory)
+
+
+def bench_batch():
+    """
+    srt2sjson over 400 files of 200 cues: one process per file
+    against the batch command with 1, 4 and one-per-CPU workers
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        text = synthetic_srt(200)
+        paths = []
+        for index in range(400):
+            path = os.path.join(directory, '%d.srt' % index)
+            with open(path, 'w') as handle:
+                handle.write(text)
+            paths.append(path)
+        
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'srt.py')
+        before = time.time()
+        for path in paths[:40]:
+            with open(os.devnull, 'w') as devnull:
+                subprocess.check_call([sys.executable, script, 'srt2sjson', path], stdout=devnull)
+        print "one process per file: %7.1f files/s" % (40 / (time.time() - before))
+        
+        for workers in sorted(set([1, 4, multiprocessing.cpu_count()])):
+            before = time.time()
+            for path, error in run_batch('srt2sjson', paths, workers=workers, chunksize=8, overwrite=True):
+                assert error is None, error
+            print "batch, %2d workers:    %7.1f files/s" % (workers, len(paths) / (time.time() - before))
+    finally:
+        shutil.rmtree(directory)
+
+
+class NullWriter(object):
+    def write(self, data):
+        pass
+
+
+def bench_delete():
+    """
+    what the delete command does to a 100k cue document
+    (split, split, add, shift), on SRTDocument and on a lazy view,
+    then writing the result out
+    """
+    count = 100000
+    doc = SRTDocument.from_frames(
+        SRTFrame(Timecode(index * 2000), Timecode(index * 2000 + 1500), ['line'])
+        for index in xrange(count))
+    doc._time_index() # built once per parse either way
+    
+    def delete(source):
+        left, right = source.split(Timecode(count * 500 + 700))
+        gone, right = right.split(Timecode(count * 1000 + 700))
+        return left.add(right).shift(-100)
+    
+    print "SRTDocument: edit %7.3fs  write %7.3fs" % (
+        timed(delete, doc), timed(lambda: write_srt(delete(doc).frames, NullWriter())))
+    print "view:        edit %7.3fs  write %7.3fs" % (
+        timed(delete, doc.view()), timed(lambda: write_srt(delete(doc.view()), NullWriter())))
+    print "write only:             write %7.3fs" % timed(lambda: write_srt(doc.frames, NullWriter()))
+
+
+def bench_edit():
+    """
+    removing 200 ad breaks from a 100k cue document:
+    200 deletes in a row (split, split, add, shift on a view,
+    as the delete command does) against one EditList
+    """
+    count = 100000
+    doc = SRTDocument.from_frames(
+        SRTFrame(Timecode(index * 2000), Timecode(index * 2000 + 1500), ['line'])
+        for index in xrange(count))
+    doc._time_index()
+    breaks = [(index * 1000000 + 700, index * 1000000 + 30700) for index in range(1, 201)]
+    
+    def one_by_one():
+        result = doc.view()
+        # from the last one, so the earlier times don't move
+        for start, end in reversed(breaks):
+            left, right = result.split(Timecode(start))
+            gone, right = right.split(Timecode(end))
+            result = left.add(right)
+        return result.to_document()
+    
+    def edit_list():
+        edits = EditList()
+        for start, end in breaks:
+            edits.delete(start, end)
+        return edits.apply(doc)
+    
+    print "200 deletes:    %7.3fs" % timed(one_by_one)
+    print "one EditList:   %7.3fs" % timed(edit_list)
+
+
+def bench_merge():
+    """
+    merging 3 sorted tracks of 100k cues: concatenate and sort
+    against iter_merged, then sorting 300k shuffled cues in memory
+    against runs of 50k (with the peak memory of each)
+    """
+    tracks = [
+        [SRTFrame(Timecode(index * 2000 + track * 300), Timecode(index * 2000 + track * 300 + 1500), ['line'])
+         for index in xrange(100000)]
+        for track in range(3)
+    ]
+    print "concatenate + sort:  %7.3fs" % timed(
+        lambda: SRTDocument.from_frames(tracks[0] + tracks[1] + tracks[2]))
+    print "iter_merged:         %7.3fs" % timed(
+        lambda: SRTDocument.from_frames(iter_merged(*tracks), presorted=True))
+    
+    def shuffled(count):
+        rand = random.Random(count)
+        for _ in xrange(count):
+            start = rand.randint(0, count * 2000)
+            yield SRTFrame(Timecode(start), Timecode(start + 1500), ['line number %d' % start])
+    
+    def drain(frames):
+        for frame in frames:
+            pass
+    
+    for name, max_frames in [('in memory', 10 ** 9), ('runs of 50k', 50000)]:
+        result = measure(None, lambda text: None,
+                         lambda argument: drain(iter_sorted(shuffled(300000), max_frames)), 1)
+        print "iter_sorted, %-12s %7.3fs  peak +%7d kB" % (name + ':', result['seconds'], result['peak_kb'])
+
+
+def bench_mapped():
+    """
+    five minutes of cues out of a 200k cue file:
+    full parse + split against MappedSRTFile, with and without
+    its sidecar index
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'big.srt')
+        with open(path, 'w') as handle:
+            handle.write(synthetic_srt(200000))
+        start, end = Timecode(3600 * 1000), Timecode(3900 * 1000)
+        
+        def full():
+            return parse(path).split(start)[1].split(end)[0]
+        
+        def cold():
+            if os.path.exists(path + '.idx'):
+                os.remove(path + '.idx')
+            with MappedSRTFile(path) as mapped:
+                return mapped.slice(start, end)
+        
+        def warm():
+            with MappedSRTFile(path) as mapped:
+                return mapped.slice(start, end)
+        
+        print "parse + split:                  %7.3fs" % timed(full)
+        print "MappedSRTFile, building index:  %7.3fs" % timed(cold)
+        print "MappedSRTFile, reusing index:   %7.3fs" % timed(warm)
+    finally:
+        shutil.rmtree(directory)
+
+
+def bench_formats():
+    """
+    loading a 200k cue document from .srt, .sjson and .sbin
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        doc = parse_srt(StringIO(synthetic_srt(200000)))
+        paths = []
+        for extension, writer in [('srt', write_srt), ('sjson', write_sjson), ('sbin', write_bin)]:
+            path = os.path.join(directory, 'big.' + extension)
+            with open(path, 'wb') as handle:
+                writer(doc.frames, handle)
+            paths.append(path)
+        del doc
+        
+        for path in paths:
+            print "%-6s %9d bytes  load %7.3fs" % (
+                os.path.splitext(path)[1], os.path.getsize(path), timed(parse, path))
+    finally:
+        shutil.rmtree(directory)
+
+
+def bench_sjson():
+    """
+    loading and writing a 200k cue .sjson: the frame by frame
+    loader against the column loader, indented against compact output
+    """
+    doc = parse_srt(StringIO(synthetic_srt(200000)))
+    indented = doc.json()
+    compact = doc.json(compact=True)
+    
+    def frame_by_frame():
+        # what parse_sjson used to do
+        data = json.loads(indented)
+        frames = []
+        for index in range(len(data['start'])):
+            frames.append(SRTFrame(Timecode(data['start'][index]), Timecode(data['end'][index]),
+                                   data['text'][index].split('\n')))
+        return SRTDocument.from_frames(frames)
+    
+    print "decoder: %s" % srt.sjson_decoder.__name__
+    print "sizes: indented %d bytes, compact %d bytes (%.0f%%)" % (
+        len(indented), len(compact), 100.0 * len(compact) / len(indented))
+    print "frame by frame load:        %7.3fs" % timed(frame_by_frame)
+    print "parse_sjson:                %7.3fs" % timed(lambda: parse_sjson(StringIO(indented)))
+    print "parse_sjson(compact=True):  %7.3fs" % timed(lambda: parse_sjson(StringIO(indented), compact=True))
+    print "write indented:             %7.3fs" % timed(lambda: write_sjson(doc.frames, NullWriter()))
+    print "write compact:              %7.3fs" % timed(lambda: write_sjson(doc.frames, NullWriter(), True))
+
+
+def bench_stream():
+    """
+    a 20k cue file fed to SRTStreamParser in network sized chunks
+    against parse_srt, and 200 feeds followed at once over pipes
+    """
+    text = synthetic_srt(20000)
+    
+    def chunks():
+        parser = SRTStreamParser()
+        for position in xrange(0, len(text), 1400):
+            parser.feed(text[position:position + 1400])
+        parser.close()
+    
+    print "parse_srt:                %7.3fs" % timed(lambda: parse_srt(StringIO(text)))
+    print "SRTStreamParser, 1400B:   %7.3fs" % timed(chunks)
+    
+    feed_text = synthetic_srt(500)
+    pipes = [os.pipe() for _ in range(200)]
+    before = time.time()
+    if os.fork() == 0:
+        # the writer: round robin over every feed
+        for read_fd, write_fd in pipes:
+            os.close(read_fd)
+        for position in xrange(0, len(feed_text), 1400):
+            for read_fd, write_fd in pipes:
+                os.write(write_fd, feed_text[position:position + 1400])
+        os._exit(0)
+    
+    readers = []
+    for read_fd, write_fd in pipes:
+        os.close(write_fd)
+        readers.append(os.fdopen(read_fd, 'rb'))
+    frames = []
+    follow_feeds(readers, lambda handle, frame: frames.append(frame))
+    os.wait()
+    elapsed = time.time() - before
+    print "follow_feeds, 200 feeds:  %7.3fs  %d frames  %6.2fus/frame" % (
+        elapsed, len(frames), elapsed / len(frames) * 1e6)
+
+
+def bench_bytes():
+    """
+    parse_srt against parse_srt_bytes on a 200k cue file,
+    and parse_srt_bytes on the same cues with CRLF line ends,
+    a BOM, in cp1252 and in utf-16
+    """
+    text = synthetic_srt(200000)
+    crlf = text.replace('\n', '\r\n')
+    
+    print "%.1fMB" % (len(text) / 1e6)
+    print "%-29s %7.3fs" % ('parse_srt:', timed(lambda: parse_srt(StringIO(text))))
+    print "%-29s %7.3fs" % ('parse_srt_bytes:', timed(lambda: parse_srt_bytes(StringIO(text))))
+    for name, data in [('CRLF', crlf),
+                       ('BOM + CRLF', '\xef\xbb\xbf' + crlf),
+                       ('cp1252', text.replace('e', '\xe9')),
+                       ('utf-16', text.decode('utf-8').encode('utf-16'))]:
+        print "%-29s %7.3fs" % ('parse_srt_bytes, %s:' % name, timed(lambda: parse_srt_bytes(StringIO(data))))
+
+
+def parse_srt_text(text):
+    return parse_srt(StringIO(text))
+
+
+def parse_srt_bytes_text(text):
+    return parse_srt_bytes(StringIO(text))
+
+
+def split_in_half(doc):
+    return doc.split(doc.frames[len(doc.frames) / 2].start + Timecode(700))
+
+
+def bench_retime():
+    """
+    retiming a 200k cue document: frame by frame shift against
+    TimeMaps on SRTDocument and CompactSRTDocument
+    """
+    count = 200000
+    doc = SRTDocument.from_frames(
+        SRTFrame(Timecode(index * 2000), Timecode(index * 2000 + 1500), ['line'])
+        for index in xrange(count))
+    compact = CompactSRTDocument.from_document(doc)
+    fps = TimeMap.framerate(23.976, 25)
+    drift = TimeMap.piecewise([(0, 0), (count * 1000, count * 1000 + 500), (count * 2000, count * 2000 + 2000)])
+    
+    print "numpy: %s" % ('yes' if srt.numpy is not None else 'no, plain python')
+    print "SRTDocument.shift:               %7.3fs" % timed(doc.shift, 1000)
+    print "SRTDocument.retime(shift):       %7.3fs" % timed(doc.retime, TimeMap.shift(1000))
+    print "CompactSRTDocument.shift:        %7.3fs" % timed(compact.shift, 1000)
+    print "CompactSRTDocument.retime(fps):  %7.3fs" % timed(compact.retime, fps)
+    print "CompactSRTDocument.retime(fps, piecewise): %7.3fs" % timed(compact.retime, fps, drift)
+
+
+# name, what to build from the synthetic text before timing, the operation
+SUITE = [
+    ('parse_srt', lambda text: text, parse_srt_text),
+    ('parse_srt_bytes', lambda text: text, parse_srt_bytes_text),
+    ('split', parse_srt_text, split_in_half),
+    ('add', lambda text: split_in_half(parse_srt_text(text)), lambda (left, right): left.add(right)),
+    ('shift', parse_srt_text, lambda doc: doc.shift(1000)),
+    ('str', parse_srt_text, str),
+    ('json', parse_srt_text, lambda doc: doc.json()),
+]
+
+
+def max_rss_kb():
+    """
+    this process' peak resident size so far, in kB
+    (ru_maxrss is kB on Linux, bytes on OS X)
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak /= 1024
+    return peak
+
+
+def best_time(operation, argument, repeat):
+    """
+    the best per call time of operation(argument) over repeat
+    rounds, each one long enough (0.1s) to not be timer noise
+    """
+    number = 1
+    while True:
+        before = time.time()
+        for _ in xrange(number):
+            operation(argument)
+        if time.time() - before >= 0.1:
+            break
+        number *= 2
+    
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        before = time.time()
+        for _ in xrange(number):
+            operation(argument)
+        elapsed = (time.time() - before) / number
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def measure(text, setup, operation, repeat):
+    """
+    runs operation(setup(text)) in a forked child, so every operation
+    starts from the same heap, and returns its best time
+    and how far the first run pushed the child's peak resident size
+    """
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(read_fd)
+            argument = setup(text)
+            gc.collect()
+            before = max_rss_kb()
+            result = operation(argument)
+            peak_kb = max_rss_kb() - before
+            del result
+            seconds = best_time(operation, argument, repeat)
+            os.write(write_fd, json.dumps({'seconds': seconds, 'peak_kb': peak_kb}))
+        finally:
+            os._exit(0)
+    
+    os.close(write_fd)
+    with os.fdopen(read_fd) as reader:
+        data = reader.read()
+    os.waitpid(pid, 0)
+    if not data:
+        raise RuntimeError("benchmark child died")
+    return json.loads(data)
+
+
+def compare(results, baseline, tolerance):
+    """
+    prints results against a saved baseline,
+    returns the names of the operations more than
+    tolerance (a fraction) slower or bigger
+    """
+    if baseline.get('config') != results['config']:
+        print "warning: baseline was run with %s" % baseline.get('config')
+    
+    regressions = []
+    for name, result in sorted(results['operations'].items()):
+        old = baseline['operations'].get(name)
+        if old is None:
+            print "%-15s not in the baseline" % name
+            continue
+        
+        time_ratio = result['seconds'] / old['seconds'] if old['seconds'] else 1.0
+        memory_ratio = float(result['peak_kb']) / old['peak_kb'] if old['peak_kb'] else 1.0
+        slower = time_ratio > 1 + tolerance or memory_ratio > 1 + tolerance
+        if slower:
+            regressions.append(name)
+        print "%-15s time x%5.2f  memory x%5.2f%s" % (
+            name, time_ratio, memory_ratio, '  REGRESSION' if slower else '')
+    return regressions
+
+
+def bench_suite(options):
+    """
+    time and peak memory of parse, split, add, shift, str and json
+    on a synthetic document, optionally saved or compared
+    against a baseline
+    """
+    config = {
+        'cues': options.cues,
+        'line_length': options.line_length,
+        'overlap': options.overlap,
+    }
+    text = synthetic_srt(options.cues, options.line_length, options.overlap)
+    
+    results = {'config': config, 'operations': {}}
+    print "%d cues, lines up to %d chars, %.0f%% overlapping, %d bytes" % (
+        options.cues, options.line_length, options.overlap * 100, len(text))
+    for name, setup, operation in SUITE:
+        result = measure(text, setup, operation, options.repeat)
+        results['operations'][name] = result
+        print "%-15s %9.4fs  peak +%8d kB" % (name, result['seconds'], result['peak_kb'])
+    
+    if options.save:
+        with open(options.save, 'w') as handle:
+            json.dump(results, handle, indent=4, sort_keys=True)
+        print "saved to %s" % options.save
+    
+    if options.compare:
+        with open(options.compare) as handle:
+            baseline = json.load(handle)
+        regressions = compare(results, baseline, options.tolerance)
+        if regressions:
+            raise SystemExit("regressions: %s" % ', '.join(regressions))
+
+
+benchmarks = [
+    ('load', bench_load),
+    ('timecode', bench_timecode),
+    ('compact', bench_compact),
+    ('frames', bench_frames),
+    ('query', bench_query),
+    ('overlap', bench_overlap),
+    ('split', bench_split),
+    ('cat', bench_cat),
+    ('delete', bench_delete),
+    ('edit', bench_edit),
+    ('merge', bench_merge),
+    ('mapped', bench_mapped),
+    ('formats', bench_formats),
+    ('sjson', bench_sjson),
+    ('stream', bench_stream),
+    ('bytes', bench_bytes),
+    ('retime', bench_retime),
+    ('cache', bench_cache),
+    ('server', bench_server),
+    ('index', bench_index),
+    ('batch', bench_batch),
+    ('suite', bench_suite),
+]
+
+
+def option_parser():
+    parser = optparse.OptionParser(usage="python bench.py [options] [benchmark ...]")
+    parser.add_option('--cues', type='int', default=50000,
+                      help="suite: cues in the synthetic document [%default]")
+    parser.add_option('--line-length', type='int', default=42,
+                      help="suite: longest line of text [%default]")
+    parser.add_option('--overlap', type='float', default=0.1,
+                      help="suite: fraction of overlapping cues [%default]")
+    parser.add_option('--save', metavar='FILE',
+                      help="suite: save the results as a baseline")
+    parser.add_option('--compare', metavar='FILE',
+                      help="suite: compare against a saved baseline, exit 1 on regressions")
+    parser.add_option('--repeat', type='int', default=5,
+                      help="suite: timing rounds, the best one counts [%default]")
+    parser.add_option('--tolerance', type='float', default=0.15,
+                      help="suite: allowed slowdown before a regression [%default]")
+    return parser
+
+
+if __name__ == '__main__':
+    options, selected = option_parser().parse_args()
+    selected = selected or [name for name, function in benchmarks]
+    for name, function in benchmarks:
+        if name in selected:
+            print "== %s" % name
+            if function is bench_suite:
+                function(options)
+            else:
+                function()
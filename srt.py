@@ -14,12 +14,309 @@
 # Email:    louis.a.sobel@gmail.com
 #################################################
 
+import codecs
+import errno
 import functools
+import gc
+import glob
+import hashlib
+import heapq
+import marshal
+import mmap
+import multiprocessing
+import os
 import re
+import select
+import struct
+import time
+from array import array
+from collections import namedtuple
+from bisect import bisect_left, bisect_right
 from sys import argv
-from itertools import count
+from itertools import chain, count, imap, islice, izip
 import sys
 import json
+import shutil
+import stat
+import SocketServer
+import socket
+import sqlite3
+import tempfile
+import threading
+from cStringIO import StringIO
+from math import floor
+
+# sjson loads with the fastest json decoder installed
+try:
+    import ujson as sjson_decoder
+except ImportError:
+    try:
+        import simplejson as sjson_decoder
+    except ImportError:
+        sjson_decoder = json
+
+try:
+    import numpy
+except ImportError:
+    # retiming falls back to plain python
+    numpy = None
+
+
+#################################################
+# instrumentation
+#################################################
+
+class Stats(object):
+    """
+    Records where a run spends its time: wall time and net new
+    (gc tracked) objects per phase, plus counters like cues read
+
+    the library reports its phases (parse, edit, write...) to the
+    active Stats of its thread, if there is one:
+
+    with Stats() as stats:
+        doc = parse('in.srt')
+        write_srt(doc.frames, out)
+    print stats.json()
+
+    counting objects walks the whole heap at each phase boundary,
+    pass count_objects=False to skip it
+    """
+    
+    def __init__(self, count_objects=True):
+        self.count_objects = count_objects
+        # (name, seconds, objects), in the order the phases ended
+        self.phases = []
+        self.counters = {}
+        self._previous = None
+    
+    def __enter__(self):
+        self._previous = _active.stats
+        _active.stats = self
+        return self
+    
+    def __exit__(self, *exc_info):
+        _active.stats = self._previous
+        self._previous = None
+    
+    def _objects(self):
+        if self.count_objects:
+            return len(gc.get_objects())
+        return 0
+    
+    def phase(self, name):
+        """
+        a context manager recording its block as phase name
+        """
+        return _Phase(self, name)
+    
+    def add(self, counter, value=1):
+        self.counters[counter] = self.counters.get(counter, 0) + value
+    
+    def totals(self):
+        """
+        {phase name: [seconds, objects, times entered]}
+        """
+        totals = {}
+        for name, seconds, objects in self.phases:
+            total = totals.setdefault(name, [0.0, 0, 0])
+            total[0] += seconds
+            total[1] += objects
+            total[2] += 1
+        return totals
+    
+    def as_dict(self):
+        return {
+            'phases': [
+                {'name': name, 'seconds': seconds, 'objects': objects}
+                for name, seconds, objects in self.phases
+            ],
+            'totals': dict(
+                (name, {'seconds': seconds, 'objects': objects, 'count': entered})
+                for name, (seconds, objects, entered) in self.totals().items()
+            ),
+            'counters': self.counters,
+        }
+    
+    def json(self):
+        return json.dumps(self.as_dict(), indent=4, sort_keys=True)
+
+
+class _Phase(object):
+    
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+    
+    def __enter__(self):
+        self.objects = self.stats._objects()
+        self.started = time.time()
+        return self
+    
+    def __exit__(self, *exc_info):
+        seconds = time.time() - self.started
+        self.stats.phases.append((self.name, seconds, self.stats._objects() - self.objects))
+
+
+class _NoPhase(object):
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        pass
+
+_no_phase = _NoPhase()
+
+
+class _ActiveStats(threading.local):
+    """
+    the Stats each thread is recording to, so concurrent
+    server requests don't count into each other's
+    """
+    stats = None
+
+_active = _ActiveStats()
+
+
+def phase(name):
+    """
+    times the with block as phase name of the active Stats,
+    does nothing when there is none
+    """
+    stats = _active.stats
+    if stats is None:
+        return _no_phase
+    return _Phase(stats, name)
+
+
+def add_count(counter, value=1):
+    """
+    adds value to a counter of the active Stats, if any
+    """
+    stats = _active.stats
+    if stats is not None:
+        stats.add(counter, value)
+
+
+def instrumented(phase_name):
+    """
+    a decorator recording every call of the function
+    as phase phase_name of the active Stats
+    """
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            stats = _active.stats
+            if stats is None:
+                return function(*args, **kwargs)
+            with _Phase(stats, phase_name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+class LRUCache(object):
+    """
+    A bounded mapping that forgets the least recently used key
+    once it holds more than maxsize of them
+
+    entries live in a circular doubly linked list,
+    [prev, next, key, value], with the most recent just before the root.
+    even get changes the list, so threads sharing one need a lock
+    """
+    
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._map = {}
+        self._root = root = []
+        root[:] = [root, root, None, None]
+    
+    def __len__(self):
+        return len(self._map)
+    
+    def __contains__(self, key):
+        return key in self._map
+    
+    def get(self, key, default=None):
+        link = self._map.get(key)
+        if link is None:
+            return default
+        # unlink, and move to the most recent end
+        link_prev, link_next = link[0], link[1]
+        link_prev[1] = link_next
+        link_next[0] = link_prev
+        root = self._root
+        last = root[0]
+        last[1] = root[0] = link
+        link[0] = last
+        link[1] = root
+        return link[3]
+    
+    def __setitem__(self, key, value):
+        link = self._map.get(key)
+        if link is not None:
+            self.get(key)
+            link[3] = value
+            return
+        
+        root = self._root
+        last = root[0]
+        link = [last, root, key, value]
+        last[1] = root[0] = self._map[key] = link
+        if len(self._map) > self.maxsize:
+            self.pop_oldest()
+    
+    def pop_oldest(self):
+        """
+        removes the least recently used entry and returns (key, value)
+        """
+        root = self._root
+        oldest = root[1]
+        if oldest is root:
+            raise KeyError("pop_oldest on an empty LRUCache")
+        root[1] = oldest[1]
+        oldest[1][0] = root
+        del self._map[oldest[2]]
+        return oldest[2], oldest[3]
+    
+    def clear(self):
+        self._map.clear()
+        root = self._root
+        root[:] = [root, root, None, None]
+
+
+TIMECODE_RE     = re.compile('(?:(?:(?:(\d?\d):)?(\d?\d):)?(\d?\d))?(?:[,.](\d?\d?\d))?')
+# NOTE the above regex matches all following cases
+# 12:34:56,789
+# 01:02:03,004
+# 1:2:3,4   => 01:02:03,004
+# ,4        => 00:00:00,004
+# 3         => 00:00:03,000
+# 3,4       => 00:00:03,004
+# 1:2       => 00:01:02,000
+# 1:2,3     => 00:01:03,003
+# 1:2:3     => 01:02:03
+# also accept "." instead of "," as millsecond separator
+
+TIMECODE_SEP    = re.compile('[ \->]*')
+
+class _TimecodeCaches(threading.local):
+    """
+    timecode string => milliseconds, a plain LRUCache per thread
+    so the server's threads never share one (and need no lock).
+    cues usually start where the previous one ended,
+    so about half the timestamps in a file are repeats
+    """
+    
+    def __init__(self):
+        self.cache = LRUCache(4096)
+
+_timecode_caches = _TimecodeCaches()
+
+# the immutable classes below block __setattr__,
+# so their constructors set slots through object's
+_set_slot = object.__setattr__
 
 @functools.total_ordering
 class Timecode(object):
@@ -27,45 +324,54 @@ class Timecode(object):
     Wrapper over a time code
     Includes comparisons,
     and ways for it to convert to and from a string
+
+    Timecodes are immutable, so they can be shared freely
     """
     
+    __slots__ = ('_milliseconds',)
+    
     @classmethod
     def from_string(cls, tc):
         """
         Parses the timecode and creates a Timecode isntance
         with the milliseconds stored internally
         """
+        cache = _timecode_caches.cache
+        ms = cache.get(tc)
+        if ms is None:
+            ms = cache[tc] = cls._parse_milliseconds(tc)
+        return cls(ms)
+    
+    @staticmethod
+    def _parse_milliseconds(tc):
+        """
+        the flexible grammar: see TIMECODE_RE
+        """
         sign    = 1
         if tc[0] in "+-":
             sign    = -1 if tc[0] == "-" else 1
             tc  = tc[1:]
 
-        TIMECODE_RE     = re.compile('(?:(?:(?:(\d?\d):)?(\d?\d):)?(\d?\d))?(?:[,.](\d?\d?\d))?')
-        # NOTE the above regex matches all following cases
-        # 12:34:56,789
-        # 01:02:03,004
-        # 1:2:3,4   => 01:02:03,004
-        # ,4        => 00:00:00,004
-        # 3         => 00:00:03,000
-        # 3,4       => 00:00:03,004
-        # 1:2       => 00:01:02,000
-        # 1:2,3     => 00:01:03,003
-        # 1:2:3     => 01:02:03
-        # also accept "." instead of "," as millsecond separator
         match   = TIMECODE_RE.match(tc)
         
         if match is None:
             raise ValueError("Bad input string to timecode")
         
         hh,mm,ss,ms = map(lambda x: 0 if x==None else int(x), match.groups())
-        return cls(((hh*3600 + mm*60 + ss) * 1000 + ms) * sign)
+        return ((hh*3600 + mm*60 + ss) * 1000 + ms) * sign
      
     def __init__(self, ms):
         '''
         Construct a Timecode object from string representation or milliseconds
         '''
 
-        self._milliseconds = ms   
+        _set_slot(self, '_milliseconds', ms)
+    
+    def __setattr__(self, name, value):
+        raise AttributeError("Timecode is immutable")
+    
+    def __reduce__(self):
+        return (Timecode, (self._milliseconds,))
     
     def copy(self):
         return Timecode(self.milliseconds())
@@ -88,10 +394,18 @@ class Timecode(object):
         return TIMECODE_FORMAT % (sign, hh, mm, ss, ms) 
 
     def __eq__(self, other):
+        if not isinstance(other, Timecode):
+            return NotImplemented
         return self.milliseconds() == other.milliseconds()
+    
+    def __ne__(self, other):
+        return not self == other
         
     def __lt__(self, other):
         return self.milliseconds() < other.milliseconds()
+    
+    def __hash__(self):
+        return hash(self._milliseconds)
         
     def __sub__(self, other):
         return Timecode(self.milliseconds() - other.milliseconds())
@@ -99,23 +413,227 @@ class Timecode(object):
     def __add__(self, other):
         return Timecode(self.milliseconds() + other.milliseconds())
 
+def _to_milliseconds(time):
+    """
+    time is a Timecode or a number of milliseconds
+    """
+    if isinstance(time, Timecode):
+        return time.milliseconds()
+    return time
+
+
+def _running_max(values):
+    """
+    returns the list of the running maximum of values
+    """
+    out = []
+    current = None
+    for value in values:
+        if current is None or value > current:
+            current = value
+        out.append(current)
+    return out
+
+
+def _running_sum(values):
+    """
+    the running totals of an iterable of numbers
+    """
+    total = 0
+    out = []
+    for value in values:
+        total += value
+        out.append(total)
+    return out
+
+
+def _plan_cuts(starts, ends, max_ends, cuts):
+    """
+    plans cutting a document at each of cuts (increasing),
+    all in milliseconds. starts and ends are the cue times,
+    max_ends is the running maximum of ends
+
+    yields, for each of the len(cuts) + 1 segments, a list of parts.
+    each part is either (lo, hi), the whole cues lo:hi,
+    or (index, start, end), a piece of cue index with new times.
+    index is None for the blank cue that fills a gap at a cut
+
+    the cues are swept once: each cut only looks at the cues
+    that start before it and might still be on screen
+    """
+    n = len(starts)
+    pending = [] # pieces carried over from the previous cut
+    position = 0 # cues[position:] are not cut yet
+    previous = None
+    for time in cuts:
+        if pending:
+            first_start = previous
+        elif position < n:
+            first_start = starts[position]
+        else:
+            first_start = None
+        
+        if first_start is None or time <= first_start:
+            yield []
+            continue
+        
+        # cues position:j all end before time: they go left whole.
+        # cues k: start at or after it: they are the next remainder.
+        # the rest go left whole, or get cut if they straddle time
+        # (cues can overlap, so there can be several)
+        k = bisect_left(starts, time, position)
+        j = min(max(bisect_left(max_ends, time), position), k)
+        
+        left = []
+        right = []
+        reaches = False
+        for index, start, end in pending:
+            if end > time:
+                left.append((index, start, time))
+                right.append((index, time, end))
+            else:
+                left.append((index, start, end))
+            reaches = reaches or end >= time
+        
+        if j > position:
+            left.append((position, j))
+        for index in xrange(j, k):
+            end = ends[index]
+            if end > time:
+                left.append((index, starts[index], time))
+                right.append((index, time, end))
+            else:
+                left.append((index, index + 1))
+            reaches = reaches or end >= time
+        
+        if not reaches and k < n:
+            # time is in a gap between cues:
+            # like SRTFrame.split, fill it with a blank cue
+            # up to the next one
+            left.append((None, time, starts[k]))
+        
+        yield left
+        pending = right
+        position = k
+        previous = time
+    
+    last = list(pending)
+    if position < n:
+        last.append((position, n))
+    yield last
+
+
+class IntervalIndex(object):
+    """
+    A static index over intervals [start, end),
+    given as two sequences of milliseconds sorted by start
+
+    a binary tree over the intervals holds the maximum end
+    of each subtree, so queries skip every subtree that is
+    over before the query range begins
+    """
+    
+    def __init__(self, starts, ends):
+        self.starts = starts
+        size = 1
+        while size < len(starts):
+            size *= 2
+        tree = [float('-inf')] * (2 * size)
+        tree[size:size + len(ends)] = ends
+        for node in xrange(size - 1, 0, -1):
+            tree[node] = max(tree[2 * node], tree[2 * node + 1])
+        self._size = size
+        self._tree = tree
+    
+    def overlapping(self, lo, hi):
+        """
+        returns the indexes, in order, of the intervals
+        that intersect [lo, hi)
+        """
+        # only intervals starting before hi can intersect
+        count = bisect_left(self.starts, hi)
+        out = []
+        tree, size = self._tree, self._size
+        stack = [(1, 0, size)]
+        while stack:
+            node, node_lo, node_hi = stack.pop()
+            if node_lo >= count or tree[node] <= lo:
+                continue
+            if node >= size:
+                out.append(node - size)
+                continue
+            middle = (node_lo + node_hi) // 2
+            stack.append((2 * node + 1, middle, node_hi))
+            stack.append((2 * node, node_lo, middle))
+        return out
+    
+    def active_at(self, time):
+        """
+        returns the indexes, in order, of the intervals containing time
+        """
+        return self.overlapping(time, time + 1)
+
+
+def parse_timecode_line(line):
+    """
+    parses the "start --> end" line of an srt cue
+    and returns (start, end) Timecodes
+
+    the canonical HH:MM:SS,mmm --> HH:MM:SS,mmm form is read
+    at fixed offsets, anything else goes through Timecode.from_string
+    """
+    if len(line) == 29 and line[12:17] == ' --> ':
+        start = _canonical_milliseconds(line[:12])
+        end = _canonical_milliseconds(line[17:])
+        if start is not None and end is not None:
+            return Timecode(start), Timecode(end)
+    
+    start, end = TIMECODE_SEP.split(line)
+    return Timecode.from_string(start), Timecode.from_string(end)
+
+
+def _canonical_milliseconds(tc):
+    """
+    milliseconds of a HH:MM:SS,mmm timecode, or None if tc is not one
+    """
+    cache = _timecode_caches.cache
+    ms = cache.get(tc)
+    if ms is None:
+        if not (tc[2] == ':' and tc[5] == ':' and tc[8] in ',.' and tc[:2].isdigit()
+                and tc[3:5].isdigit() and tc[6:8].isdigit() and tc[9:].isdigit()):
+            return None
+        ms = cache[tc] = ((int(tc[:2]) * 60 + int(tc[3:5])) * 60 + int(tc[6:8])) * 1000 + int(tc[9:])
+    return ms
+
+
 @functools.total_ordering
 class SRTFrame(object):
     """
     An object representing an SRT Frame
+
+    Frames are immutable (lines is a tuple),
+    so documents can share them instead of copying
     """
     
+    __slots__ = ('start', 'end', 'lines')
+    
     def __init__(self, start, end, lines=None):
         """
         Start, end are Timecode instances
-        Words is a string
+        lines is a sequence of strings
         """
-        self.start = start
-        self.end = end
-        self.lines = lines or []
+        _set_slot(self, 'start', start)
+        _set_slot(self, 'end', end)
+        _set_slot(self, 'lines', tuple(lines) if lines else ())
+    
+    def __setattr__(self, name, value):
+        raise AttributeError("SRTFrame is immutable")
+    
+    def __reduce__(self):
+        return (SRTFrame, (self.start, self.end, self.lines))
         
     def copy(self):
-        return SRTFrame(self.start.copy(), self.end.copy(), [l for l in self.lines])
+        return SRTFrame(self.start, self.end, self.lines)
     
     def split(self, time):
         """
@@ -134,8 +652,8 @@ class SRTFrame(object):
             second = SRTFrame(self.end, time)
             
         else:
-            first = SRTFrame(self.start, time, self.lines[:])
-            second = SRTFrame(time, self.end, self.lines[:])
+            first = SRTFrame(self.start, time, self.lines)
+            second = SRTFrame(time, self.end, self.lines)
             
         return (first, second)
         
@@ -145,13 +663,13 @@ class SRTFrame(object):
         if time is negative, it will move backwards!
         if time is positive, it will move forwards!
         """
-        if isinstance(time, int):
+        if isinstance(time, (int, long)):
             time = Timecode(time)
         
         start = self.start + time
         end = self.end + time
 
-        return SRTFrame(start, end, self.lines[:])
+        return SRTFrame(start, end, self.lines)
     
     def text(self):
         return '\n'.join(self.lines)
@@ -159,21 +677,29 @@ class SRTFrame(object):
     def __str__(self):
         HEADERFORMAT = "%s --> %s\n"
         
-        out = ""
-        out += HEADERFORMAT % (str(self.start), str(self.end))
-        
-        for line in self.lines:
-            out += line + '\n'
+        out = [HEADERFORMAT % (str(self.start), str(self.end))]
+        # lines from sjson are unicode, .srt output is utf-8
+        out.extend((line.encode('utf-8') if isinstance(line, unicode) else line) + '\n'
+                   for line in self.lines)
             
-        return out
+        return ''.join(out)
         
     ## total ordering is by start time.
     ## should be OK 
     def __eq__(self, other):
+        if not isinstance(other, SRTFrame):
+            return NotImplemented
         return self.start == other.start
+    
+    def __ne__(self, other):
+        return not self == other
         
     def __lt__(self, other):
         return self.start < other.start
+    
+    def __hash__(self):
+        # consistent with __eq__
+        return hash(self.start)
 
 
 class SRTDocument(object):
@@ -187,17 +713,101 @@ class SRTDocument(object):
     def __init__(self, frames=None):
         """
         frames is an optional LIST of frames
+
+        frames are immutable, so they are shared, not copied
         """
-        self.frames = frames or []
-        self.frames = [f.copy() for f in self.frames]
+        self.frames = list(frames) if frames else []
+        self._index = None
+        self._intervals = None
         
         self._sort()
+
+    @classmethod
+    def from_frames(cls, frames, presorted=False):
+        """
+        builds a document straight from an iterable of frames
+        in a single pass
+
+        if presorted is True the caller promises they are already
+        in order, otherwise they are sorted once (if needed)
+        """
+        doc = cls.__new__(cls)
+        doc.frames = list(frames)
+        doc._index = None
+        doc._intervals = None
+        if not presorted:
+            doc._sort()
+        return doc
         
     def _sort(self):
         # because of the total ordering on 
         # frames, this should be sufficient
+        # (timsort is linear on input that is already in order,
+        # which is what parsed files almost always are)
         self.frames.sort()
+        self._index = None
+        self._intervals = None
         return self
+    
+    def _time_index(self):
+        """
+        returns (starts, ends, max_ends): the start and end of each
+        frame, and the running maximum of the ends, in milliseconds.
+        starts and max_ends are sorted, so they can be bisected
+
+        built on first use. frames should not be changed in place
+        after that
+        """
+        if self._index is None:
+            starts = [frame.start.milliseconds() for frame in self.frames]
+            ends = [frame.end.milliseconds() for frame in self.frames]
+            self._index = (starts, ends, _running_max(ends))
+        return self._index
+    
+    def interval_index(self):
+        """
+        the IntervalIndex of the frames, built on first use
+        """
+        if self._intervals is None:
+            starts, ends, max_ends = self._time_index()
+            self._intervals = IntervalIndex(starts, ends)
+        return self._intervals
+    
+    def frame_at(self, time):
+        """
+        returns the frame on screen at time, or None.
+        if frames overlap there, the one that started last
+
+        frames are on screen from their start up to (not including)
+        their end. time is a Timecode or milliseconds
+        """
+        time = _to_milliseconds(time)
+        starts, ends, max_ends = self._time_index()
+        index = bisect_right(starts, time) - 1
+        if index < 0:
+            return None
+        if self.frames[index].end.milliseconds() > time:
+            return self.frames[index]
+        if max_ends[index] <= time:
+            # nothing before it is still on screen either
+            return None
+        active = self.frames_active_at(time)
+        return active[-1] if active else None
+    
+    def frames_active_at(self, time):
+        """
+        returns the list of all the frames on screen at time
+        """
+        indexes = self.interval_index().active_at(_to_milliseconds(time))
+        return [self.frames[index] for index in indexes]
+    
+    def frames_between(self, start, end):
+        """
+        returns the list of frames that are on screen at some point
+        in [start, end). start and end are Timecodes or milliseconds
+        """
+        indexes = self.interval_index().overlapping(_to_milliseconds(start), _to_milliseconds(end))
+        return [self.frames[index] for index in indexes]
         
     def add_frame(self, frame):
         return SRTDocument(self.frames + [frame])
@@ -205,64 +815,47 @@ class SRTDocument(object):
     def copy(self):
         return SRTDocument(self.frames)
     
+    def view(self):
+        """
+        a lazy SRTDocumentView of the whole document
+        """
+        return SRTDocumentView([_Run(self, 0, len(self.frames), 0)])
+    
     def split(self, time):
         """
         splits the document at the given time
         """
+        first, second = self.split_many([time])
+        return (first, second)
+    
+    def split_many(self, timecodes, normalize=False):
+        """
+        splits the document at each of the given times (increasing),
+        like calling split on the second half again and again,
+        but in a single sweep over the frames
+
+        yields the len(timecodes) + 1 documents one at a time.
+        if normalize is True each one is shifted to start at 0
+        as it is built (see normalize)
+        """
+        starts, ends, max_ends = self._time_index()
+        cuts = [time.milliseconds() for time in timecodes]
         
-        if not self.frames:
-            # so if I don't have any frames:
-            # return two empty documents. fine
-            first = SRTDocument()
-            second = SRTDocument()
+        for parts in _plan_cuts(starts, ends, max_ends, cuts):
+            frames = []
+            for part in parts:
+                if len(part) == 2:
+                    frames.extend(self.frames[part[0]:part[1]])
+                else:
+                    index, start, end = part
+                    lines = self.frames[index].lines if index is not None else None
+                    frames.append(SRTFrame(Timecode(start), Timecode(end), lines))
             
-        else:
+            if normalize and frames and frames[0].start.milliseconds():
+                offset = Timecode(-frames[0].start.milliseconds())
+                frames = [frame.shift(offset) for frame in frames]
             
-            first_frame = self.frames[0]
-            if time <= first_frame.start:
-                first = SRTDocument()
-                second = self.copy()
-            else:
-                # lets find the first frame
-                # whose end is >= time
-                frame_iter = iter(self.frames)
-                
-                splitframe = frame_iter.next() # we have at least one, so this is safe
-                splitindex = 0
-                while splitframe.end < time:
-                    try:
-                        splitframe = frame_iter.next()
-                        splitindex += 1
-                    except StopIteration:
-                        splitframe = None
-                        break
-                
-                #ok cool. so split frame is the frame we split at.
-                # but, if time == splitframe.end, we don't split ()
-                # AND, if split frame is none, we need an empty document
-                
-                if splitframe is None:
-                    # this is the condition
-                    # of time being after the end
-                    first = self.copy()
-                    second = SRTDocument()
-                
-                else:
-                    # lets check if time is on the end of splitframe
-                    if time == splitframe.end:
-                        first = SRTDocument(self.frames[:splitindex + 1])
-                        second = SRTDocument(self.frames[splitindex + 1:])
-                    else:
-                        #ok so now this is an internal, internal case
-                        left, right = splitframe.split(time)
-                                                
-                        first_frames = self.frames[:splitindex] + [left]
-                        second_frames = [right] + self.frames[splitindex + 1:]
-                        
-                        first = SRTDocument(first_frames)
-                        second = SRTDocument(second_frames)
-                        
-        return (first, second)
+            yield SRTDocument.from_frames(frames, presorted=True)
             
     def normalize(self):
         """
@@ -274,7 +867,7 @@ class SRTDocument(object):
         # we have at least one
         start = self.frames[0].start.milliseconds()
         if start: # does not equal 0
-             return SRTDocument([frame.shift(start * -1) for frame in self.frames])
+             return self.shift(start * -1)
 
         return self
         
@@ -282,7 +875,22 @@ class SRTDocument(object):
         """
         shifts the given SRT by this many millisecods
         """
-        return SRTDocument([frame.shift(ms) for frame in self.frames])
+        # a shift keeps the order, no need to sort again
+        return SRTDocument.from_frames((frame.shift(ms) for frame in self.frames), presorted=True)
+    
+    def retime(self, *time_maps):
+        """
+        maps every start and end through the TimeMaps, in turn
+        (shift, scale, piecewise or framerate, see TimeMap)
+        """
+        typecode = CompactSRTDocument.TIME_TYPECODE
+        starts = retime_column(array(typecode, [frame.start.milliseconds() for frame in self.frames]), time_maps)
+        ends = retime_column(array(typecode, [frame.end.milliseconds() for frame in self.frames]), time_maps)
+        return SRTDocument.from_frames(
+            (SRTFrame(Timecode(start), Timecode(end), frame.lines)
+             for start, end, frame in izip(starts, ends, self.frames)),
+            presorted=True,
+        )
         
     
     def add(self, other):
@@ -300,7 +908,8 @@ class SRTDocument(object):
         #other.frames is at elast one
         other_start = other.frames[0].start
         
-        self_end = self.frames[-1].end
+        # the last frame to end is not the last one if frames overlap
+        self_end = Timecode(self._time_index()[2][-1])
         
         if other_start < self_end:
             raise ValueError("Other cannot start before this SRTDocument ends! (in add)")
@@ -308,295 +917,3105 @@ class SRTDocument(object):
         shift_duration = self_end - other_start
         other = other.shift(shift_duration) #other now starts right when self ends. so we can just glob them
         
-        for frame in other.frames:
-            self = self.add_frame(frame)
-        
-        return self
+        # everything in other starts after everything in self
+        return SRTDocument.from_frames(self.frames + other.frames, presorted=True)
+    
+    @classmethod
+    def concatenate(cls, documents):
+        """
+        chains the documents one after the other,
+        see iter_concatenated
+        """
+        return cls.from_frames(iter_concatenated(documents), presorted=True)
+    
+    @classmethod
+    def merge(cls, documents):
+        """
+        interleaves the documents (tracks) into one timeline,
+        see iter_merged
+        """
+        return cls.from_frames(iter_merged(*[doc.frames for doc in documents]), presorted=True)
         
         
     def __str__(self):
-        out = "\n"
-        index = 1
-        
-        for frame in self.frames:
-            out += "%d\n" % index
-            out += str(frame)
-            out += "\n"
-            index += 1
-        return out
+        out = StringIO()
+        write_srt(self.frames, out)
+        return out.getvalue()
     
-    def json(self):
-        start = []
-        end = []
-        text = []
-        for frame in self.frames:
-            start.append(frame.start.milliseconds())
-            end.append(frame.end.milliseconds())
-            text.append(frame.text())
-        return json.dumps({
-            'start' : start,
-            'end' : end,
-            'text' : text,
-        }, indent=4)             
-
-#################################################
-# .srt parsing
-#################################################
-
-def get_file_type(file_path):
-    if file_path.endswith('.sjson'):
-        return 'sjson'
-    elif file_path.endswith('.srt'):
-        return 'srt'
-    else:
-        #fallback
-        return 'srt'
+    def json(self, compact=False):
+        out = StringIO()
+        write_sjson(self.frames, out, compact)
+        return out.getvalue()
 
-def parse(file_path):
-    type_parse_functions = {
-        'sjson' : parse_sjson,
-        'srt' : parse_srt,
-    }
-    file_handle = open(file_path, 'r')
-    return type_parse_functions[get_file_type(file_path)](file_handle)
-
-def parse_sjson(file_handle):
+def iter_concatenated(documents):
     """
-    returns an SRTDocuement from a sjson file
+    yields the frames of each of documents in turn,
+    each document shifted to start where the previous one ended
+    (the first one is not shifted)
+
+    unlike SRTDocument.add, documents can start anywhere: a later
+    one that starts at 0 is moved forward. documents can be any
+    iterable, and each is dropped once its frames are out
     """
-    json_data = json.load(file_handle)
-    
-    doc = SRTDocument()
-    
-    starts = json_data['start']
-    ends = json_data['end']
-    texts = json_data['text']
+    end = None
+    for doc in documents:
+        shift = None
+        for frame in doc.frames:
+            if shift is None:
+                shift = end - frame.start.milliseconds() if end is not None else 0
+            if shift:
+                frame = frame.shift(shift)
+            frame_end = frame.end.milliseconds()
+            if end is None or frame_end > end:
+                end = frame_end
+            yield frame
 
-    for frame_index in range(len(starts)):
-        start = Timecode(starts[frame_index])
-        end = Timecode(ends[frame_index])
-        text = texts[frame_index]
-        doc = doc.add_frame(SRTFrame(start, end, text.split('\n')))
-    return doc
-    
 
+# the pieces of an SRTDocumentView:
+# frames lo:hi of base (an SRTDocument) shifted by offset milliseconds,
+_Run = namedtuple('_Run', 'base lo hi offset')
+# or a single frame, with its times in milliseconds
+_Piece = namedtuple('_Piece', 'start end lines')
 
-def parse_srt(file_handle):
+
+class SRTDocumentView(object):
     """
-    returns an SRTDocument from a .srt file
+    A lazy, read only SRTDocument
+
+    it records runs of frames of other documents, with the shift
+    to apply to them, plus the few frames that split had to cut.
+    split, shift, normalize and add only rearrange these records:
+    frames are built when the view is iterated or written out
+
+    views share the documents they are made from,
+    which must not be changed in place
     """
-    TIMECODE_SEP = re.compile('[ \->]*')   
     
-    state = 'waiting' # or timerange or lines
+    def __init__(self, entries=()):
+        """
+        entries is a list of _Run and _Piece, in start time order
+        """
+        self._entries = [entry for entry in entries
+                         if not (isinstance(entry, _Run) and entry.lo >= entry.hi)]
+        self._frames = None
     
-    doc = SRTDocument()
-
-    start = None
-    end = None
-    lines = []
-
-    for line in file_handle:
-        line = line.strip()
-        
-        if state == 'waiting':
-            #assume its a valid SRT
-            if line:
-                state = 'time'
-        elif state == 'time':
-            start, end = map(Timecode.from_string, TIMECODE_SEP.split(line))
-            state = 'text'
-        elif state == 'text':
-            if line == '':
-                # switch 
-                doc = doc.add_frame(SRTFrame(start, end, lines))
-                start = None
-                end = None
-                lines = []
-                state = 'waiting'
+    def __iter__(self):
+        for entry in self._entries:
+            if isinstance(entry, _Piece):
+                yield SRTFrame(Timecode(entry.start), Timecode(entry.end), entry.lines)
+            elif entry.offset:
+                shift = Timecode(entry.offset)
+                for frame in entry.base.frames[entry.lo:entry.hi]:
+                    yield frame.shift(shift)
             else:
-                lines.append(line)
-                
-    if start:
-        doc = doc.add_frame(SRTFrame(start, end, lines))
-    return doc
-
-
-def command_delete(args):
-    """python srt.py delete [filename] [start] [end]
+                for frame in entry.base.frames[entry.lo:entry.hi]:
+                    yield frame
     
-    deletes the segment described by [start] [end]
-
-    start and end should be a HH:MM:SS,MMM timestamp
-    they can also be the words 'start' or 'end'
+    @property
+    def frames(self):
+        """
+        the list of frames, built on first use
+        """
+        if self._frames is None:
+            self._frames = list(self)
+        return self._frames
+    
+    def to_document(self):
+        return SRTDocument.from_frames(self.frames, presorted=True)
+    
+    def view(self):
+        return self
+    
+    def copy(self):
+        return self
+    
+    def first_start(self):
+        """
+        the start of the first frame as a Timecode, None if empty
+        """
+        if not self._entries:
+            return None
+        entry = self._entries[0]
+        if isinstance(entry, _Piece):
+            return Timecode(entry.start)
+        starts, ends, max_ends = entry.base._time_index()
+        return Timecode(starts[entry.lo] + entry.offset)
+    
+    def last_end(self):
+        """
+        the latest frame end as a Timecode, None if empty
+        """
+        last = None
+        for entry in self._entries:
+            if isinstance(entry, _Piece):
+                end = entry.end
+            else:
+                starts, ends, max_ends = entry.base._time_index()
+                end = max(ends[entry.lo:entry.hi]) + entry.offset
+            if last is None or end > last:
+                last = end
+        return Timecode(last) if last is not None else None
+    
+    def split(self, time):
+        """
+        splits the view at the given time,
+        exactly like SRTDocument.split
+        """
+        time = _to_milliseconds(time)
+        first_start = self.first_start()
+        if first_start is None or time <= first_start.milliseconds():
+            return (SRTDocumentView(), self)
+        
+        # same sweep as _plan_cuts, over the entries
+        left = []
+        right_halves = []
+        right_rest = []
+        reaches = False
+        next_start = None
+        for entry_index, entry in enumerate(self._entries):
+            if isinstance(entry, _Piece):
+                if entry.start >= time:
+                    right_rest.extend(self._entries[entry_index:])
+                    next_start = entry.start
+                    break
+                if entry.end > time:
+                    left.append(_Piece(entry.start, time, entry.lines))
+                    right_halves.append(_Piece(time, entry.end, entry.lines))
+                else:
+                    left.append(entry)
+                reaches = reaches or entry.end >= time
+                continue
+            
+            base, lo, hi, offset = entry
+            starts, ends, max_ends = base._time_index()
+            local = time - offset
+            k = bisect_left(starts, local, lo, hi)
+            j = min(max(bisect_left(max_ends, local), lo), k)
+            left.append(_Run(base, lo, j, offset))
+            for index in xrange(j, k):
+                if ends[index] > local:
+                    lines = base.frames[index].lines
+                    left.append(_Piece(starts[index] + offset, time, lines))
+                    right_halves.append(_Piece(time, ends[index] + offset, lines))
+                else:
+                    left.append(_Run(base, index, index + 1, offset))
+                reaches = reaches or ends[index] >= local
+            if k < hi:
+                right_rest.append(_Run(base, k, hi, offset))
+                right_rest.extend(self._entries[entry_index + 1:])
+                next_start = starts[k] + offset
+                break
+        
+        if not reaches and next_start is not None:
+            # a blank frame up to the next one, see SRTDocument.split
+            left.append(_Piece(time, next_start, ()))
+        
+        return (SRTDocumentView(left), SRTDocumentView(right_halves + right_rest))
+    
+    def shift(self, ms):
+        """
+        shifts the view by this many milliseconds
+        """
+        ms = _to_milliseconds(ms)
+        if not ms:
+            return self
+        entries = []
+        for entry in self._entries:
+            if isinstance(entry, _Piece):
+                entries.append(_Piece(entry.start + ms, entry.end + ms, entry.lines))
+            else:
+                entries.append(entry._replace(offset=entry.offset + ms))
+        return SRTDocumentView(entries)
+    
+    def normalize(self):
+        """
+        makes sure that first frame starts at 0
+        """
+        first_start = self.first_start()
+        if first_start is None:
+            return self
+        return self.shift(-first_start.milliseconds())
+    
+    def add(self, other):
+        """
+        adds other to the end of self,
+        see SRTDocument.add
+        """
+        other = other.view()
+        other_start = other.first_start()
+        if other_start is None:
+            return self
+        
+        self_end = self.last_end()
+        if self_end is None:
+            return other
+        
+        if other_start < self_end:
+            raise ValueError("Other cannot start before this SRTDocument ends! (in add)")
+        
+        other = other.shift((self_end - other_start).milliseconds())
+        return SRTDocumentView(self._entries + other._entries)
+    
+    def __str__(self):
+        out = StringIO()
+        write_srt(self, out)
+        return out.getvalue()
+    
+    def json(self, compact=False):
+        out = StringIO()
+        write_sjson(self.frames, out, compact)
+        return out.getvalue()
+
+
+class CompactSRTDocument(object):
+    """
+    An SRTDocument stored column-wise
+
+    starts and ends are packed arrays of milliseconds,
+    and all the cue text lives in a single string
+    with a (text_start, text_end) span per cue.
+    SRTFrames are only built when they are asked for.
+
+    documents derived from each other (split, shift...) share
+    the text buffer, and the arrays are never modified in place
+    """
+    
+    # array('q') is python 3 only. 'l' is 64 bits on LP64 platforms
+    TIME_TYPECODE = 'l'
+    
+    def __init__(self, starts=None, ends=None, text='', text_starts=None, text_ends=None, presorted=False):
+        self.starts = starts if starts is not None else array(self.TIME_TYPECODE)
+        self.ends = ends if ends is not None else array(self.TIME_TYPECODE)
+        self.text = text
+        self.text_starts = text_starts if text_starts is not None else array(self.TIME_TYPECODE)
+        self.text_ends = text_ends if text_ends is not None else array(self.TIME_TYPECODE)
+        self._max_ends = None
+        self._intervals = None
+        if not presorted:
+            self._sort()
+    
+    @classmethod
+    def from_frames(cls, frames):
+        """
+        packs an iterable of SRTFrames
+        """
+        starts = array(cls.TIME_TYPECODE)
+        ends = array(cls.TIME_TYPECODE)
+        text_starts = array(cls.TIME_TYPECODE)
+        text_ends = array(cls.TIME_TYPECODE)
+        texts = []
+        offset = 0
+        for frame in frames:
+            starts.append(frame.start.milliseconds())
+            ends.append(frame.end.milliseconds())
+            text = frame.text()
+            texts.append(text)
+            text_starts.append(offset)
+            offset += len(text)
+            text_ends.append(offset)
+        return cls(starts, ends, ''.join(texts), text_starts, text_ends)
+    
+    @classmethod
+    def from_columns(cls, starts, ends, texts):
+        """
+        packs parallel lists of start times, end times and texts,
+        like the ones in an sjson file
+        """
+        if not len(starts) == len(ends) == len(texts):
+            raise ValueError("start, end and text columns have different lengths")
+        
+        text_ends = array(cls.TIME_TYPECODE, _running_sum(len(text) for text in texts))
+        text_starts = array(cls.TIME_TYPECODE, [0])
+        text_starts.extend(text_ends[:-1])
+        return cls(
+            array(cls.TIME_TYPECODE, starts), array(cls.TIME_TYPECODE, ends),
+            ''.join(texts), text_starts[:len(texts)], text_ends,
+        )
+    
+    @classmethod
+    def from_document(cls, doc):
+        return cls.from_frames(doc.frames)
+    
+    def to_document(self):
+        return SRTDocument.from_frames(self.frames, presorted=True)
+    
+    def view(self):
+        return self.to_document().view()
+    
+    def _sort(self):
+        # same ordering as SRTDocument: stable, by start time
+        starts = self.starts
+        if all(starts[i] <= starts[i + 1] for i in xrange(len(starts) - 1)):
+            return self
+        
+        order = sorted(xrange(len(starts)), key=starts.__getitem__)
+        for name in ('starts', 'ends', 'text_starts', 'text_ends'):
+            column = getattr(self, name)
+            setattr(self, name, array(self.TIME_TYPECODE, [column[i] for i in order]))
+        return self
+    
+    def _running_max_ends(self):
+        """
+        running maximum of the ends, see SRTDocument._time_index
+        """
+        if self._max_ends is None:
+            self._max_ends = array(self.TIME_TYPECODE, _running_max(self.ends))
+        return self._max_ends
+    
+    def interval_index(self):
+        """
+        the IntervalIndex of the cues, built on first use
+        """
+        if self._intervals is None:
+            self._intervals = IntervalIndex(self.starts, self.ends)
+        return self._intervals
+    
+    def frame_at(self, time):
+        """
+        returns the frame on screen at time, or None.
+        see SRTDocument.frame_at
+        """
+        time = _to_milliseconds(time)
+        index = bisect_right(self.starts, time) - 1
+        if index < 0:
+            return None
+        if self.ends[index] > time:
+            return self.frame(index)
+        if self._running_max_ends()[index] <= time:
+            return None
+        active = self.interval_index().active_at(time)
+        return self.frame(active[-1]) if active else None
+    
+    def frames_active_at(self, time):
+        """
+        returns the list of all the frames on screen at time
+        """
+        return [self.frame(index) for index in self.interval_index().active_at(_to_milliseconds(time))]
+    
+    def frames_between(self, start, end):
+        """
+        returns the list of frames on screen at some point in [start, end).
+        see SRTDocument.frames_between
+        """
+        indexes = self.interval_index().overlapping(_to_milliseconds(start), _to_milliseconds(end))
+        return [self.frame(index) for index in indexes]
+    
+    @property
+    def frames(self):
+        return _CompactFrames(self)
+    
+    def __len__(self):
+        return len(self.starts)
+    
+    def frame(self, index):
+        """
+        builds the SRTFrame at index
+        """
+        text = self.text[self.text_starts[index]:self.text_ends[index]]
+        return SRTFrame(
+            Timecode(self.starts[index]),
+            Timecode(self.ends[index]),
+            text.split('\n') if text else [],
+        )
+    
+    def texts(self):
+        """
+        iterates over the text of each cue
+        """
+        text = self.text
+        for text_start, text_end in izip(self.text_starts, self.text_ends):
+            yield text[text_start:text_end]
+    
+    def copy(self):
+        return CompactSRTDocument(self.starts, self.ends, self.text, self.text_starts, self.text_ends)
+    
+    def split(self, time):
+        """
+        splits the document at the given time,
+        exactly like SRTDocument.split
+        """
+        first, second = self.split_many([time])
+        return (first, second)
+    
+    def split_many(self, timecodes, normalize=False):
+        """
+        splits the document at each of the given times,
+        exactly like SRTDocument.split_many
+        """
+        cuts = [_to_milliseconds(time) for time in timecodes]
+        
+        for parts in _plan_cuts(self.starts, self.ends, self._running_max_ends(), cuts):
+            starts, ends, text_starts, text_ends = [array(self.TIME_TYPECODE) for _ in range(4)]
+            for part in parts:
+                if len(part) == 2:
+                    lo, hi = part
+                    starts.extend(self.starts[lo:hi])
+                    ends.extend(self.ends[lo:hi])
+                    text_starts.extend(self.text_starts[lo:hi])
+                    text_ends.extend(self.text_ends[lo:hi])
+                else:
+                    index, start, end = part
+                    starts.append(start)
+                    ends.append(end)
+                    text_starts.append(self.text_starts[index] if index is not None else 0)
+                    text_ends.append(self.text_ends[index] if index is not None else 0)
+            
+            doc = CompactSRTDocument(starts, ends, self.text, text_starts, text_ends)
+            yield doc.normalize() if normalize else doc
+    
+    def shift(self, ms):
+        """
+        shifts the document by this many milliseconds
+        """
+        ms = _to_milliseconds(ms)
+        return CompactSRTDocument(
+            shift_column(self.starts, ms), shift_column(self.ends, ms),
+            self.text, self.text_starts, self.text_ends, presorted=True,
+        )
+    
+    def retime(self, *time_maps):
+        """
+        maps every start and end through the TimeMaps, in turn
+        """
+        return CompactSRTDocument(
+            retime_column(self.starts, time_maps), retime_column(self.ends, time_maps),
+            self.text, self.text_starts, self.text_ends, presorted=True,
+        )
+    
+    def normalize(self):
+        """
+        makes sure that first frame starts at 0
+        """
+        if self.starts and self.starts[0]:
+            return self.shift(-self.starts[0])
+        return self
+    
+    def add(self, other):
+        """
+        adds other to the end of self,
+        see SRTDocument.add
+        """
+        if not isinstance(other, CompactSRTDocument):
+            other = CompactSRTDocument.from_document(other)
+        
+        if not other.starts:
+            return self.copy()
+        
+        if not self.starts:
+            return other.copy()
+        
+        other_start = other.starts[0]
+        self_end = self._running_max_ends()[-1]
+        
+        if other_start < self_end:
+            raise ValueError("Other cannot start before this SRTDocument ends! (in add)")
+        
+        other = other.shift(self_end - other_start)
+        base = len(self.text)
+        return CompactSRTDocument(
+            self.starts + other.starts,
+            self.ends + other.ends,
+            self.text + other.text,
+            self.text_starts + array(self.TIME_TYPECODE, [offset + base for offset in other.text_starts]),
+            self.text_ends + array(self.TIME_TYPECODE, [offset + base for offset in other.text_ends]),
+        )
+    
+    def __str__(self):
+        out = StringIO()
+        write_srt(self.frames, out)
+        return out.getvalue()
+    
+    def json(self, compact=False):
+        out = StringIO()
+        write_sjson(self.frames, out, compact)
+        return out.getvalue()
+
+
+class _CompactFrames(object):
+    """
+    read only sequence of the SRTFrames in a CompactSRTDocument,
+    built on access
+    """
+    
+    def __init__(self, doc):
+        self._doc = doc
+    
+    def __len__(self):
+        return len(self._doc)
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._doc.frame(i) for i in xrange(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("frame index out of range")
+        return self._doc.frame(index)
+    
+    def __iter__(self):
+        frame = self._doc.frame
+        for index in xrange(len(self._doc)):
+            yield frame(index)
+
+
+#################################################
+# retiming
+#################################################
+
+class TimeMap(object):
+    """
+    A piecewise linear, non decreasing mapping of times (in ms)
+
+    piece i maps t >= breaks[i] (the first piece also takes
+    everything before) to offsets[i] + (t - breaks[i]) * slopes[i]
+
+    apply() maps a whole column at once, with numpy if it is
+    installed, so retiming never builds a Timecode per value
+    """
+    
+    def __init__(self, breaks, offsets, slopes):
+        if not breaks or not len(breaks) == len(offsets) == len(slopes):
+            raise ValueError("a TimeMap needs one offset and slope per break")
+        if any(slope < 0 for slope in slopes):
+            raise ValueError("a TimeMap can't run time backwards")
+        self.breaks = [float(value) for value in breaks]
+        self.offsets = [float(value) for value in offsets]
+        self.slopes = [float(value) for value in slopes]
+    
+    @classmethod
+    def shift(cls, ms):
+        return cls([0], [_to_milliseconds(ms)], [1])
+    
+    @classmethod
+    def scale(cls, factor, origin=0):
+        """
+        stretches (factor > 1) or squeezes times around origin
+        """
+        if factor <= 0:
+            raise ValueError("Scale factor must be positive")
+        origin = _to_milliseconds(origin)
+        return cls([origin], [origin], [factor])
+    
+    @classmethod
+    def framerate(cls, from_fps, to_fps, origin=0):
+        """
+        retimes subtitles made for video at from_fps
+        to the same video played at to_fps
+        (a 23.976 -> 25 conversion runs about 4% faster)
+        """
+        if from_fps <= 0 or to_fps <= 0:
+            raise ValueError("Frame rates must be positive")
+        return cls.scale(float(from_fps) / to_fps, origin)
+    
+    @classmethod
+    def piecewise(cls, points):
+        """
+        interpolates linearly between (source, target) points,
+        before the first and after the last one it carries on
+        along the nearest segment. one point is a shift
+        """
+        points = sorted((_to_milliseconds(source), _to_milliseconds(target)) for source, target in points)
+        if not points:
+            raise ValueError("A piecewise TimeMap needs at least one point")
+        if len(points) == 1:
+            source, target = points[0]
+            return cls([source], [target], [1])
+        
+        breaks, offsets, slopes = [], [], []
+        for (source, target), (next_source, next_target) in zip(points, points[1:]):
+            if next_source == source:
+                raise ValueError("Two points map the same time %s" % Timecode(source))
+            breaks.append(source)
+            offsets.append(target)
+            slopes.append(float(next_target - target) / (next_source - source))
+        return cls(breaks, offsets, slopes)
+    
+    def __call__(self, ms):
+        """
+        maps one time, rounded to the millisecond
+        """
+        return int(floor(self.apply([_to_milliseconds(ms)])[0] + 0.5))
+    
+    def apply(self, times):
+        """
+        maps a sequence of times, returns them as floats
+        (a numpy array if times is one)
+        """
+        if numpy is not None and isinstance(times, numpy.ndarray):
+            return self._apply_numpy(times)
+        
+        breaks, offsets, slopes = self.breaks, self.offsets, self.slopes
+        if len(breaks) == 1:
+            start, offset, slope = breaks[0], offsets[0], slopes[0]
+            return [offset + (time - start) * slope for time in times]
+        
+        last = len(breaks) - 1
+        out = []
+        for time in times:
+            piece = bisect_right(breaks, time) - 1
+            if piece < 0:
+                piece = 0
+            elif piece > last:
+                piece = last
+            out.append(offsets[piece] + (time - breaks[piece]) * slopes[piece])
+        return out
+    
+    def _apply_numpy(self, times):
+        if len(self.breaks) == 1:
+            return self.offsets[0] + (times - self.breaks[0]) * self.slopes[0]
+        
+        breaks = numpy.array(self.breaks)
+        pieces = numpy.clip(numpy.searchsorted(breaks, times, 'right') - 1, 0, len(breaks) - 1)
+        return numpy.take(self.offsets, pieces) + (times - breaks[pieces]) * numpy.take(self.slopes, pieces)
+
+
+def retime_column(values, time_maps):
+    """
+    maps an array of ms through each TimeMap in turn,
+    returns a new array rounded to the millisecond
+
+    the maps don't reorder times, so a sorted column stays sorted
+    """
+    if numpy is not None and values:
+        times = _numpy_column(values).astype(numpy.float64)
+        for time_map in time_maps:
+            times = time_map.apply(times)
+        return _from_numpy(numpy.floor(times + 0.5).astype(numpy.int64))
+    
+    times = values
+    for time_map in time_maps:
+        times = time_map.apply(times)
+    return array(CompactSRTDocument.TIME_TYPECODE, [int(floor(time + 0.5)) for time in times])
+
+
+def shift_column(values, ms):
+    """
+    adds ms to every value of an array of ms
+    """
+    if numpy is not None and values:
+        return _from_numpy(_numpy_column(values) + ms)
+    return array(CompactSRTDocument.TIME_TYPECODE, [value + ms for value in values])
+
+
+def _numpy_column(values):
+    """
+    an int64 numpy view of an array of ms, without a copy when the sizes match
+    """
+    if values.itemsize == 8:
+        return numpy.frombuffer(values, dtype=numpy.int64)
+    return numpy.array(values.tolist(), dtype=numpy.int64)
+
+
+def _from_numpy(values):
+    typecode = CompactSRTDocument.TIME_TYPECODE
+    if array(typecode).itemsize == 8:
+        return array(typecode, values.tostring())
+    return array(typecode, values.tolist())
+
+
+#################################################
+# edit lists
+#################################################
+
+# a kept stretch of the input, [start, end) in ms (None is open ended),
+# moved by offset ms
+_Segment = namedtuple('_Segment', 'start end offset')
+
+
+class EditList(object):
+    """
+    Many cuts and moves, applied to a document in one sweep
+
+    every time refers to the input, whatever the order
+    of the operations:
+
+    delete(start, end)      removes [start, end), what follows moves back
+    keep(start, end)        with any keeps, everything outside them is deleted
+    shift(start, end, ms)   moves what is in [start, end) by ms
+    gap(at, ms)             inserts ms of nothing at at, what follows moves on
+
+    cues are cut wherever they cross a boundary, and like the
+    delete command, the result starts when the input did
+    """
+    
+    OPERATIONS = {
+        'delete': 2,
+        'keep': 2,
+        'shift': 3,
+        'gap': 2,
+    }
+    
+    def __init__(self, operations=()):
+        self.operations = []
+        for operation in operations:
+            self.add(*operation)
+    
+    def add(self, name, *times):
+        """
+        adds an operation, times are ms or Timecodes
+        """
+        if self.OPERATIONS.get(name) != len(times):
+            raise ValueError("unknown edit %s with %d times" % (name, len(times)))
+        times = tuple(_to_milliseconds(time) for time in times)
+        if name != 'gap' and times[1] < times[0]:
+            raise ValueError("%s ends before it starts" % name)
+        if name == 'gap' and times[1] < 0:
+            raise ValueError("gap can't be negative")
+        self.operations.append((name,) + times)
+        return self
+    
+    def delete(self, start, end):
+        return self.add('delete', start, end)
+    
+    def keep(self, start, end):
+        return self.add('keep', start, end)
+    
+    def shift(self, start, end, ms):
+        return self.add('shift', start, end, ms)
+    
+    def gap(self, at, ms):
+        return self.add('gap', at, ms)
+    
+    @classmethod
+    def from_lines(cls, lines):
+        """
+        reads an edit list, one operation per line, eg
+
+        # drop the first ad break, and wait 2s after the second
+        delete 00:10:00,000 00:12:30,000
+        gap 00:25:00,000 00:00:02,000
+        shift 00:40:00,000 00:45:00,000 -00:00:00,500
+        """
+        edits = cls()
+        for number, line in enumerate(lines):
+            words = line.split('#', 1)[0].split()
+            if not words:
+                continue
+            try:
+                edits.add(words[0], *[Timecode.from_string(word) for word in words[1:]])
+            except (ValueError, AttributeError, TypeError) as error:
+                raise ValueError("edit list line %d: %s" % (number + 1, error))
+        return edits
+    
+    def segments(self):
+        """
+        the kept stretches of the input, in order, as _Segments
+        """
+        bounds = set()
+        for operation in self.operations:
+            if operation[0] == 'gap':
+                bounds.add(operation[1])
+            else:
+                bounds.update(operation[1:3])
+        bounds = sorted(bounds)
+        
+        keeps = [operation[1:3] for operation in self.operations if operation[0] == 'keep']
+        deletes = [operation[1:3] for operation in self.operations if operation[0] == 'delete']
+        shifts = [operation[1:] for operation in self.operations if operation[0] == 'shift']
+        gaps = [operation[1:] for operation in self.operations if operation[0] == 'gap']
+        
+        segments = []
+        removed = 0
+        for start, end in zip([None] + bounds, bounds + [None]):
+            # every operation covers all of this stretch or none of it
+            probe = start if start is not None else (end - 1 if end is not None else 0)
+            covered = lambda ranges: any(lo <= probe < hi for lo, hi in ranges)
+            
+            if covered(deletes) or (keeps and not covered(keeps)):
+                if start is not None and end is not None:
+                    removed += end - start
+                continue
+            
+            offset = (
+                sum(ms for at, ms in gaps if start is not None and at <= start) - removed +
+                sum(ms for lo, hi, ms in shifts if lo <= probe < hi)
+            )
+            if segments and segments[-1].end == start and segments[-1].offset == offset:
+                segments[-1] = segments[-1]._replace(end=end)
+            else:
+                segments.append(_Segment(start, end, offset))
+        return segments
+    
+    def apply(self, doc):
+        """
+        returns a new SRTDocument with the edits made to doc
+        (anything with sorted frames: SRTDocument, CompactSRTDocument, a view)
+        """
+        segments = self.segments()
+        frames = []
+        first_start = None
+        next_segment = 0
+        for frame in doc.frames:
+            start = frame.start.milliseconds()
+            end = frame.end.milliseconds()
+            if first_start is None:
+                first_start = start
+            
+            # frames come by start, so segments ending
+            # before this one does are done with
+            while next_segment < len(segments) and \
+                    segments[next_segment].end is not None and segments[next_segment].end <= start:
+                next_segment += 1
+            
+            for segment in islice(segments, next_segment, None):
+                if segment.start is not None and (segment.start > start if start == end else segment.start >= end):
+                    break
+                piece_start = start if segment.start is None else max(start, segment.start)
+                piece_end = end if segment.end is None else min(end, segment.end)
+                if piece_start == start and piece_end == end and not segment.offset:
+                    frames.append(frame) # untouched, frames are immutable
+                elif piece_start < piece_end or start == end:
+                    frames.append(SRTFrame(
+                        Timecode(piece_start + segment.offset),
+                        Timecode(piece_end + segment.offset),
+                        frame.lines,
+                    ))
+        
+        result = SRTDocument.from_frames(frames)
+        # the start time of the result is the start time of the input
+        if result.frames and result.frames[0].start.milliseconds() != first_start:
+            result = result.shift(first_start - result.frames[0].start.milliseconds())
+        return result
+
+
+#################################################
+# merging and sorting
+#################################################
+
+# cues held in memory by iter_sorted before it
+# sorts them out to a run file
+SORT_RUN_FRAMES = 200000
+
+
+def iter_merged(*tracks):
+    """
+    yields the frames of several tracks (each sorted by start time,
+    any iterable) as one timeline, in O(n log k) for k tracks
+
+    frames starting at the same time come in track order,
+    then in the order of their track
+    """
+    def keyed(track_index, frames):
+        for frame_index, frame in enumerate(frames):
+            yield frame.start.milliseconds(), track_index, frame_index, frame
+    
+    for start, track_index, frame_index, frame in heapq.merge(
+            *[keyed(track_index, frames) for track_index, frames in enumerate(tracks)]):
+        yield frame
+
+
+def iter_checked(frames, name='input'):
+    """
+    passes frames on, raising ValueError
+    if they are not sorted by start time
+    """
+    last = None
+    for frame in frames:
+        start = frame.start.milliseconds()
+        if last is not None and start < last:
+            raise ValueError("%s is not sorted by start time (%s after %s)" % (name, Timecode(start), Timecode(last)))
+        last = start
+        yield frame
+
+
+def iter_sorted(frames, max_frames=SORT_RUN_FRAMES, directory=None):
+    """
+    yields frames sorted by start time (stable), holding
+    at most max_frames of them in memory
+
+    inputs that fit are sorted in memory. bigger ones are cut into
+    sorted runs, saved to temporary files (in directory) and then
+    merged back with iter_merged
+    """
+    frames = iter(frames)
+    run = list(islice(frames, max_frames))
+    run.sort(key=lambda frame: frame.start.milliseconds())
+    if len(run) < max_frames:
+        for frame in run:
+            yield frame
+        return
+    
+    run_files = []
+    try:
+        while run:
+            run_file = tempfile.TemporaryFile(dir=directory)
+            run_files.append(run_file)
+            _write_run(run, run_file)
+            run = list(islice(frames, max_frames))
+            run.sort(key=lambda frame: frame.start.milliseconds())
+        
+        for run_file in run_files:
+            run_file.seek(0)
+        for frame in iter_merged(*[_read_run(run_file) for run_file in run_files]):
+            yield frame
+    finally:
+        for run_file in run_files:
+            run_file.close()
+
+
+def _write_run(frames, run_file):
+    dump = marshal.dump
+    for frame in frames:
+        dump((frame.start.milliseconds(), frame.end.milliseconds(), frame.lines), run_file)
+
+
+def _read_run(run_file):
+    load = marshal.load
+    while True:
+        try:
+            start, end, lines = load(run_file)
+        except EOFError:
+            return
+        yield SRTFrame(Timecode(start), Timecode(end), lines)
+
+
+#################################################
+# .srt parsing
+#################################################
+
+def get_file_type(file_path):
+    if file_path.endswith('.sjson'):
+        return 'sjson'
+    elif file_path.endswith('.sbin'):
+        return 'bin'
+    elif file_path.endswith('.srt'):
+        return 'srt'
+    else:
+        #fallback
+        return 'srt'
+
+@instrumented('parse')
+def parse(file_path):
+    """
+    parses a file by its extension, through
+    the active DocumentCache if there is one
+    """
+    if _active_cache is not None:
+        return _active_cache.parse(file_path)
+    return _parse_file(file_path)
+
+def _parse_file(file_path):
+    type_parse_functions = {
+        'sjson' : parse_sjson,
+        'srt' : parse_srt_bytes,
+        'bin' : parse_bin,
+    }
+    file_type = get_file_type(file_path)
+    file_handle = open(file_path, 'r' if file_type == 'sjson' else 'rb')
+    doc = type_parse_functions[file_type](file_handle)
+    add_count('cues read', len(doc.frames))
+    return doc
+
+def iter_frames(file_path):
+    """
+    yields the frames of a file in file order, by its extension,
+    without building a document. only .srt is streamed: a .sbin
+    is loaded in one go, and a .sjson's json is too
+    """
+    file_type = get_file_type(file_path)
+    if file_type == 'bin':
+        with open(file_path, 'rb') as file_handle:
+            frames = parse_bin(file_handle).frames
+        for frame in frames:
+            yield frame
+        return
+    
+    # closed once the frames run out (or the generator is)
+    with open(file_path, 'r' if file_type == 'sjson' else 'rb') as file_handle:
+        frames = iter_srt_bytes(file_handle) if file_type == 'srt' else iter_sjson(file_handle)
+        for frame in frames:
+            yield frame
+
+def parse_sjson(file_handle, compact=False):
+    """
+    returns an SRTDocuement from a sjson file,
+    or a CompactSRTDocument built straight from
+    the columns with compact
+    """
+    if compact:
+        return CompactSRTDocument.from_columns(*load_sjson_columns(file_handle))
+    return SRTDocument.from_frames(iter_sjson(file_handle))
+
+
+def load_sjson_columns(file_handle):
+    """
+    returns the (start, end, text) lists of a sjson file,
+    checking they are all there and of the same length
+    """
+    json_data = sjson_decoder.loads(file_handle.read())
+    
+    try:
+        columns = json_data['start'], json_data['end'], json_data['text']
+    except (KeyError, TypeError):
+        raise ValueError("sjson must be an object with start, end and text lists")
+    
+    if not len(columns[0]) == len(columns[1]) == len(columns[2]):
+        raise ValueError("sjson start, end and text lists have different lengths (%d, %d, %d)" %
+                         tuple(len(column) for column in columns))
+    return columns
+
+
+def iter_sjson(file_handle):
+    """
+    yields the SRTFrames of a sjson file in file order
+
+    the json itself has to be loaded in one go,
+    but no SRTDocument is built
+    """
+    starts, ends, texts = load_sjson_columns(file_handle)
+    for start, end, text in izip(starts, ends, texts):
+        yield SRTFrame(Timecode(start), Timecode(end), text.split('\n'))
+
+
+def parse_srt(file_handle):
+    """
+    returns an SRTDocument from a .srt file
+    """
+    return SRTDocument.from_frames(iter_srt(file_handle))
+
+
+def iter_srt(file_handle):
+    """
+    yields the SRTFrames of a .srt file in file order,
+    each one as soon as the blank line ending it is read
+
+    only the cue being read is held in memory
+    """
+    parser = SRTStreamParser()
+    feed_line = parser.feed_line
+    
+    for line in file_handle:
+        frame = feed_line(line)
+        if frame is not None:
+            yield frame
+    
+    for frame in parser.close():
+        yield frame
+
+
+class SRTStreamParser(object):
+    """
+    A push style .srt parser for text that arrives in pieces,
+    like a live caption feed
+
+    feed() takes chunks of any size (cut mid line or mid cue)
+    and returns the SRTFrames they completed. close() returns
+    the last, unterminated one
+    """
+    
+    def __init__(self):
+        self.state = 'waiting' # or time or text
+        self.start = None
+        self.end = None
+        self.lines = []
+        # the unterminated tail of the last chunk
+        self._partial = ''
+    
+    def feed(self, data):
+        """
+        returns the list of frames completed by data
+        """
+        if '\n' not in data:
+            self._partial += data
+            return []
+        
+        lines = data.split('\n')
+        lines[0] = self._partial + lines[0]
+        self._partial = lines.pop()
+        
+        feed_line = self.feed_line
+        frames = []
+        for line in lines:
+            frame = feed_line(line)
+            if frame is not None:
+                frames.append(frame)
+        return frames
+    
+    def feed_line(self, line):
+        """
+        advances the state machine by one whole line,
+        returns the frame it completed or None
+        """
+        line = line.strip()
+        state = self.state
+        
+        if state == 'waiting':
+            #assume its a valid SRT
+            if line:
+                self.state = 'time'
+        elif state == 'time':
+            self.start, self.end = parse_timecode_line(line)
+            self.state = 'text'
+        elif state == 'text':
+            if line == '':
+                # switch 
+                frame = SRTFrame(self.start, self.end, self.lines)
+                self.start = None
+                self.end = None
+                self.lines = []
+                self.state = 'waiting'
+                return frame
+            else:
+                self.lines.append(line)
+        return None
+    
+    def close(self):
+        """
+        ends the stream, returns the list of frames still pending
+        """
+        frames = []
+        if self._partial:
+            frame = self.feed_line(self._partial)
+            self._partial = ''
+            if frame is not None:
+                frames.append(frame)
+        if self.start is not None:
+            frames.append(SRTFrame(self.start, self.end, self.lines))
+        self.__init__()
+        return frames
+
+
+def follow_feeds(handles, on_frame, read_size=65536):
+    """
+    follows many live .srt feeds (sockets, pipes, ...) from one process,
+    calling on_frame(handle, frame) for every frame as it completes
+
+    each handle gets its own SRTStreamParser, and is read
+    whenever poll (or select) says it has data. returns once
+    every feed has reached end of file
+    """
+    parsers = dict((handle.fileno(), (handle, SRTStreamParser())) for handle in handles)
+    
+    if hasattr(select, 'poll'):
+        poller = select.poll()
+        for fd in parsers:
+            poller.register(fd, select.POLLIN | select.POLLPRI)
+        def ready():
+            return [fd for fd, event in poller.poll()]
+        forget = poller.unregister
+    else:
+        def ready():
+            return select.select(list(parsers), [], [])[0]
+        forget = lambda fd: None
+    
+    while parsers:
+        for fd in ready():
+            handle, parser = parsers[fd]
+            data = os.read(fd, read_size)
+            if data:
+                frames = parser.feed(data)
+            else:
+                frames = parser.close()
+                forget(fd)
+                del parsers[fd]
+            for frame in frames:
+                on_frame(handle, frame)
+
+
+#################################################
+# bulk .srt reading
+#################################################
+
+SRT_READ_BLOCK = 1 << 20
+
+# the byte order marks looked for, utf-32 first
+# as its little endian one starts with utf-16's
+SRT_BOMS = (
+    (codecs.BOM_UTF32_LE, 'utf-32-le'),
+    (codecs.BOM_UTF32_BE, 'utf-32-be'),
+    (codecs.BOM_UTF8, 'utf-8'),
+    (codecs.BOM_UTF16_LE, 'utf-16-le'),
+    (codecs.BOM_UTF16_BE, 'utf-16-be'),
+)
+
+# what files that aren't utf-8 are taken to be
+SRT_FALLBACK_ENCODING = 'cp1252'
+
+# the whitespace around line ends that line.strip() would remove
+_LINE_END_SPACE_RE = re.compile(r'[ \t\x0b\x0c]*\n[ \t\x0b\x0c]*')
+_BLANK_LINES_RE = re.compile(r'\n\n+')
+# HH:MM:SS,mmm --> HH:MM:SS,mmm, anything else goes through parse_timecode_line
+_CANONICAL_TIME_LINE_RE = re.compile(r'(\d\d):(\d\d):(\d\d)[,.](\d\d\d) --> (\d\d):(\d\d):(\d\d)[,.](\d\d\d)$')
+
+
+def detect_encoding(head):
+    """
+    guesses the encoding of a subtitle file from its first bytes,
+    returns (encoding, length of its byte order mark)
+
+    a byte order mark wins, then utf-16 without one is spotted
+    by its zero bytes, then whatever decodes as utf-8 is utf-8
+    and anything else cp1252
+    """
+    for bom, encoding in SRT_BOMS:
+        if head.startswith(bom):
+            return encoding, len(bom)
+    
+    sample = head[:4096]
+    if '\x00' in sample:
+        # mostly ascii text, so every other byte is zero
+        if sample[1::2].count('\x00') >= sample[::2].count('\x00'):
+            return 'utf-16-le', 0
+        return 'utf-16-be', 0
+    
+    try:
+        head.decode('utf-8')
+    except UnicodeDecodeError as error:
+        # but head may end mid character: a lead byte
+        # and less than 3 continuation bytes
+        tail = head[error.start:]
+        if not (len(tail) < 4 and all('\x80' <= byte <= '\xbf' for byte in tail[1:])):
+            return SRT_FALLBACK_ENCODING, 0
+    return 'utf-8', 0
+
+
+def iter_utf8_blocks(file_handle, encoding=None, block_size=SRT_READ_BLOCK):
+    """
+    yields the content of a file opened in binary mode as
+    utf-8 str, block_size bytes at a time, decoding it from
+    encoding (detected from the first block if None). a block
+    holding only part of a character yields nothing
+
+    utf-8 is only checked, not copied. if a later block of a file
+    detected as utf-8 turns out not to be, the rest is read as cp1252
+    """
+    # enough for any byte order mark
+    block = file_handle.read(max(block_size, 4))
+    if encoding is None:
+        encoding, bom_length = detect_encoding(block)
+        block = block[bom_length:] or file_handle.read(block_size)
+    
+    checking = codecs.lookup(encoding).name == 'utf-8'
+    decoder = codecs.getincrementaldecoder(encoding)('strict' if checking else 'replace')
+    # the start of a character cut by the end of the last block
+    pending = ''
+    while block:
+        if checking:
+            try:
+                decoder.decode(block)
+            except UnicodeDecodeError:
+                checking = False
+                decoder = codecs.getincrementaldecoder(SRT_FALLBACK_ENCODING)('replace')
+                block, pending = pending + block, ''
+            else:
+                # what the decoder holds back is a suffix of pending + block,
+                # and may be longer than block
+                data = pending + block
+                pending = decoder.getstate()[0]
+                if len(data) > len(pending):
+                    yield data[:len(data) - len(pending)]
+                block = file_handle.read(block_size)
+                continue
+        text = decoder.decode(block)
+        if text:
+            yield text.encode('utf-8')
+        block = file_handle.read(block_size)
+    
+    if checking:
+        if pending:
+            # the end of the file cut a character, or wasn't utf-8
+            yield pending.decode(SRT_FALLBACK_ENCODING, 'replace').encode('utf-8')
+    else:
+        tail = decoder.decode('', True)
+        if tail:
+            yield tail.encode('utf-8')
+
+
+def parse_srt_bytes(file_handle, encoding=None):
+    """
+    returns an SRTDocument from a .srt file opened in binary mode,
+    see iter_srt_bytes
+    """
+    return SRTDocument.from_frames(iter_srt_bytes(file_handle, encoding))
+
+
+def iter_srt_bytes(file_handle, encoding=None, block_size=SRT_READ_BLOCK):
+    """
+    yields the SRTFrames of a .srt file opened in binary mode,
+    the same ones as iter_srt but with the text always in utf-8
+
+    the file is read and decoded a block at a time (see
+    iter_utf8_blocks), so BOMs, utf-16 and cp1252 files work.
+    line ends are normalized and the cues cut at blank lines on
+    the whole block, leaving one split and one regex match per
+    cue to python
+    """
+    split_cues = _BLANK_LINES_RE.split
+    strip_line_ends = _LINE_END_SPACE_RE.sub
+    match_time_line = _CANONICAL_TIME_LINE_RE.match
+    
+    carry = ''
+    for block in chain(iter_utf8_blocks(file_handle, encoding, block_size), [None]):
+        if block is None:
+            # the end of the file
+            cues = split_cues(strip_line_ends('\n', carry.replace('\r', '\n')).strip())
+            carry = ''
+        else:
+            text = carry + block
+            held = ''
+            if text.endswith('\r'):
+                # its \n may start the next block
+                text, held = text[:-1], '\r'
+            # text always starts at a cue, so blank lines before it don't count
+            text = strip_line_ends('\n', text.replace('\r\n', '\n').replace('\r', '\n')).lstrip()
+            
+            cut = text.rfind('\n\n')
+            if cut == -1:
+                carry = text + held
+                continue
+            carry = text[cut + 2:] + held
+            while cut and text[cut - 1] == '\n':
+                cut -= 1
+            cues = split_cues(text[:cut])
+        
+        for cue in cues:
+            lines = cue.split('\n')
+            if len(lines) < 2:
+                # a number with no time, or nothing at all
+                continue
+            match = match_time_line(lines[1])
+            if match is None:
+                start, end = parse_timecode_line(lines[1])
+            else:
+                hh, mm, ss, ms, end_hh, end_mm, end_ss, end_ms = map(int, match.groups())
+                start = Timecode(((hh * 60 + mm) * 60 + ss) * 1000 + ms)
+                end = Timecode(((end_hh * 60 + end_mm) * 60 + end_ss) * 1000 + end_ms)
+            yield SRTFrame(start, end, lines[2:])
+
+
+#################################################
+# random access .srt reading
+#################################################
+
+class MappedSRTFile(object):
+    """
+    Random access to the cues of a (large) .srt file
+
+    the file is mmap-ed and scanned once for the byte range
+    and times of each cue. cues are only parsed when a query
+    needs them.
+
+    the scan is saved to a sidecar index file ([path].idx)
+    and reused as long as the file's size and mtime don't change
+    """
+    
+    INDEX_MAGIC = 'SRTIDX01'
+    # magic, itemsize of the arrays, file size, file mtime, cue count
+    INDEX_HEADER = struct.Struct('<8sqqdq')
+    INDEX_TYPECODE = 'l'
+    
+    def __init__(self, path, index_path=None, persist_index=True):
+        self.path = path
+        self.index_path = index_path or path + '.idx'
+        
+        self._file = open(path, 'rb')
+        stat = os.fstat(self._file.fileno())
+        if stat.st_size:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            # mmap can't map an empty file
+            self._map = ''
+        
+        key = (stat.st_size, stat.st_mtime)
+        columns = self._load_index(key)
+        if columns is None:
+            columns = self._scan()
+            if persist_index:
+                self._save_index(key, columns)
+        # all sorted by start
+        self.starts, self.ends, self.offsets, self.lengths = columns
+        self._intervals = IntervalIndex(self.starts, self.ends)
+    
+    def close(self):
+        if not isinstance(self._map, str):
+            self._map.close()
+        self._file.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+    
+    def __len__(self):
+        return len(self.starts)
+    
+    def _scan(self):
+        """
+        finds the byte range and times of every cue,
+        with the same state machine as iter_srt, but only
+        parsing the time lines
+
+        returns the (starts, ends, offsets, lengths) columns, by start
+        """
+        data = self._map
+        cues = []
+        state = 'waiting'
+        position = 0
+        size = len(data)
+        while position < size:
+            line_end = data.find('\n', position)
+            if line_end == -1:
+                line_end = size
+            line = data[position:line_end].strip()
+            
+            if state == 'waiting':
+                if line:
+                    cue_offset = position
+                    state = 'time'
+            elif state == 'time':
+                start, end = parse_timecode_line(line)
+                cues.append([start.milliseconds(), end.milliseconds(), cue_offset, None])
+                state = 'text'
+            elif state == 'text':
+                if line == '':
+                    cues[-1][3] = position - cues[-1][2]
+                    state = 'waiting'
+            position = line_end + 1
+        
+        if cues and cues[-1][3] is None:
+            cues[-1][3] = size - cues[-1][2]
+        
+        # sort is stable, so file order breaks ties, like SRTDocument
+        cues.sort(key=lambda cue: cue[0])
+        return tuple(array(self.INDEX_TYPECODE, column) for column in zip(*cues)) or \
+            tuple(array(self.INDEX_TYPECODE) for _ in range(4))
+    
+    def _load_index(self, key):
+        """
+        the columns saved in the sidecar index, or None
+        if there is none or it is out of date
+        """
+        try:
+            index_file = open(self.index_path, 'rb')
+        except IOError:
+            return None
+        
+        with index_file:
+            header = index_file.read(self.INDEX_HEADER.size)
+            if len(header) != self.INDEX_HEADER.size:
+                return None
+            magic, itemsize, size, mtime, count = self.INDEX_HEADER.unpack(header)
+            if (magic != self.INDEX_MAGIC or (size, mtime) != key or
+                    itemsize != array(self.INDEX_TYPECODE).itemsize):
+                return None
+            columns = []
+            for _ in range(4):
+                column = array(self.INDEX_TYPECODE)
+                try:
+                    column.fromfile(index_file, count)
+                except EOFError:
+                    return None
+                columns.append(column)
+        return tuple(columns)
+    
+    def _save_index(self, key, columns):
+        size, mtime = key
+        try:
+            with open(self.index_path, 'wb') as index_file:
+                index_file.write(self.INDEX_HEADER.pack(
+                    self.INDEX_MAGIC, array(self.INDEX_TYPECODE).itemsize, size, mtime, len(columns[0])))
+                for column in columns:
+                    column.tofile(index_file)
+        except IOError:
+            # the index is only a cache
+            pass
+    
+    def frame(self, index):
+        """
+        parses the cue at index (in start order)
+        """
+        offset = self.offsets[index]
+        block = self._map[offset:offset + self.lengths[index]]
+        for frame in iter_srt(block.splitlines()):
+            return frame
+    
+    @property
+    def frames(self):
+        """
+        all the frames, parsed one at a time
+        """
+        for index in xrange(len(self)):
+            yield self.frame(index)
+    
+    def document(self):
+        """
+        parses every cue into an SRTDocument
+        """
+        return SRTDocument.from_frames(self.frames, presorted=True)
+    
+    def frames_active_at(self, time):
+        """
+        returns the list of frames on screen at time
+        """
+        return [self.frame(index) for index in self._intervals.active_at(_to_milliseconds(time))]
+    
+    def frames_between(self, start, end):
+        """
+        returns the list of frames on screen at some point
+        in [start, end), see SRTDocument.frames_between
+        """
+        indexes = self._intervals.overlapping(_to_milliseconds(start), _to_milliseconds(end))
+        return [self.frame(index) for index in indexes]
+    
+    def slice(self, start, end):
+        """
+        the part of the file from start to end, exactly
+        doc.split(start)[1].split(end)[0] on the whole document,
+        but only parsing the cues that it needs
+        """
+        start = _to_milliseconds(start)
+        end = _to_milliseconds(end)
+        indexes = self._intervals.overlapping(start, end)
+        # the first cue after end says how long the blank
+        # that split puts at the end is
+        after = bisect_left(self.starts, end)
+        if after < len(self) and after not in indexes:
+            indexes.append(after)
+        doc = SRTDocument.from_frames([self.frame(index) for index in indexes], presorted=True)
+        return doc.split(Timecode(start))[1].split(Timecode(end))[0]
+
+
+#################################################
+# .srt and .sjson writing
+#################################################
+
+# how many frames to format before each write
+WRITE_BATCH = 512
+
+@instrumented('write')
+def write_srt(frames, out_handle):
+    """
+    writes the frames to out_handle in .srt format,
+    numbering them from 1
+
+    frames can be any iterable (a list, a generator...),
+    output is written in batches as it is formatted
+    """
+    pieces = ['\n']
+    index = -1
+    for index, frame in enumerate(frames):
+        pieces.append('%d\n' % (index + 1))
+        pieces.append(str(frame))
+        pieces.append('\n')
+        if len(pieces) >= WRITE_BATCH * 3:
+            out_handle.write(''.join(pieces))
+            pieces = []
+    out_handle.write(''.join(pieces))
+    add_count('cues written', index + 1)
+
+
+# the strings between sjson values, indented for people or compact for machines:
+# object start, key, first value, between values, column end, between columns, object end
+SJSON_LAYOUTS = {
+    False: ('{', '\n    "%s": [', '\n        ', ',\n        ', '\n    ]', ',', '\n}\n'),
+    True: ('{', '"%s":[', '', ',', ']', ',', '}\n'),
+}
+
+
+@instrumented('write')
+def write_sjson(frames, out_handle, compact=False):
+    """
+    writes the frames to out_handle in .sjson format,
+    without any indentation with compact
+
+    sjson is column oriented, so the frames are read once per column.
+    if frames is a one-shot iterator instead, the start times are
+    written straight out while the end times and texts are spooled to
+    temporary files, so memory use does not grow with the input.
+    the frames of a CompactSRTDocument are written from its arrays
+    """
+    layout = SJSON_LAYOUTS[bool(compact)]
+    open_object, open_column, first, between, close_column, next_column, close_object = layout
+    columns = [
+        ('start', lambda frame: '%d' % frame.start.milliseconds()),
+        ('end', lambda frame: '%d' % frame.end.milliseconds()),
+        ('text', lambda frame: json.dumps(frame.text())),
+    ]
+    
+    if isinstance(frames, _CompactFrames):
+        doc = frames._doc
+        _write_sjson_columns([
+            ('start', doc.starts, str),
+            ('end', doc.ends, str),
+            ('text', doc.texts(), json.dumps),
+        ], out_handle, layout)
+        add_count('cues written', len(doc))
+        return
+    
+    if iter(frames) is not frames:
+        _write_sjson_columns(
+            [(key, frames, format_value) for key, format_value in columns],
+            out_handle, layout,
+        )
+        if hasattr(frames, '__len__'):
+            add_count('cues written', len(frames))
+        return
+    
+    # single pass over an iterator: the first column goes straight out
+    out_handle.write(open_object + open_column % columns[0][0])
+    spools = [out_handle] + [tempfile.TemporaryFile() for _ in columns[1:]]
+    pieces = [[] for _ in columns]
+    separator = first
+    count = -1
+    for count, frame in enumerate(frames):
+        for column_pieces, (key, format_value) in zip(pieces, columns):
+            column_pieces.append(separator + format_value(frame))
+        separator = between
+        if count % WRITE_BATCH == WRITE_BATCH - 1:
+            for column_pieces, spool in zip(pieces, spools):
+                spool.write(''.join(column_pieces))
+                del column_pieces[:]
+    out_handle.write(''.join(pieces[0]))
+    out_handle.write(close_column)
+    
+    for column_pieces, spool, (key, format_value) in zip(pieces, spools, columns)[1:]:
+        out_handle.write(next_column + open_column % key)
+        spool.write(''.join(column_pieces))
+        spool.seek(0)
+        shutil.copyfileobj(spool, out_handle)
+        spool.close()
+        out_handle.write(close_column)
+    out_handle.write(close_object)
+    add_count('cues written', count + 1)
+
+
+def _write_sjson_columns(columns, out_handle, layout=SJSON_LAYOUTS[False]):
+    """
+    columns is a list of (key, values, format_value),
+    each values is iterated once, in order
+    """
+    open_object, open_column, first, between, close_column, next_column, close_object = layout
+    out_handle.write(open_object)
+    for column_index, (key, values, format_value) in enumerate(columns):
+        if column_index:
+            out_handle.write(next_column)
+        out_handle.write(open_column % key)
+        _write_column(values, format_value, out_handle, first, between)
+        out_handle.write(close_column)
+    out_handle.write(close_object)
+
+
+def _write_column(values, format_value, out_handle, first='\n        ', between=',\n        '):
+    pieces = []
+    separator = first
+    for value in values:
+        pieces.append(separator + format_value(value))
+        separator = between
+        if len(pieces) >= WRITE_BATCH:
+            out_handle.write(''.join(pieces))
+            pieces = []
+    out_handle.write(''.join(pieces))
+
+
+#################################################
+# .sbin binary format
+#################################################
+
+# .sbin layout, all integers little endian:
+#   header: magic 'SRTB', version (uint16), reserved (uint16),
+#           cue count n (int64), text length (int64)
+#   starts: n int64 milliseconds
+#   ends:   n int64 milliseconds
+#   text offsets: n + 1 int64, cue i's text is text[offsets[i]:offsets[i + 1]]
+#   text:   the cue texts back to back (lines joined by newlines)
+BIN_MAGIC = 'SRTB'
+BIN_VERSION = 1
+BIN_HEADER = struct.Struct('<4sHHqq')
+
+def _pack_int64s(values):
+    """
+    values (an array or list of ints) as little endian int64 bytes
+    """
+    column = array(CompactSRTDocument.TIME_TYPECODE, values)
+    if column.itemsize != 8:
+        return struct.pack('<%dq' % len(column), *column)
+    if sys.byteorder != 'little':
+        column.byteswap()
+    return column.tostring()
+
+
+def _unpack_int64s(data, offset, count):
+    """
+    count little endian int64s from data at offset, as an array
+    """
+    column = array(CompactSRTDocument.TIME_TYPECODE)
+    if column.itemsize != 8:
+        column.extend(struct.unpack_from('<%dq' % count, data, offset))
+        return column
+    column.fromstring(buffer(data, offset, count * 8))
+    if sys.byteorder != 'little':
+        column.byteswap()
+    return column
+
+
+@instrumented('write')
+def write_bin(frames, out_handle):
+    """
+    writes the frames to out_handle in .sbin format
+
+    the frames of a CompactSRTDocument are written
+    straight from its arrays
+    """
+    if isinstance(frames, _CompactFrames):
+        doc = frames._doc
+        starts, ends, texts = doc.starts, doc.ends, doc.texts()
+    else:
+        starts = array(CompactSRTDocument.TIME_TYPECODE)
+        ends = array(CompactSRTDocument.TIME_TYPECODE)
+        texts = []
+        for frame in frames:
+            starts.append(frame.start.milliseconds())
+            ends.append(frame.end.milliseconds())
+            texts.append(frame.text())
+    
+    # the blob is utf-8, and the offsets count its bytes
+    offsets = [0]
+    text = []
+    for cue_text in texts:
+        if isinstance(cue_text, unicode):
+            cue_text = cue_text.encode('utf-8')
+        text.append(cue_text)
+        offsets.append(offsets[-1] + len(cue_text))
+    text = ''.join(text)
+    
+    out_handle.write(BIN_HEADER.pack(BIN_MAGIC, BIN_VERSION, 0, len(starts), len(text)))
+    out_handle.write(_pack_int64s(starts))
+    out_handle.write(_pack_int64s(ends))
+    out_handle.write(_pack_int64s(offsets))
+    out_handle.write(text)
+    add_count('cues written', len(starts))
+
+
+def parse_bin(file_handle):
+    """
+    returns a CompactSRTDocument from a .sbin file,
+    with the text as utf-8 str like parse_srt_bytes
+
+    the columns are copied straight into arrays,
+    no frames are built
+    """
+    data = file_handle.read()
+    if len(data) < BIN_HEADER.size:
+        raise ValueError("Not an .sbin file: too short")
+    
+    magic, version, reserved, count, text_length = BIN_HEADER.unpack_from(data)
+    if magic != BIN_MAGIC:
+        raise ValueError("Not an .sbin file: bad magic")
+    if version != BIN_VERSION:
+        raise ValueError("Unsupported .sbin version %d" % version)
+    
+    text_offset = BIN_HEADER.size + (3 * count + 1) * 8
+    if len(data) != text_offset + text_length:
+        raise ValueError("Truncated or corrupt .sbin file")
+    
+    starts = _unpack_int64s(data, BIN_HEADER.size, count)
+    ends = _unpack_int64s(data, BIN_HEADER.size + count * 8, count)
+    offsets = _unpack_int64s(data, BIN_HEADER.size + 2 * count * 8, count + 1)
+    return CompactSRTDocument(
+        starts, ends, data[text_offset:], offsets[:-1], offsets[1:], presorted=True,
+    )
+
+
+#################################################
+# document cache
+#################################################
+
+class DocumentCache(object):
+    """
+    parse() with a memory, for services that load the same
+    files over and over
+
+    documents are kept as CompactSRTDocuments (they are small, and
+    every operation on them returns a new document, so one copy can
+    be handed to every caller) in an LRU holding at most max_bytes.
+
+    a file is known by its path, size and mtime, or with
+    key='content' by a sha1 of its bytes (which still reads the
+    file, but survives touches and copies).
+
+    with a store_directory, every parsed document is also saved
+    there as .sbin, and read back instead of parsing again, also
+    by other processes. nothing is ever removed from the store
+
+    while a cache is active, parse() goes through it:
+
+    with DocumentCache() as cache:
+        doc = parse('in.srt')
+
+    it can be shared between threads
+    """
+    
+    def __init__(self, max_bytes=64 * 1024 * 1024, store_directory=None, key='stat'):
+        if key not in ('stat', 'content'):
+            raise ValueError("DocumentCache key must be 'stat' or 'content'")
+        self.max_bytes = max_bytes
+        self.store_directory = store_directory
+        self.key = key
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.store_hits = 0
+        self.evictions = 0
+        self._documents = LRUCache(sys.maxint)
+        self._lock = threading.Lock()
+        self._previous = None
+    
+    def __enter__(self):
+        global _active_cache
+        self._previous = _active_cache
+        _active_cache = self
+        return self
+    
+    def __exit__(self, *exc_info):
+        global _active_cache
+        _active_cache = self._previous
+        self._previous = None
+    
+    def __len__(self):
+        return len(self._documents)
+    
+    def _key(self, file_path):
+        if self.key == 'content':
+            digest = hashlib.sha1()
+            with open(file_path, 'rb') as file_handle:
+                for block in iter(functools.partial(file_handle.read, 1 << 20), ''):
+                    digest.update(block)
+            return get_file_type(file_path), digest.hexdigest()
+        
+        stat = os.stat(file_path)
+        return os.path.realpath(file_path), stat.st_size, stat.st_mtime
+    
+    def parse(self, file_path):
+        """
+        the CompactSRTDocument of file_path, from memory,
+        the store or parsing it
+        """
+        key = self._key(file_path)
+        with self._lock:
+            entry = self._documents.get(key)
+            if entry is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if entry is not None:
+            add_count('cache hits')
+            return entry[0]
+        
+        # parsed outside the lock, two threads missing
+        # the same file at once both parse it
+        add_count('cache misses')
+        doc = self._load_stored(key)
+        if doc is None:
+            doc = _parse_file(file_path)
+            if not isinstance(doc, CompactSRTDocument):
+                doc = CompactSRTDocument.from_document(doc)
+            self._store(key, doc)
+        
+        self._keep(key, doc)
+        return doc
+    
+    def _keep(self, key, doc):
+        size = document_bytes(doc)
+        if size > self.max_bytes:
+            return
+        
+        with self._lock:
+            if key in self._documents:
+                return
+            self._documents[key] = (doc, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                old_key, (old_doc, old_size) = self._documents.pop_oldest()
+                self.bytes -= old_size
+                self.evictions += 1
+                add_count('cache evictions')
+    
+    def _stored_path(self, key):
+        return os.path.join(self.store_directory, hashlib.sha1(repr(key)).hexdigest() + '.sbin')
+    
+    def _load_stored(self, key):
+        if not self.store_directory:
+            return None
+        try:
+            file_handle = open(self._stored_path(key), 'rb')
+        except IOError:
+            return None
+        with file_handle:
+            try:
+                doc = parse_bin(file_handle)
+            except ValueError:
+                return None
+        with self._lock:
+            self.store_hits += 1
+        add_count('cache store hits')
+        return doc
+    
+    def _store(self, key, doc):
+        if not self.store_directory:
+            return
+        if not os.path.isdir(self.store_directory):
+            os.makedirs(self.store_directory)
+        # written aside and renamed, so readers never see half a file
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=self.store_directory, suffix='.tmp')
+        with os.fdopen(file_descriptor, 'wb') as file_handle:
+            write_bin(doc.frames, file_handle)
+        os.rename(temporary_path, self._stored_path(key))
+    
+    def clear(self):
+        """
+        forgets every document held in memory (not the store)
+        """
+        with self._lock:
+            self._documents.clear()
+            self.bytes = 0
+    
+    def stats(self):
+        return {
+            'documents': len(self._documents),
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'store_hits': self.store_hits,
+            'evictions': self.evictions,
+        }
+
+
+_active_cache = None
+
+
+def document_bytes(doc):
+    """
+    roughly how much memory a CompactSRTDocument holds
+    """
+    return (
+        sys.getsizeof(doc.text) +
+        sum(column.itemsize * len(column) for column in
+            (doc.starts, doc.ends, doc.text_starts, doc.text_ends))
+    )
+
+
+def command_delete(args):
+    """python srt.py delete [filename] [start] [end]
+    
+    deletes the segment described by [start] [end]
+
+    start and end should be a HH:MM:SS,MMM timestamp
+    they can also be the words 'start' or 'end'
+    
+    the start time of the new file will always be the same
+    as the start time of the original one
+
+    this prints the new file to stdout
+    """
+    if not args:
+        raise ValueError("delete must be called with a filename argument")
+    
+    filename = args.pop(0)
+    # a lazy view: the splits, add and shift below only move
+    # ranges around, frames are built once, as they are written
+    doc = parse(filename).view()
+    
+    input_start_time = doc.first_start()
+    if input_start_time is None:
+        input_start_time = Timecode(0) # it doesn't matter
+    
+    start_string = args[0]
+    end_string = args[1]
+    
+    if start_string == 'start':
+        start = input_start_time
+    else:
+        start =  Timecode.from_string(start_string)    
+    
+    if end_string == 'end':
+        end = Timecode(sys.maxint)
+    else:
+        end = Timecode.from_string(end_string)
+        
+    
+    with phase('edit'):
+        left, right = doc.split(start)
+        gone, right = right.split(end)
+        
+        result = left.add(right)
+        # ok...  i promise that the start time of the result will be the start time of the input
+        # this is pretty ok. it will either be the start time already (in the case of an interiror delete)
+        # or it will be later (in the case of a delete starting at start or earlier)
+        # so if we store the original start time, this is fine
+        result_start_time = result.first_start()
+        if result_start_time is not None:
+            # we only have to even worry about the shift if there is a result!
+            diff = (result_start_time - input_start_time).milliseconds()
+        
+            if diff < 0:
+                raise AssertionError("Start time of the result should never be before start time of the input!")
+            elif diff > 0:
+                # then we have to do a shift
+                result = result.shift(-1 * diff)
+    
+    write_srt(result, sys.stdout)
+    return result
+
+def command_split(args):
+    """python srt.py split [filename] [timestamp]+
+    
+    splits the file at the given timestamps
+    timestamp has format HH:MM:SS,MMM
+    
+    The timestamps should be in increasing order!
+    
+    writes the files out with format [infile]_0.srt
+    with the digit ranging up
+    
+    ALL RESULTING FILES WILL BE SHIFTED TO START AT 0
+    we'll see how use cases develop for this
+    """
+    if not args:
+        raise ValueError("Split must be given arguments!")
+    
+    filename = args.pop(0)
+    doc = parse(filename)
+    
+    if not args:
+        raise ValueError("Split must be called with at least one timestamp")
+    
+    timecodes = [Timecode.from_string(arg) for arg in args]
+    
+    # the pieces are built one at a time as we write them out
+    out_list = doc.split_many(timecodes, normalize=True)
+    
+    # lets get our format... lets strip a .srt if there is one
+    if filename.endswith('.srt'):
+        filename = filename[:-4]
+        
+    FORMAT_STRING = "%s_%%d.srt" % filename
+    
+    for index, srt_document in enumerate(out_list):
+        add_count('pieces')
+        out_file_handle = open(FORMAT_STRING % index, 'w')
+        write_srt(srt_document.frames, out_file_handle)
+        out_file_handle.close()
+        
+def command_slice(args):
+    """python srt.py slice [filename] [start] [end]
+    
+    prints the part of the .srt file between start and end
+    (HH:MM:SS,MMM timestamps), with the cues cut at them,
+    without parsing the rest of the file
+    
+    the cue index is kept in [filename].idx and reused
+    until the file changes
+    """
+    if len(args) != 3:
+        raise ValueError("slice must be called with a filename, a start and an end")
+    
+    filename, start_string, end_string = args
+    with MappedSRTFile(filename) as mapped:
+        doc = mapped.slice(Timecode.from_string(start_string), Timecode.from_string(end_string))
+    write_srt(doc.frames, sys.stdout)
+    
+
+def command_srt2sjson(args):
+    """python srt.py srt2sjson [--stream] [--compact] [filename | -]
+    
+    converts the file name given to a sjson file
+    (from a srt file)
+    accepts input from stdin by giving a dash
+    
+    with --stream, frames are converted as they are read
+    and memory use does not grow with the file size
+    (the input is not sorted)
+    
+    with --compact, the sjson has no indentation or newlines
+    
+    prints result to stdout
+    """
+    
+    stream = '--stream' in args
+    compact = '--compact' in args
+    args = [arg for arg in args if arg not in ('--stream', '--compact')]
+    
+    try:
+        filename = args[0]
+    except IndexError:
+        filename = '-'
+        
+    if stream:
+        if filename == '-':
+            write_sjson(iter_srt(sys.stdin), sys.stdout, compact)
+        else:
+            with open(filename, 'r') as file_handle:
+                write_sjson(iter_srt(file_handle), sys.stdout, compact)
+        return
+    
+    if filename == '-':
+        doc = parse_srt_bytes(sys.stdin)
+    else:
+        # through parse, to use the server's cache
+        doc = parse(filename)
+    write_sjson(doc.frames, sys.stdout, compact)
+    
+def command_sjson2srt(args):
+    """python srt.py sjson2srt [--stream] [filename | -]
+
+    converts the file name given to a srt file
+    (from a sjson file)
+    accepts input from stdin by giving a dash
+
+    with --stream, frames are written out one at a time
+    instead of building a document first
+    (the input is not sorted)
+
+    prints result to stdout
+    """
+
+    stream = '--stream' in args
+    args = [arg for arg in args if arg != '--stream']
+
+    try:
+        filename = args[0]
+    except IndexError:
+        filename = '-'
+
+    if filename == '-':
+        file_handle = sys.stdin
+    else:
+        file_handle = open(filename, 'r')
+
+    if stream:
+        write_srt(iter_sjson(file_handle), sys.stdout)
+        return
+
+    # no need for frames until they are written
+    doc = parse_sjson(file_handle, compact=True)
+    write_srt(doc.frames, sys.stdout)
+
+        
+    
+
+def command_cat(args):
+    """python srt.py cat [file1] [file2]...
+    
+    Concatenates the given SRT files (in the order given)
+    and prints the result to stdout.
+    
+    each file is shifted to start where the previous one ends.
+    files can be .srt or .sjson, the output has the type of the first
+    """
+    
+    if not args:
+        raise ValueError("Cannot concatenate no files!")
+
+    first = args[0]
+    output_type = get_file_type(first)
+
+    # parsed lazily, so only one input is in memory at a time
+    srt_docs = (parse(filename) for filename in args)
+    
+    type_write_functions = {
+        'sjson' : write_sjson,
+        'srt' : write_srt,
+        'bin' : write_bin,
+    }
+    type_write_functions[output_type](iter_concatenated(srt_docs), sys.stdout)
+    
+
+#################################################
+# batch processing
+#################################################
+
+# operations batch can run, and the suffix of the file
+# each one's output is written to (split writes its own files)
+BATCH_OUTPUT_SUFFIXES = {
+    'delete' : '.deleted.srt',
+    'split' : None,
+    'srt2sjson' : '.sjson',
+    'sjson2srt' : '.srt',
+    'srt2bin' : '.sbin',
+    'bin2srt' : '.srt',
+}
+
+def batch_output_path(operation, path):
+    """
+    where batch writes the output of operation on path
+    """
+    suffix = BATCH_OUTPUT_SUFFIXES[operation]
+    if suffix is None:
+        return None
+    base, extension = os.path.splitext(path)
+    return base + suffix
+
+
+def batch_inputs(source):
+    """
+    the input files named by source:
+    '-' reads a manifest of paths (one per line) from stdin,
+    '@file' reads one from file, anything else is a glob
+    """
+    if source == '-':
+        lines = sys.stdin
+    elif source.startswith('@'):
+        lines = open(source[1:], 'r')
+    else:
+        return sorted(glob.glob(source))
+    return [line.strip() for line in lines if line.strip()]
+
+
+def _batch_worker(task):
+    """
+    runs one batch task in a worker process.
+    returns (path, None) or (path, error message)
+    """
+    operation, path, operation_args, overwrite = task
+    output_path = batch_output_path(operation, path)
+    # sjson2srt and bin2srt write x.srt, which may well be another input
+    if output_path is not None and not overwrite and os.path.exists(output_path):
+        return (path, "%s exists, not overwritten (see --overwrite)" % output_path)
+    
+    # each worker runs one task at a time,
+    # so it can point stdout at the task's output file
+    saved_stdout = sys.stdout
+    try:
+        if output_path is not None:
+            sys.stdout = open(output_path, 'wb')
+        command_dict[operation]([path] + list(operation_args))
+    except Exception as failure:
+        error = "%s: %s" % (failure.__class__.__name__, failure)
+    else:
+        error = None
+    finally:
+        if sys.stdout is not saved_stdout:
+            sys.stdout.close()
+            sys.stdout = saved_stdout
+    
+    if error is not None and output_path is not None and os.path.exists(output_path):
+        os.remove(output_path)
+    return (path, error)
+
+
+def run_batch(operation, paths, operation_args=(), workers=None, chunksize=1, overwrite=False):
+    """
+    runs operation on each of paths across a pool of worker processes,
+    yielding (path, error) as each file finishes (error is None on success)
+
+    workers defaults to the number of CPUs. with one worker
+    the files are processed in this process. a file whose output
+    already exists is an error, unless overwrite is True
+    """
+    if operation not in BATCH_OUTPUT_SUFFIXES:
+        raise ValueError("batch cannot run %s" % operation)
     
-    the start time of the new file will always be the same
-    as the start time of the original one
+    tasks = ((operation, path, tuple(operation_args), overwrite) for path in paths)
+    workers = workers or multiprocessing.cpu_count()
+    
+    if workers == 1:
+        for task in tasks:
+            yield _batch_worker(task)
+        return
+    
+    pool = multiprocessing.Pool(workers)
+    try:
+        for result in pool.imap_unordered(_batch_worker, tasks, chunksize):
+            yield result
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
 
-    this prints the new file to stdout
+
+def command_batch(args):
+    """python srt.py batch [--workers N] [--chunksize N] [--overwrite] [operation] [files] [args]*
+    
+    runs operation (delete, split, srt2sjson, sjson2srt,
+    srt2bin or bin2srt) on many files at once,
+    in parallel worker processes
+    
+    files is a glob ('subs/*.srt', quote it), @manifest for a file
+    listing one path per line, or - to read that list from stdin.
+    any args are passed to the operation after the filename
+    
+    output that the operation would print goes to a file next to
+    each input: .sjson for srt2sjson, .srt for sjson2srt and bin2srt,
+    .sbin for srt2bin, .deleted.srt for delete. files whose output
+    already exists fail and are left alone, unless --overwrite is given
+    
+    --workers defaults to the number of CPUs, --chunksize to 1
+    
+    failures are reported per file on stderr, with a summary
     """
-    if not args:
-        raise ValueError("delete must be called with a filename argument")
+    args = list(args)
+    options = {'--workers' : None, '--chunksize' : 1}
+    overwrite = False
+    while args and (args[0] in options or args[0] == '--overwrite'):
+        option = args.pop(0)
+        if option == '--overwrite':
+            overwrite = True
+        else:
+            options[option] = int(args.pop(0))
     
-    filename = args.pop(0)
-    doc = parse(filename)
+    if len(args) < 2:
+        raise ValueError("batch must be given an operation and files")
     
-    if doc.frames:
-        input_start_time = doc.frames[0].start
-    else:
-        input_start_time = Timecode(0) # it doesn't matter
+    operation = args.pop(0)
+    paths = batch_inputs(args.pop(0))
     
-    start_string = args[0]
-    end_string = args[1]
+    started = time.time()
+    failures = 0
+    for path, error in run_batch(operation, paths, args, options['--workers'], options['--chunksize'], overwrite):
+        if error is not None:
+            failures += 1
+            sys.stderr.write("%s: %s\n" % (path, error))
+    elapsed = time.time() - started
     
-    if start_string == 'start':
-        start = input_start_time
-    else:
-        start =  Timecode.from_string(start_string)    
+    sys.stderr.write("%d files, %d failed, %.2fs (%.1f files/s)\n" % (
+        len(paths), failures, elapsed, len(paths) / elapsed if elapsed else 0))
+    if failures:
+        sys.exit(1)
+
+
+#################################################
+# full text index
+#
+# an sqlite database of every word of every cue of a corpus:
+# files (path, size, mtime), cues (file, cue index in the parsed
+# document, start, end, text) and postings (file, cue, position
+# of the word in the cue, token). postings are keyed by position,
+# for phrases, and indexed by token, for lookups and prefixes
+#################################################
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cues (
+    file_id INTEGER NOT NULL,
+    cue INTEGER NOT NULL,
+    start INTEGER NOT NULL,
+    end INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    PRIMARY KEY (file_id, cue)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS postings (
+    file_id INTEGER NOT NULL,
+    cue INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    token TEXT NOT NULL,
+    PRIMARY KEY (file_id, cue, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS postings_token ON postings (token);
+"""
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# files SubtitleIndex.update indexes between commits
+INDEX_COMMIT_FILES = 256
+
+# one match of SubtitleIndex.search, times in ms
+SearchHit = namedtuple('SearchHit', 'path cue start end text')
+
+
+def tokenize(text):
+    """
+    the lowercased words of text, as unicode
+    """
+    if isinstance(text, str):
+        text = text.decode('utf-8', 'replace')
+    return TOKEN_RE.findall(text.lower())
+
+
+def _index_worker(path):
+    """
+    parses one file for the index, in a worker process.
+    returns (path, size, mtime, cues, error), cues being
+    (cue, start, end, text, tokens) for each cue
+    """
+    try:
+        stat = os.stat(path)
+        cues = []
+        for cue, frame in enumerate(parse(path).frames):
+            text = frame.text()
+            if isinstance(text, str):
+                text = text.decode('utf-8', 'replace')
+            cues.append((cue, frame.start.milliseconds(), frame.end.milliseconds(), text, tokenize(text)))
+    except Exception as error:
+        return (path, None, None, None, "%s: %s" % (error.__class__.__name__, error))
+    return (path, stat.st_size, stat.st_mtime, cues, None)
+
+
+class SubtitleIndex(object):
+    """
+    A persistent inverted index of the words in a corpus of
+    .srt/.sjson/.sbin files, see the notes above
+
+    update() (re)indexes the files that changed since the last
+    time, parsing them across a pool of processes. search()
+    finds phrases (words next to each other in one cue), with
+    the last word a prefix if asked
+    """
     
-    if end_string == 'end':
-        end = Timecode(sys.maxint)
-    else:
-        end = Timecode.from_string(end_string)
-        
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self.connection = sqlite3.connect(index_path)
+        self.connection.execute('PRAGMA journal_mode = WAL')
+        self.connection.execute('PRAGMA synchronous = NORMAL')
+        self.connection.executescript(INDEX_SCHEMA)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
     
-    left, right = doc.split(start)
-    gone, right = right.split(end)
+    def close(self):
+        self.connection.close()
+    
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM files').fetchone()[0]
     
+    def update(self, paths, workers=None, chunksize=16):
+        """
+        indexes the files of paths that are new or changed (by size
+        and mtime), returns {'indexed': n, 'unchanged': n, 'errors': [(path, error)]}
 
-    result = left.add(right)
-    # ok...  i promise that the start time of the result will be the start time of the input
-    # this is pretty ok. it will either be the start time already (in the case of an interiror delete)
-    # or it will be later (in the case of a delete starting at start or earlier)
-    # so if we store the original start time, this is fine
-    if result.frames:
-        # we only have to even worry about the shift if there is a result!
-        result_start_time = result.frames[0].start
-        diff = (result_start_time - input_start_time).milliseconds()
+        workers defaults to the number of CPUs. with one worker
+        the files are parsed in this process
+        """
+        known = dict(
+            (path, (size, mtime)) for path, size, mtime in
+            self.connection.execute('SELECT path, size, mtime FROM files')
+        )
+        summary = {'indexed': 0, 'unchanged': 0, 'errors': []}
+        changed = []
+        for path in paths:
+            path = os.path.abspath(path)
+            try:
+                stat = os.stat(path)
+            except OSError as error:
+                summary['errors'].append((path, "%s: %s" % (error.__class__.__name__, error)))
+                continue
+            if known.get(path) == (stat.st_size, stat.st_mtime):
+                summary['unchanged'] += 1
+            else:
+                changed.append(path)
+        
+        workers = min(workers or multiprocessing.cpu_count(), len(changed) or 1)
+        if workers == 1:
+            results = imap(_index_worker, changed)
+            pool = None
+        else:
+            pool = multiprocessing.Pool(workers)
+            results = pool.imap_unordered(_index_worker, changed, chunksize)
+        
+        # sqlite has one writer: the workers parse, this process writes,
+        # committing every so often so an interrupted build keeps its work
+        try:
+            for path, size, mtime, cues, error in results:
+                if error is not None:
+                    summary['errors'].append((path, error))
+                    continue
+                self._store(path, size, mtime, cues)
+                summary['indexed'] += 1
+                if summary['indexed'] % INDEX_COMMIT_FILES == 0:
+                    self.connection.commit()
+            self.connection.commit()
+            if pool is not None:
+                pool.close()
+        except:
+            self.connection.rollback()
+            if pool is not None:
+                pool.terminate()
+            raise
+        finally:
+            if pool is not None:
+                pool.join()
         
-        if diff < 0:
-            raise AssertionError("Start time of the result should never be before start time of the input!")
-        elif diff > 0:
-            # then we have to do a shift
-            result = result.shift(-1 * diff)
+        self.connection.execute('PRAGMA optimize')
+        return summary
     
-    print result
-    return result
-
-def command_split(args):
-    """python srt.py split [filename] [timestamp]+
+    def _store(self, path, size, mtime, cues):
+        connection = self.connection
+        row = connection.execute('SELECT id FROM files WHERE path = ?', (path,)).fetchone()
+        if row is None:
+            file_id = connection.execute(
+                'INSERT INTO files (path, size, mtime) VALUES (?, ?, ?)', (path, size, mtime)).lastrowid
+        else:
+            file_id = row[0]
+            self._forget(file_id)
+            connection.execute('UPDATE files SET size = ?, mtime = ? WHERE id = ?', (size, mtime, file_id))
+        
+        connection.executemany(
+            'INSERT INTO cues (file_id, cue, start, end, text) VALUES (?, ?, ?, ?, ?)',
+            ((file_id, cue, start, end, text) for cue, start, end, text, tokens in cues))
+        connection.executemany(
+            'INSERT INTO postings (file_id, cue, position, token) VALUES (?, ?, ?, ?)',
+            ((file_id, cue, position, token)
+             for cue, start, end, text, tokens in cues
+             for position, token in enumerate(tokens)))
     
-    splits the file at the given timestamps
-    timestamp has format HH:MM:SS,MMM
+    def _forget(self, file_id):
+        self.connection.execute('DELETE FROM postings WHERE file_id = ?', (file_id,))
+        self.connection.execute('DELETE FROM cues WHERE file_id = ?', (file_id,))
     
-    The timestamps should be in increasing order!
+    def prune(self):
+        """
+        drops the files that no longer exist, returns their paths
+        """
+        gone = [
+            (file_id, path) for file_id, path in
+            self.connection.execute('SELECT id, path FROM files').fetchall()
+            if not os.path.exists(path)
+        ]
+        with self.connection:
+            for file_id, path in gone:
+                self._forget(file_id)
+                self.connection.execute('DELETE FROM files WHERE id = ?', (file_id,))
+        return [path for file_id, path in gone]
     
-    writes the files out with format [infile]_0.srt
-    with the digit ranging up
+    def search(self, query, prefix=False, limit=None):
+        """
+        the cues containing the words of query next to each other,
+        as SearchHits ordered by file (in the order they were
+        indexed) and time. with prefix, the last word only has
+        to start the word in the cue
+        """
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        
+        # each word is (condition on a postings table, parameters)
+        words = []
+        for position, token in enumerate(tokens):
+            if prefix and position == len(tokens) - 1:
+                words.append(('%(p)s.token >= ? AND %(p)s.token < ?', [token, token + u'\uffff']))
+            else:
+                words.append(('%(p)s.token = ?', [token]))
+        
+        # the lookup starts from the rarest word, the others are
+        # checked at their positions around it. CROSS JOIN keeps
+        # sqlite from reordering that
+        driver = min(range(len(words)), key=lambda position: self._rarity(*words[position]))
+        joins = []
+        conditions = [words[driver][0] % {'p': 'd'}]
+        parameters = list(words[driver][1])
+        for position, (condition, word_parameters) in enumerate(words):
+            if position == driver:
+                continue
+            alias = 'p%d' % position
+            joins.append(
+                'CROSS JOIN postings %(p)s ON %(p)s.file_id = d.file_id AND %(p)s.cue = d.cue '
+                'AND %(p)s.position = d.position + %(offset)d' % {'p': alias, 'offset': position - driver})
+            conditions.append(condition % {'p': alias})
+            parameters.extend(word_parameters)
+        
+        sql = (
+            'SELECT files.path, cues.cue, cues.start, cues.end, cues.text '
+            'FROM postings d %s '
+            'CROSS JOIN cues ON cues.file_id = d.file_id AND cues.cue = d.cue '
+            'CROSS JOIN files ON files.id = d.file_id '
+            'WHERE %s GROUP BY d.file_id, d.cue ORDER BY d.file_id, d.cue'
+        ) % (' '.join(joins), ' AND '.join(conditions))
+        if limit is not None:
+            sql += ' LIMIT %d' % limit
+        return [SearchHit(*row) for row in self.connection.execute(sql, parameters)]
     
-    ALL RESULTING FILES WILL BE SHIFTED TO START AT 0
-    we'll see how use cases develop for this
+    def _rarity(self, condition, parameters, cap=1000):
+        """
+        how many postings match a word, counting no further than cap
+        """
+        return self.connection.execute(
+            'SELECT COUNT(*) FROM (SELECT 1 FROM postings p WHERE %s LIMIT %d)' % (condition % {'p': 'p'}, cap),
+            parameters).fetchone()[0]
+
+
+def command_index(args):
+    """python srt.py index [index] [--workers n] [files | @manifest | - | glob]...
+    
+    adds the given files to the full text index in the file [index]
+    (an sqlite database, created if needed), for the search command.
+    files already indexed are only parsed again if they changed,
+    indexed files that no longer exist are dropped
+    
+    files are parsed in parallel, by one process per CPU
+    unless --workers says otherwise
     """
-    if not args:
-        raise ValueError("Split must be given arguments!")
+    if len(args) < 2:
+        raise ValueError("index must be called with an index file and input files")
     
-    filename = args.pop(0)
-    doc = parse(filename)
+    index_path = args.pop(0)
+    workers = None
+    paths = []
+    while args:
+        arg = args.pop(0)
+        if arg == '--workers':
+            workers = int(args.pop(0))
+        else:
+            paths.extend(batch_inputs(arg))
     
-    if not args:
-        raise ValueError("Split must be called with at least one timestamp")
+    with SubtitleIndex(index_path) as index:
+        removed = index.prune()
+        summary = index.update(paths, workers)
     
-    out_list = []
-    current = doc
-    for arg in args:
-        timecode = Timecode.from_string(arg)
-        left, right = current.split(timecode)
-        out_list.append(left)
-        current = right
-    out_list.append(current)
+    for path, error in summary['errors']:
+        print >> sys.stderr, "%s: %s" % (path, error)
+    print "%d indexed, %d unchanged, %d removed, %d failed" % (
+        summary['indexed'], summary['unchanged'], len(removed), len(summary['errors']))
+
+
+def command_search(args):
+    """python srt.py search [index] [--prefix] [--limit n] [words]...
     
-    out_list = [srt_document.normalize() for srt_document in out_list]
+    prints every cue of the indexed files containing the words
+    next to each other (case does not matter), as
     
-    # ok, now we have to print them
+    path  cue number  start --> end  text
     
-    # lets get our format... lets strip a .srt if there is one
-    if filename.endswith('.srt'):
-        filename = filename[:-4]
-        
-    FORMAT_STRING = "%s_%%d.srt" % filename
+    with --prefix, the last word can be the start of a word
+    """
+    if len(args) < 2:
+        raise ValueError("search must be called with an index file and words")
     
-    for index, srt_document in enumerate(out_list):
-        out_file_handle = open(FORMAT_STRING % index, 'w')
-        out_file_handle.write(str(srt_document))
-        out_file_handle.close()
-        
-def command_srt2sjson(args):
-    """python srt.py srt2sjson [filename | -]
+    index_path = args.pop(0)
+    if not os.path.exists(index_path):
+        raise ValueError("no index at %s, see the index command" % index_path)
     
-    converts the file name given to a sjson file
-    (from a srt file)
+    prefix = False
+    limit = None
+    words = []
+    while args:
+        arg = args.pop(0)
+        if arg == '--prefix':
+            prefix = True
+        elif arg == '--limit':
+            limit = int(args.pop(0))
+        else:
+            words.append(arg)
+    
+    with SubtitleIndex(index_path) as index:
+        hits = index.search(' '.join(words), prefix, limit)
+    for hit in hits:
+        print "%s\t%d\t%s --> %s\t%s" % (
+            hit.path.encode('utf-8'), hit.cue + 1, Timecode(hit.start), Timecode(hit.end),
+            hit.text.replace('\n', ' / ').encode('utf-8'))
+    return hits
+
+
+def command_srt2bin(args):
+    """python srt.py srt2bin [filename | -]
+    
+    converts the file name given (a .srt file)
+    to the binary .sbin format
     accepts input from stdin by giving a dash
     
-    prints result to stdout
+    writes the result to stdout
     """
-    
     try:
         filename = args[0]
     except IndexError:
         filename = '-'
-        
+    
     if filename == '-':
         file_handle = sys.stdin
     else:
-        file_handle = open(filename, 'r')
-        
-    doc = parse_srt(file_handle)
-    print doc.json()
+        file_handle = open(filename, 'rb')
     
-def command_sjson2srt(args):
-    """python srt.py sjson2srt [filename | -]
+    doc = parse_srt_bytes(file_handle)
+    write_bin(doc.frames, sys.stdout)
 
-    converts the file name given to a srt file
-    (from a sjson file)
-    accepts input from stdin by giving a dash
 
+def command_bin2srt(args):
+    """python srt.py bin2srt [filename | -]
+    
+    converts the file name given (a .sbin file) to a srt file
+    accepts input from stdin by giving a dash
+    
     prints result to stdout
     """
-
     try:
         filename = args[0]
     except IndexError:
         filename = '-'
-
+    
     if filename == '-':
         file_handle = sys.stdin
     else:
-        file_handle = open(filename, 'r')
+        file_handle = open(filename, 'rb')
+    
+    doc = parse_bin(file_handle)
+    write_srt(doc.frames, sys.stdout)
 
-    doc = parse_sjson(file_handle)
-    print str(doc)
 
-        
+def command_edit(args):
+    """python srt.py edit [filename] [editlist | -]
+    
+    applies a whole edit list to the file in one go,
+    one operation per line (times are HH:MM:SS,MMM timestamps,
+    all of them in the input file's time):
+    
+    delete [start] [end]       removes the segment, later cues move back by
+                               exactly end - start (unlike the delete command,
+                               even when the cut falls in a gap between cues)
+    keep [start] [end]         with keeps, everything outside them is removed
+    shift [start] [end] [time] moves the segment by time (can be negative)
+    gap [at] [time]            inserts time of nothing at at
+    
+    # starts a comment. the edit list is read from stdin
+    when it is - or not given
+    
+    the start time of the new file will always be the same
+    as the start time of the original one
+    
+    this prints the new file to stdout
+    """
+    if not args:
+        raise ValueError("edit must be called with a filename argument")
+    
+    filename = args.pop(0)
+    edit_filename = args[0] if args else '-'
+    if edit_filename == '-':
+        edits = EditList.from_lines(sys.stdin)
+    else:
+        with open(edit_filename) as edit_handle:
+            edits = EditList.from_lines(edit_handle)
     
+    doc = parse(filename)
+    with phase('edit'):
+        result = edits.apply(doc)
+    write_srt(result.frames, sys.stdout)
+    return result
 
-def command_cat(args):
-    """python srt.py cat [file1] [file2]...
+
+def command_merge(args):
+    """python srt.py merge [--unsorted] [--run-size cues] [file1] [file2]...
     
-    Concatenates the given SRT files (in the order given)
-    and prints the result to stdout.
+    merges the given files (tracks: dialogue, SDH...) into one,
+    every cue keeping its time, and prints the result to stdout.
+    files can be .srt, .sjson or .sbin, the output has the type
+    of the first
+    
+    the files are read as streams, and have to be sorted by start
+    time already. with --unsorted they don't: everything is sorted,
+    in memory if it fits in --run-size cues (200000 by default),
+    else through temporary run files
     """
+    unsorted = False
+    max_frames = SORT_RUN_FRAMES
+    filenames = []
+    args = list(args)
+    while args:
+        arg = args.pop(0)
+        if arg == '--unsorted':
+            unsorted = True
+        elif arg == '--run-size':
+            max_frames = int(args.pop(0))
+        else:
+            filenames.append(arg)
+    
+    if not filenames:
+        raise ValueError("Cannot merge no files!")
+    
+    if unsorted:
+        frames = iter_sorted(chain.from_iterable(iter_frames(filename) for filename in filenames), max_frames)
+    else:
+        frames = iter_merged(*[iter_checked(iter_frames(filename), filename) for filename in filenames])
+    
+    type_write_functions = {
+        'sjson' : write_sjson,
+        'srt' : write_srt,
+        'bin' : write_bin,
+    }
+    type_write_functions[get_file_type(filenames[0])](frames, sys.stdout)
+
+
+def command_retime(args):
+    """python srt.py retime [filename] [option]+
+    
+    retimes every cue, applying the options in order:
     
+    --shift [timestamp]        moves everything by timestamp (can be negative)
+    --scale [factor]           stretches times by factor, around 0
+    --fps [from] [to]          converts from one frame rate to another,
+                               eg --fps 23.976 25
+    --map [source] [target]    moves source to target, consecutive --map
+                               options make one piecewise linear mapping
+    
+    this prints the new file to stdout
+    """
     if not args:
-        raise ValueError("Cannot concatenate no files!")
+        raise ValueError("retime must be called with a filename argument")
+    
+    filename = args.pop(0)
+    time_maps = []
+    points = None
+    while args:
+        option = args.pop(0)
+        if option != '--map' and points is not None:
+            time_maps.append(TimeMap.piecewise(points))
+            points = None
+        
+        if option == '--shift':
+            time_maps.append(TimeMap.shift(Timecode.from_string(args.pop(0))))
+        elif option == '--scale':
+            time_maps.append(TimeMap.scale(float(args.pop(0))))
+        elif option == '--fps':
+            time_maps.append(TimeMap.framerate(float(args.pop(0)), float(args.pop(0))))
+        elif option == '--map':
+            points = points or []
+            points.append((Timecode.from_string(args.pop(0)), Timecode.from_string(args.pop(0))))
+        else:
+            raise ValueError("unknown retime option %s" % option)
+    if points is not None:
+        time_maps.append(TimeMap.piecewise(points))
+    
+    if not time_maps:
+        raise ValueError("retime must be given at least one option")
+    
+    doc = parse(filename)
+    with phase('edit'):
+        result = doc.retime(*time_maps)
+    write_srt(result.frames, sys.stdout)
+    return result
+
+
+#################################################
+# server mode
+#
+# python srt.py serve keeps a process (and its parsed documents)
+# around to run commands for srt_client.py. the protocol:
+# the client sends one json line, {"command": ..., "args": [...]}
+# plus "stdin": true if it has any to pass on, in which case the
+# raw bytes follow as one 'i' frame. frames are SERVER_FRAME
+# (kind, length) + length bytes. the server answers with frames:
+# 'o' output, 'e' an error message, and last 'x' whose length
+# is the exit status, with no bytes after it
+#################################################
+
+DEFAULT_SERVER_ADDRESS = '/tmp/srt.py.sock'
+SERVER_FRAME = struct.Struct('<cI')
+
+
+def server_address(address):
+    """
+    'host:port' is a TCP address, anything else a unix socket path
+    """
+    if ':' in address:
+        host, port = address.rsplit(':', 1)
+        return socket.AF_INET, (host or 'localhost', int(port))
+    return socket.AF_UNIX, address
+
+
+class _ThreadStreams(object):
+    """
+    stands in for sys.stdout or sys.stdin, so each server
+    thread reads and writes its own request's streams
+    """
+    
+    def __init__(self, default):
+        self._default = default
+        self._local = threading.local()
+    
+    def use(self, stream):
+        self._local.stream = stream
+    
+    def _stream(self):
+        return getattr(self._local, 'stream', None) or self._default
+    
+    def __getattr__(self, name):
+        return getattr(self._stream(), name)
+    
+    def __iter__(self):
+        return iter(self._stream())
+
+
+class _FramedWriter(object):
+    """
+    a file-like object sending what is written to it as 'o' frames
+    """
+    
+    def __init__(self, handle, buffer_size=65536):
+        self.handle = handle
+        self.buffer_size = buffer_size
+        self.pieces = []
+        self.size = 0
+    
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        self.pieces.append(data)
+        self.size += len(data)
+        if self.size >= self.buffer_size:
+            self.flush()
+    
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+    
+    def flush(self):
+        if self.size:
+            self.send('o', ''.join(self.pieces))
+            self.pieces = []
+            self.size = 0
+    
+    def send(self, kind, data):
+        self.handle.write(SERVER_FRAME.pack(kind, len(data)) + data)
+
+
+class _CommandHandler(SocketServer.StreamRequestHandler):
+    
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            # a connection that sent nothing, like make_server's probe
+            return
+        out = _FramedWriter(self.wfile)
+        try:
+            request = json.loads(line)
+            stdin = ''
+            if request.get('stdin'):
+                kind, length = SERVER_FRAME.unpack(self.rfile.read(SERVER_FRAME.size))
+                stdin = self.rfile.read(length)
+        except (ValueError, AttributeError, struct.error) as error:
+            out.send('e', 'bad request: %s\n' % error)
+            self.wfile.write(SERVER_FRAME.pack('x', 1))
+            return
+        status = 0
+        sys.stdout.use(out)
+        sys.stdin.use(StringIO(stdin))
+        try:
+            command = request['command']
+            if command == 'serve':
+                raise ValueError("the server can't start another server")
+            try:
+                command_function = command_dict[command]
+            except KeyError:
+                raise ValueError("command %s not found" % command)
+            command_function([arg.encode('utf-8') for arg in request['args']])
+        except SystemExit as exit:
+            # like the interpreter: None is success, a message is status 1
+            out.flush()
+            if exit.code is None or isinstance(exit.code, int):
+                status = exit.code or 0
+            else:
+                out.send('e', '%s\n' % exit.code)
+                status = 1
+        except Exception as error:
+            out.flush()
+            out.send('e', '%s: %s\n' % (error.__class__.__name__, error))
+            status = 1
+        finally:
+            sys.stdout.use(None)
+            sys.stdin.use(None)
+        out.flush()
+        self.wfile.write(SERVER_FRAME.pack('x', status))
+
+
+class SRTServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    """
+    runs commands for srt_client.py, one thread per request,
+    see the server mode notes above
+    """
+    daemon_threads = True
 
-    first = args[0]
-    output_type = get_file_type(first)
 
-    srt_docs = []
-    for filename in args:
-        srt_docs.append(parse(filename))
+class SRTTCPServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def make_server(address=DEFAULT_SERVER_ADDRESS):
+    family, socket_address = server_address(address)
+    if family == socket.AF_UNIX:
+        _remove_stale_socket(socket_address)
+        return SRTServer(socket_address, _CommandHandler)
+    return SRTTCPServer(socket_address, _CommandHandler)
+
+
+def _remove_stale_socket(path):
+    """
+    removes the unix socket at path if a server that died left it.
+    anything else there, or a server still listening, is an IOError
+    """
+    try:
+        mode = os.stat(path).st_mode
+    except OSError as error:
+        if error.errno == errno.ENOENT:
+            return
+        raise
+    if not stat.S_ISSOCK(mode):
+        raise IOError("%s exists and is not a socket" % path)
+    
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except socket.error as error:
+        if error.errno != errno.ECONNREFUSED:
+            raise
+        os.remove(path)
+    else:
+        raise IOError("a server is already listening on %s" % path)
+    finally:
+        probe.close()
+
+
+def serve(server, cache):
+    """
+    runs server until it is shut down, with the cache active
+    and sys.stdout and sys.stdin per request thread
+    """
+    stdout, stdin = sys.stdout, sys.stdin
+    sys.stdout, sys.stdin = _ThreadStreams(stdout), _ThreadStreams(stdin)
+    try:
+        with cache:
+            server.serve_forever()
+    finally:
+        sys.stdout, sys.stdin = stdout, stdin
+        server.server_close()
+        if server.address_family == socket.AF_UNIX and os.path.exists(server.server_address):
+            os.remove(server.server_address)
+
+
+def command_serve(args):
+    """python srt.py serve [address] [--cache-mb MB] [--store directory]
+    
+    keeps running, and runs commands sent by srt_client.py:
+    
+    python srt_client.py [--server address] [command] [args]
     
+    prints what python srt.py [command] [args] would, but without
+    starting python and parsing the inputs again each time:
+    parsed documents are kept in memory (up to --cache-mb, 256 by
+    default) and in the --store directory, see DocumentCache
     
+    address is a unix socket path (default /tmp/srt.py.sock)
+    or host:port. requests are run in parallel threads
+    """
+    address = DEFAULT_SERVER_ADDRESS
+    cache_mb = 256
+    store_directory = None
+    args = list(args)
+    while args:
+        arg = args.pop(0)
+        if arg == '--cache-mb':
+            cache_mb = int(args.pop(0))
+        elif arg == '--store':
+            store_directory = args.pop(0)
+        else:
+            address = arg
     
+    server = make_server(address)
+    print >> sys.stderr, "serving on %s" % address
+    try:
+        serve(server, DocumentCache(cache_mb * 1024 * 1024, store_directory))
+    except KeyboardInterrupt:
+        pass
+
+
 def command_help(args):
     """python srt.py help [command]
     
@@ -630,17 +4049,65 @@ def command_help(args):
         
 
 commands = [
+    ('batch', command_batch),
+    ('cat', command_cat),
     ('delete', command_delete),
+    ('edit', command_edit),
+    ('merge', command_merge),
+    ('slice', command_slice),
     ('split', command_split),
     ('srt2sjson', command_srt2sjson),
     ('sjson2srt', command_sjson2srt),
+    ('srt2bin', command_srt2bin),
+    ('bin2srt', command_bin2srt),
+    ('retime', command_retime),
+    ('serve', command_serve),
+    ('index', command_index),
+    ('search', command_search),
     ('help', command_help),
 ]
 
 command_dict = dict(commands)
 
+def run_command(command_function, args, profile_path=None, stats_path=None):
+    """
+    runs a command, optionally under cProfile (dumping its
+    stats to profile_path) and/or recording a Stats (written
+    as json to stats_path, '-' for stderr)
+    """
+    stats = Stats() if stats_path else None
+    if stats:
+        stats.__enter__()
+    try:
+        if profile_path:
+            import cProfile
+            profiler = cProfile.Profile()
+            try:
+                return profiler.runcall(command_function, args)
+            finally:
+                profiler.dump_stats(profile_path)
+        return command_function(args)
+    finally:
+        if stats:
+            stats.__exit__()
+            if stats_path == '-':
+                sys.stderr.write(stats.json() + '\n')
+            else:
+                with open(stats_path, 'w') as stats_file:
+                    stats_file.write(stats.json())
+
+
 if __name__ == '__main__':
 
+    # global options go before the command:
+    #   --profile FILE  dump a cProfile of the command to FILE
+    #   --stats FILE    write per phase times and counts as json to FILE (- for stderr)
+    options = {'--profile': None, '--stats': None}
+    argv = argv[:]
+    while len(argv) > 2 and argv[1] in options:
+        option = argv.pop(1)
+        options[option] = argv.pop(1)
+
     try:
         command = argv[1]
         args = argv[2:]
@@ -650,7 +4117,7 @@ if __name__ == '__main__':
         else:
             print """
 Usage:
-python srt.py [command] [args]
+python srt.py [--profile FILE] [--stats FILE] [command] [args]
 
 try python srt.py help for info
 """
@@ -663,4 +4130,4 @@ try python srt.py help for info
         print "command not found..\n\ntry python srt.py help for info"
         sys.exit(1)
     
-    command_function(args)
+    run_command(command_function, args, options['--profile'], options['--stats'])
@@ -0,0 +1,90 @@
+#################################################
+# srt_client.py
+#
+# A thin client for python srt.py serve
+#
+# python srt_client.py [--server address] [command] [args]
+#
+# runs python srt.py [command] [args] in the server,
+# which keeps its parsed documents around.
+# this only imports what it needs, so it starts fast
+#################################################
+
+import json
+import os
+import socket
+import struct
+import sys
+
+# the same as in srt.py
+DEFAULT_SERVER_ADDRESS = '/tmp/srt.py.sock'
+SERVER_FRAME = struct.Struct('<cI')
+
+
+def server_address(address):
+    """
+    'host:port' is a TCP address, anything else a unix socket path
+    """
+    if ':' in address:
+        host, port = address.rsplit(':', 1)
+        return socket.AF_INET, (host or 'localhost', int(port))
+    return socket.AF_UNIX, address
+
+
+def read_exactly(handle, size):
+    data = handle.read(size)
+    if len(data) != size:
+        raise IOError("the server hung up")
+    return data
+
+
+def run(command, args, address=DEFAULT_SERVER_ADDRESS, stdin=None, stdout=None, stderr=None):
+    """
+    runs a command in the server, copying its output to stdout
+    and its errors to stderr. returns the exit status
+
+    paths in args are made absolute, as the server has its own
+    working directory. with a '-' argument, stdin is read and sent
+    as it is, in an 'i' frame after the request
+    """
+    stdout = stdout or sys.stdout
+    stderr = stderr or sys.stderr
+
+    request = {
+        'command': command,
+        'args': [os.path.abspath(arg) if os.path.exists(arg) else arg for arg in args],
+    }
+    message = ''
+    if '-' in args:
+        request['stdin'] = True
+        data = (stdin or sys.stdin).read()
+        message = SERVER_FRAME.pack('i', len(data)) + data
+
+    family, socket_address = server_address(address)
+    connection = socket.socket(family, socket.SOCK_STREAM)
+    try:
+        connection.connect(socket_address)
+        connection.sendall(json.dumps(request) + '\n' + message)
+        replies = connection.makefile('rb')
+        while True:
+            kind, length = SERVER_FRAME.unpack(read_exactly(replies, SERVER_FRAME.size))
+            if kind == 'x':
+                return length
+            data = read_exactly(replies, length)
+            (stdout if kind == 'o' else stderr).write(data)
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    address = os.environ.get('SRT_SERVER', DEFAULT_SERVER_ADDRESS)
+    if args[:1] == ['--server']:
+        address = args[1]
+        args = args[2:]
+
+    if not args:
+        print "Usage:\npython srt_client.py [--server address] [command] [args]"
+        sys.exit(1)
+
+    sys.exit(run(args[0], args[1:], address))
@@ -1,53 +1,79 @@
+import codecs
+import json
+import os
+import pickle
+import random
+import shutil
+import socket
+import sys
+import tempfile
+import threading
 import unittest
+from array import array
+from StringIO import StringIO
 
-from srt import Timecode
+from srt import Timecode, SRTFrame, SRTDocument, parse_srt, parse_sjson
+from srt import LRUCache, parse_timecode_line, CompactSRTDocument, IntervalIndex
+from srt import iter_srt, iter_sjson, write_srt, write_sjson, iter_concatenated
+from srt import run_batch, batch_inputs, SRTDocumentView, MappedSRTFile
+from srt import parse, parse_bin, write_bin, get_file_type
+from srt import SRTStreamParser, follow_feeds
+from srt import Stats, phase, add_count, run_command, command_delete
+from srt import TimeMap, retime_column, load_sjson_columns
+from srt import DocumentCache, document_bytes, make_server, serve, EditList
+from srt import iter_merged, iter_sorted, iter_checked, iter_frames
+from srt import SubtitleIndex, tokenize
+from srt import parse_srt_bytes, iter_srt_bytes, detect_encoding
+from srt import command_cat, command_merge
+import srt
+import srt_client
 
 
 class TimecodeTestCase(unittest.TestCase):    
-    
-    
+
+
     def __init__(self, *args, **kwargs):
         unittest.TestCase.__init__(self, *args, **kwargs)
-        
+
     def test_copy(self):
         first = Timecode(500)
         second = first.copy()
         self.assertEqual(first.milliseconds(), second.milliseconds())
         self.assertIsNot(first, second)
-        
+
     def test_equals(self):
         first = Timecode(500)
         second = Timecode(500)
         self.assertEqual(first, second)
-        
+
     def test_add(self):
         first = Timecode(300)
         second = Timecode(200)
         the_sum = first + second
-        
+
         self.assertEqual(the_sum, Timecode(500))
         self.assertIsNot(the_sum, first)
         self.assertIsNot(the_sum, second)
-        
+
     def test_sub(self):
         first = Timecode(400)
         second = Timecode(300)
-        
+
         first_sub = first - second
         second_sub = second - first
-        
+
         self.assertEqual(first_sub, Timecode(100))
         self.assertEqual(second_sub, Timecode(-100))
-        
+
         self.assertIsNot(second_sub, first)
         self.assertIsNot(second_sub, second)
         self.assertIsNot(first_sub, first)
         self.assertIsNot(first_sub, second)
-        
+
     def test_lt(self):
         first = Timecode(300)
         second = Timecode(200)
-        
+
         self.assertFalse(first < second)
         self.assertTrue(second < first)
 
@@ -82,16 +108,1336 @@ class TimecodeTestCase(unittest.TestCase):
             (63001, '00:01:03,001'),
             (7384005, '02:03:04,005')
         ]
-        
+
         for test, expected in to_string_tests:
             foo = Timecode(test)
             self.assertEqual(str(foo), expected, 'str(Timecode(%d)) not %s!' % (test, expected))
 
 
+class TimecodeLineTestCase(unittest.TestCase):
+
+    def test_canonical(self):
+        start, end = parse_timecode_line('01:02:03,004 --> 12:34:56,789')
+        self.assertEqual(start.milliseconds(), 3723004)
+        self.assertEqual(end.milliseconds(), 45296789)
+
+    def test_period_separator(self):
+        start, end = parse_timecode_line('00:00:01.500 --> 00:00:02.000')
+        self.assertEqual((start.milliseconds(), end.milliseconds()), (1500, 2000))
+
+    def test_loose_forms(self):
+        for line, expected in [
+            ('1:2:3,4 --> 1:2:3,5', (3723004, 3723005)),
+            ('3,4->5', (3004, 5000)),
+            ('00:00:01,000-->00:00:02,000', (1000, 2000)),
+        ]:
+            start, end = parse_timecode_line(line)
+            self.assertEqual((start.milliseconds(), end.milliseconds()), expected, line)
+
+
+class LRUCacheTestCase(unittest.TestCase):
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(2)
+        cache['a'] = 1
+        cache['b'] = 2
+        self.assertEqual(cache.get('a'), 1)
+        cache['c'] = 3
+        self.assertEqual(len(cache), 2)
+        self.assertNotIn('b', cache)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_pop_oldest(self):
+        cache = LRUCache(5)
+        for key in 'abc':
+            cache[key] = key
+        cache['a'] = 'A'
+        self.assertEqual(cache.pop_oldest(), ('b', 'b'))
+        self.assertEqual(cache.pop_oldest(), ('c', 'c'))
+        self.assertEqual(cache.pop_oldest(), ('a', 'A'))
+        self.assertRaises(KeyError, cache.pop_oldest)
+
+    def test_timecode_cache_per_thread(self):
+        # LRUCache has no lock, so each thread parses with its own
+        caches = []
+        errors = []
+        def use(offset):
+            caches.append(srt._timecode_caches.cache)
+            try:
+                for ms in range(offset, 60000, 7):
+                    tc = str(Timecode(ms))
+                    if Timecode.from_string(tc).milliseconds() != ms:
+                        errors.append(tc)
+            except Exception as error:
+                errors.append(error)
+        interval = sys.getcheckinterval()
+        sys.setcheckinterval(1)
+        try:
+            threads = [threading.Thread(target=use, args=(offset,)) for offset in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setcheckinterval(interval)
+        self.assertEqual(errors, [])
+        self.assertEqual(len(set(map(id, caches))), 8)
+        self.assertFalse(srt._timecode_caches.cache in caches)
+
+
 class SRTFrameTestCase(unittest.TestCase):
-    
-    
-    
+
+    def setUp(self):
+        self.frame = SRTFrame(Timecode(1000), Timecode(2000), ['one', 'two'])
+
+    def test_immutable(self):
+        self.assertRaises(AttributeError, setattr, self.frame, 'start', Timecode(0))
+        self.assertRaises(AttributeError, setattr, self.frame.start, '_milliseconds', 0)
+        self.assertEqual(self.frame.lines, ('one', 'two'))
+
+    def test_slots(self):
+        self.assertFalse(hasattr(self.frame, '__dict__'))
+        self.assertFalse(hasattr(self.frame.start, '__dict__'))
+
+    def test_hash(self):
+        self.assertEqual(hash(Timecode(1000)), hash(self.frame.start))
+        self.assertEqual(len(set([Timecode(5), Timecode(5), Timecode(6)])), 2)
+        self.assertIn(self.frame, set([self.frame.copy()]))
+
+    def test_pickle(self):
+        copied = pickle.loads(pickle.dumps(self.frame, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual((copied.start, copied.end, copied.lines), (self.frame.start, self.frame.end, self.frame.lines))
+
+    def test_shift_shares_lines(self):
+        shifted = self.frame.shift(500)
+        self.assertEqual(shifted.start, Timecode(1500))
+        self.assertIs(shifted.lines, self.frame.lines)
+
+
+SAMPLE_SRT = """
+1
+00:00:00,000 --> 00:00:05,500
+Test
+
+2
+00:00:05,500 --> 00:00:15,000
+Lalalala
+SRT files are neat
+
+3
+00:00:15,000 --> 00:00:30,250
+python parsing
+
+"""
+
+SAMPLE_SJSON = """{
+    "start": [0, 5500, 15000],
+    "end": [5500, 15000, 30250],
+    "text": ["Test", "Lalalala\\nSRT files are neat", "python parsing"]
+}"""
+
+
+# a track with non-ascii text, which json loads as unicode
+NON_ASCII_SJSON = json.dumps({'start': [500, 2500], 'end': [1500, 3500], 'text': [u'caf\xe9', u'na\xefve']})
+
+
+def run_command_output(command_function, args):
+    """
+    what command_function prints to stdout
+    """
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        command_function(args)
+        return sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+
+
+class SRTDocumentTestCase(unittest.TestCase):
+
+    def assertSample(self, doc):
+        self.assertEqual([f.start.milliseconds() for f in doc.frames], [0, 5500, 15000])
+        self.assertEqual([f.end.milliseconds() for f in doc.frames], [5500, 15000, 30250])
+        self.assertEqual(doc.frames[1].lines, ('Lalalala', 'SRT files are neat'))
+
+    def test_from_frames_sorts(self):
+        frames = [
+            SRTFrame(Timecode(2000), Timecode(3000), ['b']),
+            SRTFrame(Timecode(0), Timecode(1000), ['a']),
+        ]
+        doc = SRTDocument.from_frames(frames)
+        self.assertEqual([f.lines for f in doc.frames], [('a',), ('b',)])
+
+    def test_from_frames_presorted(self):
+        frames = [SRTFrame(Timecode(0), Timecode(1000), ['a'])]
+        doc = SRTDocument.from_frames(iter(frames), presorted=True)
+        self.assertEqual(doc.frames, frames)
+
+    def test_parse_srt(self):
+        self.assertSample(parse_srt(StringIO(SAMPLE_SRT)))
+
+    def test_parse_sjson(self):
+        self.assertSample(parse_sjson(StringIO(SAMPLE_SJSON)))
+
+    def test_parse_sjson_compact(self):
+        doc = parse_sjson(StringIO(SAMPLE_SJSON), compact=True)
+        self.assertTrue(isinstance(doc, CompactSRTDocument))
+        self.assertSample(doc)
+
+    def test_sjson_validation(self):
+        for bad in ['[]', '{"start": [0], "end": [1]}',
+                    '{"start": [0], "end": [1, 2], "text": ["a"]}']:
+            self.assertRaises(ValueError, load_sjson_columns, StringIO(bad))
+            self.assertRaises(ValueError, parse_sjson, StringIO(bad), True)
+
+
+
+class CompactSRTDocumentTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.doc = parse_srt(StringIO(SAMPLE_SRT))
+        self.compact = CompactSRTDocument.from_document(self.doc)
+
+    def assertSameDocument(self, compact, doc):
+        self.assertEqual(str(compact), str(doc))
+        self.assertEqual(compact.json(), doc.json())
+
+    def test_round_trip(self):
+        self.assertSameDocument(self.compact, self.doc)
+        self.assertSameDocument(self.compact.to_document(), self.doc)
+        self.assertEqual(self.compact.frames[-1].lines, ('python parsing',))
+        self.assertEqual(len(self.compact.frames[1:]), 2)
+
+    def test_split(self):
+        for time in (0, 3000, 5500, 7000, 30250, 40000):
+            for compact_half, doc_half in zip(self.compact.split(Timecode(time)), self.doc.split(Timecode(time))):
+                self.assertSameDocument(compact_half, doc_half)
+
+    def test_split_in_gap(self):
+        doc = SRTDocument([
+            SRTFrame(Timecode(0), Timecode(1000), ['a']),
+            SRTFrame(Timecode(2000), Timecode(3000), ['b']),
+        ])
+        compact = CompactSRTDocument.from_document(doc)
+        for compact_half, doc_half in zip(compact.split(Timecode(1500)), doc.split(Timecode(1500))):
+            self.assertSameDocument(compact_half, doc_half)
+
+    def test_shift_normalize(self):
+        shifted = self.compact.shift(1000)
+        self.assertSameDocument(shifted, self.doc.shift(1000))
+        self.assertSameDocument(shifted.normalize(), self.doc)
+
+    def test_add(self):
+        later = self.doc.shift(40000)
+        self.assertSameDocument(self.compact.add(CompactSRTDocument.from_document(later)), self.doc.add(later))
+        self.assertRaises(ValueError, self.compact.add, self.compact)
+
+    def test_sorts(self):
+        compact = CompactSRTDocument.from_frames([
+            SRTFrame(Timecode(2000), Timecode(3000), ['b']),
+            SRTFrame(Timecode(0), Timecode(1000), ['a']),
+        ])
+        self.assertEqual([f.text() for f in compact.frames], ['a', 'b'])
+
+
+class TimeQueryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        doc = SRTDocument([
+            SRTFrame(Timecode(0), Timecode(1000), ['a']),
+            SRTFrame(Timecode(1000), Timecode(2000), ['b']),
+            SRTFrame(Timecode(3000), Timecode(4000), ['c']),
+        ])
+        self.docs = [doc, CompactSRTDocument.from_document(doc)]
+
+    def test_frame_at(self):
+        for doc in self.docs:
+            texts = [doc.frame_at(time) and doc.frame_at(time).text() for time in (-1, 0, 999, 1000, 2500, 3999, 4000)]
+            self.assertEqual(texts, [None, 'a', 'a', 'b', None, 'c', None])
+            self.assertEqual(doc.frame_at(Timecode(1500)).text(), 'b')
+
+    def test_frames_between(self):
+        for doc in self.docs:
+            for start, end, expected in [
+                (0, 5000, ['a', 'b', 'c']),
+                (500, 1000, ['a']),
+                (1000, 3000, ['b']),
+                (2000, 3000, []),
+                (3500, 3600, ['c']),
+                (4000, 9000, []),
+            ]:
+                texts = [frame.text() for frame in doc.frames_between(start, end)]
+                self.assertEqual(texts, expected, (start, end))
+
+    def test_split_after_end(self):
+        for doc in self.docs:
+            left, right = doc.split(Timecode(5000))
+            self.assertEqual(len(left.frames), 3)
+            self.assertEqual(len(right.frames), 0)
+
+
+class OverlapTestCase(unittest.TestCase):
+
+    def setUp(self):
+        doc = SRTDocument([
+            SRTFrame(Timecode(0), Timecode(10000), ['long']),
+            SRTFrame(Timecode(1000), Timecode(2000), ['short']),
+            SRTFrame(Timecode(1500), Timecode(3000), ['other']),
+            SRTFrame(Timecode(12000), Timecode(13000), ['late']),
+        ])
+        self.docs = [doc, CompactSRTDocument.from_document(doc)]
+
+    def texts(self, frames):
+        return [frame.text() for frame in frames]
+
+    def test_interval_index_matches_brute_force(self):
+        rng = random.Random(4)
+        intervals = sorted((start, start + rng.randint(0, 500)) for start in
+                           (rng.randint(0, 2000) for _ in range(200)))
+        starts = [start for start, end in intervals]
+        ends = [end for start, end in intervals]
+        index = IntervalIndex(starts, ends)
+        for _ in range(200):
+            lo = rng.randint(-100, 2600)
+            hi = lo + rng.randint(1, 300)
+            expected = [i for i, (start, end) in enumerate(intervals) if start < hi and end > lo]
+            self.assertEqual(index.overlapping(lo, hi), expected)
+        self.assertEqual(IntervalIndex([], []).overlapping(0, 10), [])
+
+    def test_frames_active_at(self):
+        for doc in self.docs:
+            self.assertEqual(self.texts(doc.frames_active_at(1700)), ['long', 'short', 'other'])
+            self.assertEqual(self.texts(doc.frames_active_at(5000)), ['long'])
+            self.assertEqual(doc.frame_at(5000).text(), 'long')
+            self.assertEqual(doc.frame_at(1700).text(), 'other')
+            self.assertEqual(doc.frame_at(11000), None)
+
+    def test_frames_between(self):
+        for doc in self.docs:
+            self.assertEqual(self.texts(doc.frames_between(2500, 12500)), ['long', 'other', 'late'])
+
+    def test_split_overlapping(self):
+        for doc in self.docs:
+            left, right = doc.split(Timecode(1700))
+            self.assertEqual([(f.start.milliseconds(), f.end.milliseconds(), f.text()) for f in left.frames], [
+                (0, 1700, 'long'), (1000, 1700, 'short'), (1500, 1700, 'other'),
+            ])
+            self.assertEqual([(f.start.milliseconds(), f.end.milliseconds(), f.text()) for f in right.frames], [
+                (1700, 10000, 'long'), (1700, 2000, 'short'), (1700, 3000, 'other'), (12000, 13000, 'late'),
+            ])
+
+    def test_delete_overlapping(self):
+        for doc in self.docs:
+            # what command_delete does
+            left, right = doc.split(Timecode(1700))
+            gone, right = right.split(Timecode(11000))
+            result = left.add(right)
+            self.assertEqual([(f.start.milliseconds(), f.end.milliseconds()) for f in result.frames], [
+                (0, 1700), (1000, 1700), (1500, 1700), (1700, 2700),
+            ])
+
+
+class SplitManyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        doc = SRTDocument([
+            SRTFrame(Timecode(0), Timecode(1000), ['a']),
+            SRTFrame(Timecode(1000), Timecode(2500), ['b']),
+            SRTFrame(Timecode(500), Timecode(4000), ['overlap']),
+            SRTFrame(Timecode(5000), Timecode(6000), ['c']),
+            SRTFrame(Timecode(6000), Timecode(9000), ['d']),
+        ])
+        self.docs = [doc, CompactSRTDocument.from_document(doc)]
+
+    def reference_split(self, frames, time):
+        """
+        split, spelled out frame by frame
+        """
+        time = Timecode(time)
+        if not frames or time <= frames[0].start:
+            return [], frames
+        before = [frame for frame in frames if frame.start < time]
+        after = [frame for frame in frames if frame.start >= time]
+        left = [frame if frame.end <= time else frame.split(time)[0] for frame in before]
+        right = [frame.split(time)[1] for frame in before if frame.end > time]
+        if after and all(frame.end < time for frame in before):
+            left.append(SRTFrame(time, after[0].start))
+        return left, right + after
+
+    def repeated_split(self, doc, cuts):
+        out = []
+        current = list(doc.frames)
+        for time in cuts:
+            left, current = self.reference_split(current, time)
+            out.append(SRTDocument(left))
+        out.append(SRTDocument(current))
+        return out
+
+    def test_matches_repeated_split(self):
+        rng = random.Random(9)
+        for doc in self.docs:
+            for _ in range(50):
+                cuts = sorted(rng.randint(-500, 10000) for _ in range(rng.randint(1, 6)))
+                expected = [str(piece) for piece in self.repeated_split(doc, cuts)]
+                pieces = [str(piece) for piece in doc.split_many([Timecode(time) for time in cuts])]
+                self.assertEqual(pieces, expected, cuts)
+
+    def test_normalize(self):
+        for doc in self.docs:
+            pieces = list(doc.split_many([Timecode(2000), Timecode(5500)], normalize=True))
+            expected = [piece.normalize() for piece in self.repeated_split(doc, [2000, 5500])]
+            self.assertEqual([str(piece) for piece in pieces], [str(piece) for piece in expected])
+            self.assertEqual(pieces[2].frames[0].start, Timecode(0))
+
+    def test_lazy(self):
+        pieces = self.docs[0].split_many([Timecode(2000)])
+        self.assertEqual(len(pieces.next().frames), 3)
+
+
+class SRTDocumentViewTestCase(unittest.TestCase):
+
+    def random_document(self, rng):
+        frames = []
+        for _ in range(rng.randint(0, 12)):
+            start = rng.randint(0, 20000)
+            frames.append(SRTFrame(Timecode(start), Timecode(start + rng.randint(0, 3000)), [str(start)]))
+        return SRTDocument(frames)
+
+    def test_matches_document(self):
+        rng = random.Random(12)
+        for _ in range(300):
+            doc = self.random_document(rng)
+            view = doc.view()
+            for _ in range(4):
+                operation = rng.choice(['split_left', 'split_right', 'shift', 'normalize', 'add'])
+                if operation.startswith('split'):
+                    time = Timecode(rng.randint(-1000, 25000))
+                    side = 0 if operation == 'split_left' else 1
+                    doc = doc.split(time)[side]
+                    view = view.split(time)[side]
+                elif operation == 'shift':
+                    ms = rng.randint(-5000, 5000)
+                    doc = doc.shift(ms)
+                    view = view.shift(ms)
+                elif operation == 'normalize':
+                    doc = doc.normalize()
+                    view = view.normalize()
+                else:
+                    other = self.random_document(rng).shift(30000)
+                    try:
+                        expected = doc.add(other)
+                    except ValueError:
+                        self.assertRaises(ValueError, view.add, other)
+                        continue
+                    doc = expected
+                    view = view.add(other)
+                self.assertEqual(str(view), str(doc), operation)
+
+    def test_lazy(self):
+        doc = parse_srt(StringIO(SAMPLE_SRT))
+        left, right = doc.view().shift(1000).split(Timecode(7000))
+        self.assertEqual(left._frames, None)
+        # the untouched frames are still the document's own, not copies
+        self.assertIs(right._entries[-1].base, doc)
+        self.assertEqual(right.first_start(), Timecode(7000))
+        self.assertEqual(right.last_end(), Timecode(31250))
+        self.assertEqual(json.loads(right.json())['start'], [7000, 16000])
+
+
+class ConcatenateTestCase(unittest.TestCase):
+
+    def test_chains_documents(self):
+        first = SRTDocument([SRTFrame(Timecode(500), Timecode(1000), ['a'])])
+        second = SRTDocument([
+            SRTFrame(Timecode(0), Timecode(3000), ['b']),
+            SRTFrame(Timecode(1000), Timecode(2000), ['c']),
+        ])
+        doc = SRTDocument.concatenate([first, SRTDocument(), second, first])
+        self.assertEqual([(f.start.milliseconds(), f.end.milliseconds(), f.text()) for f in doc.frames], [
+            (500, 1000, 'a'), (1000, 4000, 'b'), (2000, 3000, 'c'), (4000, 4500, 'a'),
+        ])
+
+    def test_lazy(self):
+        consumed = []
+        def documents():
+            for text in 'ab':
+                consumed.append(text)
+                yield SRTDocument([SRTFrame(Timecode(0), Timecode(1000), [text])])
+        frames = iter_concatenated(documents())
+        frames.next()
+        self.assertEqual(consumed, ['a'])
+
+    def test_matches_add(self):
+        doc = parse_srt(StringIO(SAMPLE_SRT))
+        later = doc.shift(40000)
+        self.assertEqual(str(SRTDocument.concatenate([doc, later])), str(doc.add(later)))
+
+    def test_cat_command_non_ascii_sjson(self):
+        directory = tempfile.mkdtemp()
+        try:
+            paths = [os.path.join(directory, name) for name in ('a.srt', 'b.sjson')]
+            for path, text in zip(paths, [SAMPLE_SRT, NON_ASCII_SJSON]):
+                with open(path, 'w') as handle:
+                    handle.write(text)
+            frames = parse_srt(StringIO(run_command_output(command_cat, paths))).frames
+            self.assertEqual([frame.text() for frame in frames[-2:]], ['caf\xc3\xa9', 'na\xc3\xafve'])
+        finally:
+            shutil.rmtree(directory)
+
+
+class StreamingTestCase(unittest.TestCase):
+
+    def test_iter_srt_yields_each_cue(self):
+        handle = StringIO(SAMPLE_SRT)
+        frames = iter_srt(handle)
+        first = frames.next()
+        self.assertEqual(first.lines, ('Test',))
+        # the reader stops right after the first cue's blank line
+        self.assertTrue(handle.tell() < len(SAMPLE_SRT) / 2)
+        self.assertEqual(len(list(frames)), 2)
+
+    def test_iter_srt_last_cue_at_zero(self):
+        frames = list(iter_srt(StringIO("1\n00:00:00,000 --> 00:00:01,000\nhi")))
+        self.assertEqual(len(frames), 1)
+
+    def test_iter_sjson(self):
+        frames = list(iter_sjson(StringIO(SAMPLE_SJSON)))
+        self.assertEqual([f.text() for f in frames], ['Test', 'Lalalala\nSRT files are neat', 'python parsing'])
+
+    def test_stream_parser_chunks(self):
+        text = SAMPLE_SRT.replace('\n', '\r\n') * 3
+        expected = [(f.start, f.end, f.lines) for f in iter_srt(StringIO(text))]
+        rand = random.Random(15)
+        for _ in range(50):
+            parser = SRTStreamParser()
+            frames = []
+            position = 0
+            while position < len(text):
+                size = rand.randint(1, 40)
+                frames.extend(parser.feed(text[position:position + size]))
+                position += size
+            frames.extend(parser.close())
+            self.assertEqual([(f.start, f.end, f.lines) for f in frames], expected)
+
+    def test_stream_parser_emits_early(self):
+        parser = SRTStreamParser()
+        self.assertEqual(parser.feed('1\n00:00:01,000 --> 00:00:02,000\nhel'), [])
+        self.assertEqual(parser.feed('lo\n'), [])
+        frames = parser.feed('\n2\n')
+        self.assertEqual([f.lines for f in frames], [('hello',)])
+        self.assertEqual(parser.close(), [])
+
+    def test_follow_feeds(self):
+        feeds = []
+        for _ in range(5):
+            read_fd, write_fd = os.pipe()
+            feeds.append((os.fdopen(read_fd, 'rb'), write_fd))
+        # everything fits in the pipe buffers, so write it all up front
+        for reader, write_fd in feeds:
+            for position in range(0, len(SAMPLE_SRT), 7):
+                os.write(write_fd, SAMPLE_SRT[position:position + 7])
+            os.close(write_fd)
+
+        seen = {}
+        follow_feeds([reader for reader, write_fd in feeds],
+                     lambda handle, frame: seen.setdefault(handle, []).append(frame.text()))
+        for reader, write_fd in feeds:
+            reader.close()
+            self.assertEqual(seen[reader], ['Test', 'Lalalala\nSRT files are neat', 'python parsing'])
+
+
+
+class BytesParserTestCase(unittest.TestCase):
+
+    def frames(self, data, **kwargs):
+        return [(f.start, f.end, f.lines) for f in iter_srt_bytes(StringIO(data), **kwargs)]
+
+    def test_same_as_parse_srt(self):
+        expected = parse_srt(StringIO(SAMPLE_SRT))
+        self.assertEqual(parse_srt_bytes(StringIO(SAMPLE_SRT)).frames, expected.frames)
+
+    def test_blocks_cut_anywhere(self):
+        text = "\n\n" + SAMPLE_SRT.replace('Test', ' Test  \t') * 3 + "4\n00:00:09,000 --> 00:00:10,000\nend"
+        expected = [(f.start, f.end, f.lines) for f in iter_srt(StringIO(text))]
+        crlf = text.replace('\n', '\r\n')
+        for block_size in (1, 2, 3, 7, 64, 4096):
+            self.assertEqual(self.frames(text, block_size=block_size), expected)
+            self.assertEqual(self.frames(crlf, block_size=block_size), expected)
+        self.assertEqual(self.frames(text.replace('\n', '\r')), expected)
+
+    def test_encodings(self):
+        text = u"1\n00:00:01,000 --> 00:00:02,000\ncaf\xe9 \u2019\n\n2\n00:00:02,000 --> 00:00:03,000\nend\n"
+        expected = [(Timecode(1000), Timecode(2000), (u"caf\xe9 \u2019".encode('utf-8'),)),
+                    (Timecode(2000), Timecode(3000), ('end',))]
+        for data in (text.encode('utf-8'),
+                     codecs.BOM_UTF8 + text.encode('utf-8'),
+                     text.encode('cp1252'),
+                     text.encode('utf-16'),
+                     text.encode('utf-16-le'),
+                     text.encode('utf-16-be'),
+                     text.encode('utf-32')):
+            for block_size in range(1, 40) + [4096]:
+                self.assertEqual(self.frames(data, block_size=block_size), expected)
+
+    def test_late_cp1252(self):
+        # only a late block shows the file isn't utf-8
+        text = u"1\n00:00:01,000 --> 00:00:02,000\n%s\n\n2\n00:00:02,000 --> 00:00:03,000\nna\xefve\n" % ('x' * 100)
+        for block_size in range(1, 40):
+            frames = self.frames(text.encode('cp1252'), block_size=block_size)
+            self.assertEqual(frames[1][2], (u"na\xefve".encode('utf-8'),))
+        # and one just before the end of the file
+        for block_size in range(1, 40):
+            frames = self.frames("1\n00:00:01,000 --> 00:00:02,000\nx\xe9\n", block_size=block_size)
+            self.assertEqual(frames[0][2], (u"x\xe9".encode('utf-8'),))
+
+    def test_detect_encoding(self):
+        self.assertEqual(detect_encoding(codecs.BOM_UTF8 + 'x'), ('utf-8', 3))
+        self.assertEqual(detect_encoding(codecs.BOM_UTF16_LE + 'x\x00'), ('utf-16-le', 2))
+        self.assertEqual(detect_encoding('1\x00\n\x00'), ('utf-16-le', 0))
+        self.assertEqual(detect_encoding('caf\xc3'), ('utf-8', 0))
+        self.assertEqual(detect_encoding('caf\xe9!'), ('cp1252', 0))
+
+    def test_parse_reads_bytes(self):
+        path = tempfile.mktemp(suffix='.srt')
+        try:
+            with open(path, 'wb') as fh:
+                fh.write(codecs.BOM_UTF8 + SAMPLE_SRT.replace('\n', '\r\n'))
+            self.assertEqual(parse(path).frames, parse_srt(StringIO(SAMPLE_SRT)).frames)
+        finally:
+            os.remove(path)
+
+
+class WriterTestCase(unittest.TestCase):
+
+    def test_write_srt(self):
+        out = StringIO()
+        write_srt(iter_srt(StringIO(SAMPLE_SRT)), out)
+        self.assertEqual(out.getvalue(), SAMPLE_SRT)
+        self.assertEqual(str(parse_srt(StringIO(SAMPLE_SRT))), SAMPLE_SRT)
+
+    def test_write_sjson(self):
+        expected = json.loads(SAMPLE_SJSON)
+        doc = parse_srt(StringIO(SAMPLE_SRT))
+        self.assertEqual(json.loads(doc.json()), expected)
+
+        # one-shot iterators are spooled
+        out = StringIO()
+        write_sjson(iter_srt(StringIO(SAMPLE_SRT)), out)
+        self.assertEqual(json.loads(out.getvalue()), expected)
+
+    def test_write_sjson_compact(self):
+        doc = parse_srt(StringIO(SAMPLE_SRT))
+        compact_doc = CompactSRTDocument.from_document(doc)
+        outputs = [doc.json(compact=True), compact_doc.json(compact=True)]
+        for frames in (doc.frames, iter(doc.frames)):
+            out = StringIO()
+            write_sjson(frames, out, compact=True)
+            outputs.append(out.getvalue())
+
+        self.assertEqual(len(set(outputs)), 1)
+        self.assertEqual(json.loads(outputs[0]), json.loads(SAMPLE_SJSON))
+        self.assertNotIn(' ', outputs[0].replace('SRT files are neat', '').replace('python parsing', ''))
+        self.assertEqual(compact_doc.json(), doc.json())
+
+    def test_write_sjson_empty(self):
+        for frames in ([], iter([])):
+            out = StringIO()
+            write_sjson(frames, out)
+            self.assertEqual(json.loads(out.getvalue()), {'start': [], 'end': [], 'text': []})
+
+
+class MappedSRTFileTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'big.srt')
+        frames = [SRTFrame(Timecode(index * 1000), Timecode(index * 1000 + 800), ['cue %d' % index, 'x'])
+                  for index in range(200)]
+        frames.append(SRTFrame(Timecode(50500), Timecode(60000), ['overlap']))
+        self.doc = SRTDocument(frames)
+        with open(self.path, 'w') as handle:
+            handle.write(str(self.doc))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_queries(self):
+        with MappedSRTFile(self.path) as mapped:
+            self.assertEqual(len(mapped), 201)
+            self.assertEqual(str(mapped.document()), str(self.doc))
+            self.assertEqual([f.text() for f in mapped.frames_active_at(51200)], ['overlap', 'cue 51\nx'])
+            self.assertEqual([str(f) for f in mapped.frames_between(3000, 5000)],
+                             [str(f) for f in self.doc.frames_between(3000, 5000)])
+
+    def test_slice(self):
+        with MappedSRTFile(self.path) as mapped:
+            for start, end in [(0, 5000), (3500, 3900), (50900, 58850), (190000, 300000), (300000, 400000)]:
+                expected = self.doc.split(Timecode(start))[1].split(Timecode(end))[0]
+                self.assertEqual(str(mapped.slice(start, end)), str(expected), (start, end))
+
+    def test_index_is_reused(self):
+        MappedSRTFile(self.path).close()
+        self.assertTrue(os.path.exists(self.path + '.idx'))
+        scans = []
+        scan = MappedSRTFile._scan
+        MappedSRTFile._scan = lambda mapped: scans.append(mapped) or scan(mapped)
+        try:
+            with MappedSRTFile(self.path) as mapped:
+                self.assertEqual(len(mapped), 201)
+            self.assertEqual(scans, [])
+            # and the counting does see a scan without the index
+            with MappedSRTFile(self.path, persist_index=False, index_path=self.path + '.none') as mapped:
+                self.assertEqual(len(mapped), 201)
+            self.assertEqual(len(scans), 1)
+        finally:
+            MappedSRTFile._scan = scan
+
+    def test_stale_index_is_rebuilt(self):
+        MappedSRTFile(self.path).close()
+        with open(self.path, 'a') as handle:
+            handle.write("202\n00:10:00,000 --> 00:10:01,000\nlast\n")
+        with MappedSRTFile(self.path) as mapped:
+            self.assertEqual(len(mapped), 202)
+            self.assertEqual(mapped.frame(201).lines, ('last',))
+
+    def test_empty_file(self):
+        open(self.path, 'w').close()
+        with MappedSRTFile(self.path, persist_index=False) as mapped:
+            self.assertEqual(len(mapped), 0)
+            self.assertEqual(len(mapped.slice(0, 1000).frames), 0)
+
+
+class BinaryFormatTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.doc = parse_srt(StringIO(SAMPLE_SRT))
+
+    def round_trip(self, frames):
+        out = StringIO()
+        write_bin(frames, out)
+        return parse_bin(StringIO(out.getvalue()))
+
+    def test_round_trip(self):
+        loaded = self.round_trip(self.doc.frames)
+        self.assertTrue(isinstance(loaded, CompactSRTDocument))
+        self.assertEqual(str(loaded), str(self.doc))
+
+        # straight from the arrays of a compact document
+        again = self.round_trip(loaded.split(Timecode(7000))[1].frames)
+        self.assertEqual(str(again), str(self.doc.split(Timecode(7000))[1]))
+
+    def test_empty(self):
+        self.assertEqual(len(self.round_trip([]).frames), 0)
+
+    def test_non_ascii_sjson(self):
+        sjson = json.dumps({'start': [0, 1000], 'end': [500, 1500], 'text': [u'caf\xe9', u'na\xefve \u2019']})
+        expected = [u'caf\xe9'.encode('utf-8'), u'na\xefve \u2019'.encode('utf-8')]
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'a.sbin')
+            for compact in (False, True):
+                with open(path, 'wb') as handle:
+                    write_bin(parse_sjson(StringIO(sjson), compact=compact).frames, handle)
+                loaded = parse(path)
+                self.assertEqual([frame.text() for frame in loaded.frames], expected)
+                self.assertEqual([frame.end.milliseconds() for frame in loaded.frames], [500, 1500])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_layout(self):
+        out = StringIO()
+        write_bin(self.doc.frames, out)
+        data = out.getvalue()
+        self.assertEqual(data[:4], 'SRTB')
+        # header, 3 * 3 + 1 int64s, then the text
+        self.assertEqual(len(data), 24 + 10 * 8 + len('TestLalalala\nSRT files are neatpython parsing'))
+
+    def test_rejects_bad_files(self):
+        out = StringIO()
+        write_bin(self.doc.frames, out)
+        data = out.getvalue()
+        for bad in ['', 'XXXX' + data[4:], data[:-1], data[:4] + '\x02' + data[5:]]:
+            self.assertRaises(ValueError, parse_bin, StringIO(bad))
+
+    def test_parse(self):
+        self.assertEqual(get_file_type('a.sbin'), 'bin')
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'a.sbin')
+            with open(path, 'wb') as handle:
+                write_bin(self.doc.frames, handle)
+            self.assertEqual(str(parse(path)), str(self.doc))
+        finally:
+            shutil.rmtree(directory)
+
+
+class StatsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'a.srt')
+        with open(self.path, 'w') as handle:
+            handle.write(SAMPLE_SRT)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_library_phases(self):
+        with Stats() as stats:
+            doc = parse(self.path)
+            with phase('edit'):
+                doc = doc.shift(100)
+            write_srt(doc.frames, StringIO())
+        self.assertEqual([name for name, seconds, objects in stats.phases], ['parse', 'edit', 'write'])
+        self.assertEqual(stats.counters, {'cues read': 3, 'cues written': 3})
+        self.assertTrue(stats.phases[0][2] > 0)
+        self.assertEqual(json.loads(stats.json())['totals']['write']['count'], 1)
+
+    def test_inactive(self):
+        with Stats() as outer:
+            with Stats(count_objects=False) as inner:
+                add_count('x')
+            add_count('y', 2)
+        add_count('z')
+        with phase('nothing'):
+            pass
+        self.assertEqual(inner.counters, {'x': 1})
+        self.assertEqual(outer.counters, {'y': 2})
+
+    def test_per_thread(self):
+        thread = threading.Thread(target=add_count, args=('other thread',))
+        with Stats(count_objects=False) as stats:
+            thread.start()
+            thread.join()
+            add_count('this thread')
+        self.assertEqual(stats.counters, {'this thread': 1})
+
+    def test_run_command(self):
+        stats_path = os.path.join(self.directory, 'stats.json')
+        profile_path = os.path.join(self.directory, 'delete.prof')
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            run_command(command_delete, [self.path, '5', '15'], profile_path, stats_path)
+        finally:
+            sys.stdout = stdout
+        with open(stats_path) as handle:
+            stats = json.load(handle)
+        self.assertEqual(sorted(stats['totals']), ['edit', 'parse', 'write'])
+        self.assertEqual(stats['counters'], {'cues read': 3, 'cues written': 2})
+        self.assertTrue(os.path.getsize(profile_path) > 0)
+
+
+class RetimeTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.doc = parse_srt(StringIO(SAMPLE_SRT))
+
+    def times(self, doc):
+        return [(f.start.milliseconds(), f.end.milliseconds()) for f in doc.frames]
+
+    def test_maps(self):
+        self.assertEqual(TimeMap.shift(-500)(1000), 500)
+        self.assertEqual(TimeMap.scale(2, origin=1000)(1500), 2000)
+        self.assertEqual(TimeMap.framerate(25, 50)(1001), 501)
+        self.assertEqual(TimeMap.framerate(23.976, 25)(60000), 57542)
+
+        piecewise = TimeMap.piecewise([(10000, 20000), (0, 0)])
+        # inside, then extrapolated off either end
+        self.assertEqual([piecewise(t) for t in (5000, -1000, 11000)], [10000, -2000, 22000])
+        self.assertEqual(TimeMap.piecewise([(1000, 3000)])(0), 2000)
+
+    def test_invalid_maps(self):
+        self.assertRaises(ValueError, TimeMap.scale, 0)
+        self.assertRaises(ValueError, TimeMap.framerate, 25, -1)
+        self.assertRaises(ValueError, TimeMap.piecewise, [])
+        self.assertRaises(ValueError, TimeMap.piecewise, [(0, 0), (0, 5)])
+        self.assertRaises(ValueError, TimeMap.piecewise, [(0, 10), (10, 0)])
+
+    def test_retime_documents(self):
+        maps = [TimeMap.shift(1000), TimeMap.piecewise([(0, 0), (10000, 5000), (20000, 25000)])]
+        expected = [(500, 3250), (3250, 17000), (17000, 47500)]
+        self.assertEqual(self.times(self.doc.retime(*maps)), expected)
+
+        compact = CompactSRTDocument.from_document(self.doc).retime(*maps)
+        self.assertEqual(self.times(compact), expected)
+        self.assertEqual(compact.frames[1].lines, self.doc.frames[1].lines)
+
+    def test_column_matches_scalar(self):
+        time_map = TimeMap.piecewise([(0, 0), (333, 1000), (1000, 1001)])
+        values = range(-500, 1500, 7)
+        column = retime_column(array(CompactSRTDocument.TIME_TYPECODE, values), [time_map])
+        self.assertEqual(list(column), [time_map(value) for value in values])
+
+
+class DocumentCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.paths = []
+        for index in range(3):
+            path = os.path.join(self.directory, '%d.srt' % index)
+            with open(path, 'w') as handle:
+                handle.write(SAMPLE_SRT.replace('Test', 'Test %d' % index))
+            self.paths.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_hits_and_misses(self):
+        cache = DocumentCache()
+        first = cache.parse(self.paths[0])
+        self.assertTrue(isinstance(first, CompactSRTDocument))
+        self.assertIs(cache.parse(self.paths[0]), first)
+        self.assertEqual(first.frames[0].lines, ('Test 0',))
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['bytes']), (1, 1, document_bytes(first)))
+
+    def test_byte_budget(self):
+        size = document_bytes(DocumentCache().parse(self.paths[0]))
+        cache = DocumentCache(max_bytes=size * 2 + 1)
+        for path in self.paths + self.paths[-1:]:
+            cache.parse(path)
+        self.assertEqual((len(cache), cache.evictions, cache.hits), (2, 1, 1))
+        self.assertTrue(cache.bytes <= cache.max_bytes)
+
+        # documents over the budget are parsed, but not kept
+        cache = DocumentCache(max_bytes=1)
+        cache.parse(self.paths[0])
+        self.assertEqual((len(cache), cache.bytes), (0, 0))
+
+    def test_changed_file(self):
+        cache = DocumentCache()
+        cache.parse(self.paths[0])
+        with open(self.paths[0], 'a') as handle:
+            handle.write('4\n00:01:00,000 --> 00:01:01,000\nmore\n')
+        self.assertEqual(len(cache.parse(self.paths[0]).frames), 4)
+        self.assertEqual(cache.misses, 2)
+
+    def test_content_key(self):
+        cache = DocumentCache(key='content')
+        copy = os.path.join(self.directory, 'copy.srt')
+        shutil.copy(self.paths[1], copy)
+        self.assertIs(cache.parse(copy), cache.parse(self.paths[1]))
+        self.assertRaises(ValueError, DocumentCache, key='name')
+
+    def test_store(self):
+        store = os.path.join(self.directory, 'store')
+        expected = str(DocumentCache(store_directory=store).parse(self.paths[2]))
+
+        cache = DocumentCache(store_directory=store)
+        self.assertEqual(str(cache.parse(self.paths[2])), expected)
+        self.assertEqual((cache.misses, cache.store_hits), (1, 1))
+
+        # a damaged store entry is parsed again
+        for name in os.listdir(store):
+            with open(os.path.join(store, name), 'wb') as handle:
+                handle.write('junk')
+        cache = DocumentCache(store_directory=store)
+        self.assertEqual(str(cache.parse(self.paths[2])), expected)
+        self.assertEqual(cache.store_hits, 0)
+
+
+class ServerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'a.srt')
+        with open(self.path, 'w') as handle:
+            handle.write(SAMPLE_SRT)
+        self.address = os.path.join(self.directory, 'srt.sock')
+        self.cache = DocumentCache()
+        self.server = make_server(self.address)
+        self.thread = threading.Thread(target=serve, args=(self.server, self.cache))
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+        shutil.rmtree(self.directory)
+
+    def run_command(self, command, *args, **kwargs):
+        out = StringIO()
+        err = StringIO()
+        status = srt_client.run(command, list(args), self.address, stdout=out, stderr=err, **kwargs)
+        return status, out.getvalue(), err.getvalue()
+
+    def test_commands(self):
+        status, out, err = self.run_command('delete', self.path, '5', '15')
+        self.assertEqual((status, err), (0, ''))
+        self.assertEqual(len(parse_srt(StringIO(out)).frames), 2)
+
+        # the second time, the document comes from the cache
+        self.assertEqual(self.run_command('srt2sjson', self.path)[1], parse_srt(StringIO(SAMPLE_SRT)).json())
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+        status, out, err = self.run_command('sjson2srt', '-', stdin=StringIO(SAMPLE_SJSON))
+        self.assertEqual(out, SAMPLE_SRT)
+
+    def test_errors(self):
+        status, out, err = self.run_command('nothing')
+        self.assertEqual((status, out), (1, ''))
+        self.assertIn('nothing', err)
+        self.assertEqual(self.run_command('delete')[0], 1)
+        self.assertEqual(self.run_command('serve')[0], 1)
+
+    def test_exit_status(self):
+        bad = os.path.join(self.directory, 'bad.srt')
+        with open(bad, 'w') as handle:
+            handle.write("1\nnot a time\nhi\n")
+        stderr = sys.stderr
+        sys.stderr = StringIO()
+        try:
+            status, out, err = self.run_command('batch', '--workers', '1', 'delete', bad, '5', '15')
+        finally:
+            sys.stderr = stderr
+        self.assertEqual(status, 1)
+        self.assertEqual(self.run_command('nothing')[0], 1)
+
+    def test_binary_stdin(self):
+        # 255ms packs to a \xff byte, which isn't utf-8
+        doc = SRTDocument([SRTFrame(Timecode(255), Timecode(1255), ['hi'])])
+        data = StringIO()
+        write_bin(doc.frames, data)
+        status, out, err = self.run_command('bin2srt', '-', stdin=StringIO(data.getvalue()))
+        self.assertEqual((status, err), (0, ''))
+        self.assertEqual(out, str(doc))
+
+    def test_bad_requests(self):
+        stderr = sys.stderr
+        sys.stderr = StringIO()
+        try:
+            replies = []
+            for request in ['', 'not json\n', '[1]\n', '{"command": "cat", "args": [], "stdin": true}\n']:
+                connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                connection.connect(self.address)
+                connection.sendall(request)
+                connection.shutdown(socket.SHUT_WR)
+                replies.append(connection.makefile('rb').read())
+                connection.close()
+            # the server is still fine, and printed no tracebacks
+            self.assertEqual(self.run_command('delete', self.path, '5', '15')[0], 0)
+            self.assertEqual(sys.stderr.getvalue(), '')
+        finally:
+            sys.stderr = stderr
+        self.assertEqual(replies[0], '')
+        for reply in replies[1:]:
+            self.assertEqual(reply[0], 'e')
+            self.assertTrue(reply.endswith(srt_client.SERVER_FRAME.pack('x', 1)))
+
+    def test_address_in_use(self):
+        # a running server's socket and a regular file are left alone
+        self.assertRaises(IOError, make_server, self.address)
+        self.assertEqual(self.run_command('delete', self.path, '5', '15')[0], 0)
+        self.assertRaises(IOError, make_server, self.path)
+        self.assertEqual(open(self.path).read(), SAMPLE_SRT)
+
+        # but the socket of a server that died is replaced
+        stale = os.path.join(self.directory, 'stale.sock')
+        dead = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        dead.bind(stale)
+        dead.close()
+        make_server(stale).server_close()
+
+    def test_concurrent(self):
+        results = []
+        def client():
+            results.append(self.run_command('delete', self.path, '5', '15'))
+        clients = [threading.Thread(target=client) for _ in range(8)]
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        self.assertEqual(len(set(results)), 1)
+        self.assertEqual(results[0][0], 0)
+
+    def test_concurrent_inputs(self):
+        # different files and times, so the threads churn the shared timecode cache
+        requests = []
+        for index in range(8):
+            path = os.path.join(self.directory, '%d.srt' % index)
+            with open(path, 'w') as handle:
+                handle.write(str(SRTDocument([
+                    SRTFrame(Timecode(cue * 1000 + index), Timecode(cue * 1000 + 700 + index), ['cue %d' % cue])
+                    for cue in range(1000)])))
+            requests.append(('delete', path, str(Timecode(100000 + index * 7)), str(Timecode(300000 + index * 11))))
+            requests.append(('srt2sjson', '--stream', path))
+        expected = [self.run_command(*request) for request in requests]
+
+        results = {}
+        def client(index):
+            results[index] = self.run_command(*requests[index])
+        interval = sys.getcheckinterval()
+        sys.setcheckinterval(1)
+        try:
+            clients = [threading.Thread(target=client, args=(index,)) for index in range(len(requests))]
+            for thread in clients:
+                thread.start()
+            for thread in clients:
+                thread.join()
+        finally:
+            sys.setcheckinterval(interval)
+        self.assertEqual([results[index] for index in range(len(requests))], expected)
+        self.assertEqual(set(status for status, out, err in expected), set([0]))
+
+
+class EditListTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # back to back cues, so cuts never fall in a gap
+        self.doc = SRTDocument([SRTFrame(Timecode(index * 1000), Timecode(index * 1000 + 1000), ['cue %d' % index])
+                                for index in range(1, 30)])
+
+    def times(self, doc):
+        return [(f.start.milliseconds(), f.end.milliseconds(), f.lines) for f in doc.frames]
+
+    def delete_command(self, start, end, doc=None):
+        directory = tempfile.mkdtemp()
+        stdout = sys.stdout
+        try:
+            path = os.path.join(directory, 'a.srt')
+            with open(path, 'w') as handle:
+                handle.write(str(doc or self.doc))
+            sys.stdout = StringIO()
+            return command_delete([path, str(Timecode(start)), str(Timecode(end))])
+        finally:
+            sys.stdout = stdout
+            shutil.rmtree(directory)
+
+    def test_delete_matches_command(self):
+        rand = random.Random(22)
+        for _ in range(20):
+            start = rand.randint(1000, 29000)
+            end = rand.randint(start, 30000)
+            self.assertEqual(self.times(EditList().delete(start, end).apply(self.doc)),
+                             self.times(self.delete_command(start, end)), (start, end))
+
+    def test_many_deletes(self):
+        edits = EditList()
+        expected = self.doc
+        # the same cuts, from the last one, so earlier times don't move
+        for start in range(25000, 2000, -4000):
+            edits.delete(start + 500, start + 1500)
+            expected = self.delete_command(start + 500, start + 1500, expected)
+        self.assertEqual(self.times(edits.apply(self.doc)), self.times(expected))
+        self.assertEqual(self.times(edits.apply(CompactSRTDocument.from_document(self.doc))), self.times(expected))
+
+    def test_keep_shift_gap(self):
+        result = EditList().keep(3000, 5500).keep(10000, 11000).apply(self.doc)
+        self.assertEqual(self.times(result), [
+            (1000, 2000, ('cue 3',)), (2000, 3000, ('cue 4',)), (3000, 3500, ('cue 5',)),
+            (3500, 4500, ('cue 10',)),
+        ])
+
+        result = EditList().shift(5000, 7000, 300).gap(20500, 2000).apply(self.doc)
+        self.assertEqual(self.times(result)[3:7], [
+            (4000, 5000, ('cue 4',)), (5300, 6300, ('cue 5',)), (6300, 7300, ('cue 6',)), (7000, 8000, ('cue 7',)),
+        ])
+        self.assertEqual(self.times(result)[19:21], [(20000, 20500, ('cue 20',)), (22500, 23000, ('cue 20',))])
+
+        # the first cue never moves
+        result = EditList().shift(0, 5000, -700).apply(self.doc)
+        self.assertEqual(result.frames[0].start, Timecode(1000))
+
+    def test_from_lines(self):
+        edits = EditList.from_lines(['# ads', 'delete 00:00:03,000 00:00:04,000', '', 'gap 10 1  # wait'])
+        self.assertEqual(edits.operations, [('delete', 3000, 4000), ('gap', 10000, 1000)])
+        for bad in ['remove 1 2', 'delete 1', 'delete 2 1', 'gap 1 -1', 'shift 1 2']:
+            self.assertRaises(ValueError, EditList.from_lines, [bad])
+
+    def test_no_edits(self):
+        self.assertEqual(self.times(EditList().apply(self.doc)), self.times(self.doc))
+        self.assertEqual(EditList().delete(0, 100).apply(SRTDocument()).frames, [])
+
+
+class MergeTestCase(unittest.TestCase):
+
+    def random_frames(self, rand, count, name):
+        return [SRTFrame(Timecode(start), Timecode(start + rand.randint(0, 3000)), ['%s %d' % (name, index)])
+                for index, start in enumerate(rand.randint(0, 20000) for _ in range(count))]
+
+    def key(self, frames):
+        return [(f.start, f.end, f.lines) for f in frames]
+
+    def test_iter_merged(self):
+        rand = random.Random(23)
+        tracks = [sorted(self.random_frames(rand, count, name), key=lambda f: f.start.milliseconds())
+                  for count, name in [(50, 'dialogue'), (0, 'empty'), (30, 'sdh'), (5, 'forced')]]
+        # sorted is stable, so ties keep track order
+        expected = sorted(sum(tracks, []), key=lambda f: f.start.milliseconds())
+        self.assertEqual(self.key(iter_merged(*[iter(track) for track in tracks])), self.key(expected))
+
+        merged = SRTDocument.merge([SRTDocument(track) for track in tracks])
+        self.assertEqual(self.key(merged.frames), self.key(expected))
+
+    def test_iter_sorted(self):
+        rand = random.Random(24)
+        frames = self.random_frames(rand, 500, 'cue')
+        frames.append(SRTFrame(Timecode(0), Timecode(1), [u'unicode \xe9', '']))
+        expected = self.key(sorted(frames, key=lambda f: f.start.milliseconds()))
+        for max_frames in (7, 100, 501, 1000):
+            self.assertEqual(self.key(iter_sorted(iter(frames), max_frames)), expected, max_frames)
+        self.assertEqual(list(iter_sorted([], 3)), [])
+
+    def test_iter_checked(self):
+        frames = [SRTFrame(Timecode(1000), Timecode(2000)), SRTFrame(Timecode(500), Timecode(600))]
+        self.assertRaises(ValueError, list, iter_checked(frames))
+        self.assertEqual(len(list(iter_checked(frames[:1]))), 1)
+
+    def test_iter_frames(self):
+        directory = tempfile.mkdtemp()
+        try:
+            expected = self.key(parse_srt(StringIO(SAMPLE_SRT)).frames)
+            for name, text in [('a.srt', SAMPLE_SRT), ('a.sjson', SAMPLE_SJSON)]:
+                path = os.path.join(directory, name)
+                with open(path, 'w') as handle:
+                    handle.write(text)
+                self.assertEqual(self.key(iter_frames(path)), expected)
+
+                if os.path.isdir('/proc/self/fd'):
+                    # the file is closed once the frames run out, not when the generator is collected
+                    before = len(os.listdir('/proc/self/fd'))
+                    frames = iter_frames(path)
+                    frames.next()
+                    self.assertEqual(len(os.listdir('/proc/self/fd')), before + 1)
+                    list(frames)
+                    self.assertEqual(len(os.listdir('/proc/self/fd')), before)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_merge_command_non_ascii_sjson(self):
+        directory = tempfile.mkdtemp()
+        try:
+            paths = [os.path.join(directory, name) for name in ('a.srt', 'b.sjson')]
+            for path, text in zip(paths, [SAMPLE_SRT, NON_ASCII_SJSON]):
+                with open(path, 'w') as handle:
+                    handle.write(text)
+            for args in ([], ['--unsorted']):
+                frames = parse_srt(StringIO(run_command_output(command_merge, args + paths))).frames
+                self.assertEqual([frame.text() for frame in frames],
+                                 ['Test', 'caf\xc3\xa9', 'na\xc3\xafve', 'Lalalala\nSRT files are neat', 'python parsing'])
+        finally:
+            shutil.rmtree(directory)
+
+
+class SubtitleIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.paths = [self.write('a.srt', SAMPLE_SRT),
+                      self.write('b.sjson', u'{"start": [1000, 0], "end": [2000, 500], '
+                                            u'"text": ["Caf\\u00e9 files are NEAT", "neat python"]}')]
+        self.index = SubtitleIndex(os.path.join(self.directory, 'index.db'))
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.directory)
+
+    def write(self, name, text):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as handle:
+            handle.write(text)
+        return path
+
+    def found(self, *args, **kwargs):
+        return [(os.path.basename(hit.path), hit.cue, hit.start, hit.end)
+                for hit in self.index.search(*args, **kwargs)]
+
+    def test_tokenize(self):
+        self.assertEqual(tokenize('Hello, World!\nCaf\xc3\xa9'), [u'hello', u'world', u'caf\xe9'])
+
+    def test_search(self):
+        summary = self.index.update(self.paths, workers=2)
+        self.assertEqual((summary['indexed'], summary['errors']), (2, []))
+
+        self.assertEqual(self.found('files are neat'), [('a.srt', 1, 5500, 15000), ('b.sjson', 1, 1000, 2000)])
+        self.assertEqual(self.found('NEAT'), [('a.srt', 1, 5500, 15000), ('b.sjson', 0, 0, 500), ('b.sjson', 1, 1000, 2000)])
+        self.assertEqual(self.found(u'caf\xe9'), [('b.sjson', 1, 1000, 2000)])
+        self.assertEqual(self.found('neat files'), [])
+        self.assertEqual(self.found('python pars'), [])
+        self.assertEqual(self.found('python pars', prefix=True), [('a.srt', 2, 15000, 30250)])
+        self.assertEqual(self.found('ne', prefix=True, limit=1), [('a.srt', 1, 5500, 15000)])
+        self.assertEqual(self.found('...'), [])
+        self.assertEqual(self.index.search('lalalala')[0].text, u'Lalalala\nSRT files are neat')
+
+    def test_incremental(self):
+        self.index.update(self.paths, workers=1)
+        self.assertEqual(self.index.update(self.paths, workers=1)['unchanged'], 2)
+
+        self.write('a.srt', SAMPLE_SRT.replace('python parsing', 'something new, and longer'))
+        summary = self.index.update(self.paths, workers=1)
+        self.assertEqual((summary['indexed'], summary['unchanged']), (1, 1))
+        self.assertEqual(self.found('python'), [('b.sjson', 0, 0, 500)])
+        self.assertEqual(len(self.found('something new')), 1)
+
+        os.remove(self.paths[1])
+        self.assertEqual(self.index.prune(), [os.path.abspath(self.paths[1])])
+        self.assertEqual(self.found('python'), [])
+        self.assertEqual(len(self.index), 1)
+
+    def test_errors(self):
+        broken = self.write('broken.sjson', '{"start": [1]}')
+        summary = self.index.update([broken, os.path.join(self.directory, 'missing.srt')], workers=1)
+        self.assertEqual(summary['indexed'], 0)
+        self.assertEqual(len(summary['errors']), 2)
+
+
+class BatchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.paths = []
+        for index in range(3):
+            path = os.path.join(self.directory, '%d.srt' % index)
+            with open(path, 'w') as handle:
+                handle.write(SAMPLE_SRT)
+            self.paths.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_srt2sjson(self):
+        for workers in (1, 2):
+            results = sorted(run_batch('srt2sjson', self.paths, workers=workers, overwrite=True))
+            self.assertEqual(results, [(path, None) for path in self.paths])
+            for path in self.paths:
+                with open(path[:-4] + '.sjson') as handle:
+                    self.assertEqual(json.load(handle), json.loads(SAMPLE_SJSON))
+
+    def test_existing_outputs(self):
+        # x.sjson next to x.srt: sjson2srt would write over the source
+        sjson = self.paths[0][:-4] + '.sjson'
+        with open(sjson, 'w') as handle:
+            handle.write(SAMPLE_SJSON.replace('Test', 'Other'))
+        results = list(run_batch('sjson2srt', [sjson], workers=1))
+        self.assertIn('exists', results[0][1])
+        with open(self.paths[0]) as handle:
+            self.assertEqual(handle.read(), SAMPLE_SRT)
+
+        self.assertEqual(list(run_batch('sjson2srt', [sjson], workers=1, overwrite=True)), [(sjson, None)])
+        with open(self.paths[0]) as handle:
+            self.assertEqual(parse_srt(handle).frames[0].lines, ('Other',))
+
+    def test_operation_args(self):
+        list(run_batch('delete', self.paths[:1], ['start', '00:00:05,500'], workers=1))
+        with open(self.paths[0][:-4] + '.deleted.srt') as handle:
+            self.assertEqual(len(parse_srt(handle).frames), 2)
+
+    def test_errors_are_reported(self):
+        missing = os.path.join(self.directory, 'missing.srt')
+        results = dict(run_batch('srt2sjson', self.paths + [missing], workers=2))
+        self.assertTrue(results[missing].startswith('IOError'))
+        self.assertFalse(os.path.exists(missing[:-4] + '.sjson'))
+        self.assertEqual(results[self.paths[0]], None)
+
+    def test_inputs(self):
+        self.assertEqual(batch_inputs(os.path.join(self.directory, '*.srt')), self.paths)
+        manifest = os.path.join(self.directory, 'manifest')
+        with open(manifest, 'w') as handle:
+            handle.write('\n'.join(self.paths[:2]) + '\n\n')
+        self.assertEqual(batch_inputs('@' + manifest), self.paths[:2])
 
 
 if __name__ == "__main__":